@@ -0,0 +1,98 @@
+"""
+Local stand-in for the OCR.space parse/image endpoint, for offline tests and load tests of photo import.
+
+    python bench/fake_ocr_server.py [--port 8089] [--latency 0.8] [--fail-rate 0.1]
+    OCR_SPACE_URL=http://127.0.0.1:8089/parse/image OCR_SPACE_API_KEY=fake python main.py
+
+Answers with the same JSON shape as OCR.space ("ParsedResults": [{"ParsedText": ...}]).
+The "image" decides the text: an upload that starts with FAKEOCR_MAGIC is echoed back after the marker,
+anything else gets DEFAULT_TEXT. --latency simulates the provider's think time, --fail-rate answers
+that share of requests with HTTP 500 so client retries get exercised.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKEOCR_MAGIC = b"FAKEOCR\n"
+
+# Column-split table as OCR.space returns it for a productivity screenshot.
+DEFAULT_TEXT = "\n".join([
+    "SAP", "51010777", "51011125", "51011091", "51010373",
+    "Wydajnosc", "156,44%", "135,68%", "98,10%", "121,00%",
+])
+
+
+def fake_image(text: str) -> bytes:
+    """Bytes to upload instead of a photo so the server answers with `text`."""
+    return FAKEOCR_MAGIC + text.encode("utf-8")
+
+
+def uploaded_file(headers, body: bytes) -> bytes:
+    head = f"Content-Type: {headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1")
+    msg = BytesParser(policy=HTTP).parsebytes(head + body)
+    if not msg.is_multipart():
+        return b""
+    for part in msg.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True) or b""
+    return b""
+
+
+class FakeOcrHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    served = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.send_response(500)
+            self.end_headers()
+            return
+        image = uploaded_file(self.headers, body)
+        text = image[len(FAKEOCR_MAGIC):].decode("utf-8") if image.startswith(FAKEOCR_MAGIC) else DEFAULT_TEXT
+        payload = json.dumps({
+            "ParsedResults": [{"ParsedText": text, "FileParseExitCode": 1}],
+            "OCRExitCode": 1,
+            "IsErroredOnProcessing": False,
+        }).encode("utf-8")
+        FakeOcrHandler.served += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_ocr_server(port: int = 0, latency: float = 0.0, fail_rate: float = 0.0):
+    """Serve in a daemon thread; returns (server, url). Port 0 picks a free one."""
+    FakeOcrHandler.latency = latency
+    FakeOcrHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOcrHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/parse/image"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    server, url = start_fake_ocr_server(args.port, args.latency, args.fail_rate)
+    print(f"fake OCR.space at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,118 @@
+"""
+Load test of photo import without network or Telegram: on_photo -> OCR -> preview -> "✅ Зберегти OCR".
+
+    python bench/ocr_load.py [users] [ocr_latency_sec] [fail_rate]
+
+Starts bench/fake_ocr_server.py in-process, points OCR_SPACE_URL at it and drives the real handlers
+with minimal Update/Context stand-ins, `users` shift leads at once, each importing one photo for
+the same date. Prints pipeline latency percentiles, throughput and the I/O pool counters.
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_ocr_server import FakeOcrHandler, fake_image, start_fake_ocr_server  # noqa: E402
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+FAIL_RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+server, url = start_fake_ocr_server(latency=LATENCY, fail_rate=FAIL_RATE)
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="locker-ocr-load-"))
+os.environ.setdefault("PORT", "0")
+os.environ["OCR_SPACE_URL"] = url
+os.environ["OCR_SPACE_API_KEY"] = "fake"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+DATE = "16.10.2026"
+
+
+class FakeFile:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def download_as_bytearray(self):
+        return bytearray(self.data)
+
+
+class FakePhoto:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.file_unique_id = hashlib.md5(data).hexdigest()[:16]
+
+    async def get_file(self):
+        return FakeFile(self.data)
+
+
+class FakeMessage:
+    def __init__(self, replies: list, text: str = None, photo: bytes = None):
+        self.text = text
+        self.photo = [FakePhoto(photo)] if photo is not None else []
+        self.media_group_id = None
+        self.replies = replies
+
+    async def reply_text(self, text, reply_markup=None):
+        self.replies.append(text)
+
+
+def fake_update(chat_id: int, replies: list, **kw):
+    return SimpleNamespace(message=FakeMessage(replies, **kw), effective_chat=SimpleNamespace(id=chat_id))
+
+
+def photo_text(workers: list, user: int) -> str:
+    """Column-split OCR dump: SAP column, then percent column."""
+    saps = [w["sap"] for w in workers]
+    pcts = [f"{90 + (user * 7 + i) % 70},{i % 100:02d}%" for i in range(len(workers))]
+    return "\n".join(["SAP"] + saps + ["Wydajnosc"] + pcts)
+
+
+async def one_user(user: int, workers: list):
+    """Seconds from photo to saved, or None if the import failed (reply printed)."""
+    replies = []
+    context = SimpleNamespace(user_data={"mode": "import_photo_wait_photo", "tmp": {"date": DATE}, "menu": "work"}, bot=None)
+    started = time.perf_counter()
+    await main.on_photo(fake_update(user, replies, photo=fake_image(photo_text(workers, user))), context)
+    if context.user_data.get("mode") != "ocr_preview_wait_confirm":
+        print(f"user {user}: no preview: {replies[-1].splitlines()[0] if replies else ''}")
+        return None
+    await main.on_text(fake_update(user, replies, text=main.BTN_CONFIRM_SAVE_IMPORT), context)
+    if not replies[-1].startswith("✅ OCR збережено"):
+        print(f"user {user}: not saved: {replies[-1]}")
+        return None
+    return time.perf_counter() - started
+
+
+async def run():
+    main.copy_legacy_root_files_to_data_if_needed()
+    main.migrate_old_local_if_needed()
+    main.ensure_all_files()
+    main.merge_seed_sap()
+    main.set_shift_members_for_date(DATE, "day", list(range(40)))
+    workers = main.read_rows_for_date_shift("shifts", DATE, "day")
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one_user(u, workers) for u in range(USERS)))
+    wall = time.perf_counter() - started
+    latencies = sorted(x for x in results if x is not None)
+    if not latencies:
+        raise SystemExit("every import failed")
+    await main.close_ocr_provider()
+
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]  # noqa: E731
+    print(f"users: {USERS}, OCR latency {LATENCY:.2f}s, fail rate {FAIL_RATE:.0%}, rows per photo {len(workers)}")
+    print(f"OCR requests served: {FakeOcrHandler.served}, imports failed: {USERS - len(latencies)}")
+    print(f"pipeline p50 {pct(0.5):.2f}s  p95 {pct(0.95):.2f}s  max {latencies[-1]:.2f}s")
+    print(f"wall {wall:.2f}s  -> {len(latencies) / wall:.1f} imports/s ({len(latencies) * len(workers) / wall:.0f} rows/s)")
+    print(f"perf rows stored: {len(main.read_perf())}")
+    print(main.io_stats_text())
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,134 @@
+"""
+Accuracy and throughput of the OCR/text import parser on a corpus of real-shaped OCR outputs.
+
+    python bench/parser_bench.py [corpus] [seconds_per_timing]
+
+Reads bench/parser_corpus.txt (column-split tables, percent before SAP, hours columns like 8,50,
+O/0 confusions, out-of-range values, headers), runs parse_sap_percent_from_text in every pairing mode
+and prints per-shape pair precision/recall, the cases each mode gets wrong, and rows/sec for
+the whole parser, _normalize_ocr_text_for_numbers, parse_sap_percent_line and dense 500-row dumps.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="locker-bench-"))
+os.environ.setdefault("PORT", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from parser_regression import dense_column_dump  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.txt")
+PAIRINGS = ["nearest", "one_to_one"]
+
+
+def load_corpus(path: str) -> list:
+    """[{"name", "shape", "text", "expected": {sap: percent}}] from the "=== / --- expect" format."""
+    cases = []
+    case = None
+    in_expect = False
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.rstrip("\n")
+            if line.startswith("=== "):
+                name = line[4:].strip()
+                case = {"name": name, "shape": name.split("/", 1)[0], "lines": [], "expected": {}}
+                cases.append(case)
+                in_expect = False
+            elif case is None:
+                continue
+            elif line.strip() == "--- expect":
+                in_expect = True
+            elif in_expect:
+                if line.strip() and not line.startswith("#"):
+                    sap, percent = line.split()
+                    case["expected"][sap] = round(float(percent), 2)
+            else:
+                case["lines"].append(line)
+    for case in cases:
+        case["text"] = "\n".join(case.pop("lines")).strip("\n")
+    return cases
+
+
+def score(case: dict, pairing: str):
+    """(correct pairs, returned pairs, got dict) for one case."""
+    got = {}
+    for r in main.parse_sap_percent_from_text(case["text"], pairing=pairing):
+        got[r["sap"]] = round(main.safe_float(r["percent"]) or 0.0, 2)
+    correct = sum(1 for sap, pct in got.items() if case["expected"].get(sap) == pct)
+    return correct, len(got), got
+
+
+def report_accuracy(cases: list, pairing: str):
+    by_shape = defaultdict(lambda: [0, 0, 0, 0, 0])  # correct, returned, expected, exact cases, cases
+    misses = []
+    for case in cases:
+        correct, returned, got = score(case, pairing)
+        exact = got == case["expected"]
+        for key in (case["shape"], "all"):
+            s = by_shape[key]
+            s[0] += correct
+            s[1] += returned
+            s[2] += len(case["expected"])
+            s[3] += exact
+            s[4] += 1
+        if not exact:
+            misses.append((case, got))
+
+    print(f"\npairing={pairing}")
+    print(f"  {'shape':<12} {'cases':>9} {'precision':>10} {'recall':>8}")
+    for shape in sorted(by_shape, key=lambda k: (k == "all", k)):
+        correct, returned, expected, exact, total = by_shape[shape]
+        precision = correct / returned if returned else 1.0
+        recall = correct / expected if expected else 1.0
+        print(f"  {shape:<12} {exact:>4}/{total:<4} {precision:>10.1%} {recall:>8.1%}")
+    for case, got in misses:
+        wrong = {s: p for s, p in got.items() if case["expected"].get(s) != p}
+        missing = sorted(set(case["expected"]) - set(got))
+        print(f"  miss {case['name']}: wrong {wrong or '-'}, missing {missing or '-'}")
+
+
+def rate(fn, rows: int, seconds: float) -> float:
+    """Rows per second of fn() run repeatedly for about `seconds`."""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls * rows / elapsed
+
+
+def report_throughput(cases: list, seconds: float):
+    texts = [c["text"] for c in cases]
+    lines = [ln for t in texts for ln in t.splitlines()]
+    rows = sum(len(c["expected"]) for c in cases)
+    dense = dense_column_dump(random.Random(20261016), 500)
+
+    print(f"\nthroughput ({rows} corpus rows, {len(lines)} lines)")
+    print(f"  {'_normalize_ocr_text_for_numbers':<34} {rate(lambda: [main._normalize_ocr_text_for_numbers(t) for t in texts], rows, seconds):>12,.0f} rows/s")
+    print(f"  {'parse_sap_percent_line':<34} {rate(lambda: [main.parse_sap_percent_line(ln) for ln in lines], rows, seconds):>12,.0f} rows/s")
+    for pairing in PAIRINGS:
+        corpus_rate = rate(lambda: [main.parse_sap_percent_from_text(t, pairing=pairing) for t in texts], rows, seconds)
+        dense_rate = rate(lambda: main.parse_sap_percent_from_text(dense, pairing=pairing), 500, seconds)
+        print(f"  {'parse_sap_percent_from_text':<27} {pairing:<10} {corpus_rate:>8,.0f} rows/s corpus, {dense_rate:>9,.0f} rows/s dense 500-row dump")
+
+
+def main_bench():
+    path = sys.argv[1] if len(sys.argv) > 1 else CORPUS
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    cases = load_corpus(path)
+    print(f"corpus: {path} ({len(cases)} cases, default pairing {main.OCR_PAIRING})")
+    for pairing in PAIRINGS:
+        report_accuracy(cases, pairing)
+    report_throughput(cases, seconds)
+
+
+if __name__ == "__main__":
+    main_bench()
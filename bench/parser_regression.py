@@ -0,0 +1,187 @@
+"""
+Regression check for the SAP/% token pairing in parse_sap_percent_from_text.
+
+    python bench/parser_regression.py [cases] [seed]
+
+Generates OCR-shaped dumps (column-split tables, percent before SAP, hours columns like 8,50,
+O/0 confusions, names, stray numbers) and checks that the default "nearest" pairing returns exactly
+what the original O(S x P) scan returned. Then times both on dense dumps of 200+ rows.
+Exits 1 on the first mismatch.
+"""
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="locker-bench-"))
+os.environ.setdefault("PORT", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+def legacy_parse(text: str) -> list:
+    """parse_sap_percent_from_text before bisect pairing, kept verbatim as the reference."""
+    results = []
+    seen_sap = set()
+
+    for raw in (text or "").splitlines():
+        line = main.normalize_text(raw)
+        if not line:
+            continue
+
+        direct = main.parse_sap_percent_line(line)
+        if direct:
+            sap, percent = direct
+            if sap not in seen_sap:
+                results.append({"sap": sap, "percent": percent, "raw": line})
+                seen_sap.add(sap)
+            continue
+
+        m = re.search(r"\b(\d{8,12})\b.{0,60}?(\d{2,3}[,.]\d{1,2})\s*%?", line)
+        if m:
+            sap = m.group(1)
+            pct = str(main.safe_float(m.group(2)))
+            val = main.safe_float(pct)
+            if sap not in seen_sap and val is not None and 50 <= val <= 250:
+                results.append({"sap": sap, "percent": pct, "raw": line})
+                seen_sap.add(sap)
+            continue
+
+        m = re.search(r"(\d{2,3}[,.]\d{1,2})\s*%?.{0,60}?\b(\d{8,12})\b", line)
+        if m:
+            sap = m.group(2)
+            pct = str(main.safe_float(m.group(1)))
+            val = main.safe_float(pct)
+            if sap not in seen_sap and val is not None and 50 <= val <= 250:
+                results.append({"sap": sap, "percent": pct, "raw": line})
+                seen_sap.add(sap)
+            continue
+
+    tokens = main._extract_numeric_tokens_with_positions(text)
+    sap_tokens = [t for t in tokens if t["type"] == "sap"]
+    pct_tokens = [t for t in tokens if t["type"] == "pct"]
+
+    for sap_t in sap_tokens:
+        sap = sap_t["value"]
+        if sap in seen_sap:
+            continue
+
+        before = [p for p in pct_tokens if p["pos"] < sap_t["pos"]]
+        after = [p for p in pct_tokens if p["pos"] > sap_t["pos"]]
+
+        candidates = []
+        if before:
+            p_before = min(before, key=lambda x: sap_t["pos"] - x["pos"])
+            candidates.append((sap_t["pos"] - p_before["pos"], p_before, "before"))
+        if after:
+            p_after = min(after, key=lambda x: x["pos"] - sap_t["pos"])
+            candidates.append((p_after["pos"] - sap_t["pos"], p_after, "after"))
+
+        if not candidates:
+            continue
+
+        candidates.sort(key=lambda x: x[0])
+        pct = candidates[0][1]["value"]
+        val = main.safe_float(pct)
+
+        if val is not None and 50 <= val <= 250:
+            results.append({
+                "sap": sap,
+                "percent": pct,
+                "raw": f"near-token: {sap} -> {main.fmt_percent(pct)}%"
+            })
+            seen_sap.add(sap)
+
+    return results
+
+
+SURNAMES = ["KOVAL", "BEREZIUK ALINA", "HUNKA", "ISAKOVA V.", "Nowak", "O'NEIL"]
+
+
+def rand_sap(rng) -> str:
+    sap = str(rng.randint(51000000, 51019999))
+    if rng.random() < 0.05:
+        i = rng.randrange(1, len(sap))
+        sap = sap[:i] + "O" + sap[i + 1:]  # OCR reads 0 as O
+    return sap
+
+
+def rand_pct(rng) -> str:
+    sep = rng.choice([",", ",", ".", " , "])
+    return f"{rng.randint(40, 260)}{sep}{rng.randint(0, 99):02d}" + rng.choice(["%", "%", "", " %"])
+
+
+def rand_hours(rng) -> str:
+    return f"{rng.randint(6, 12)},{rng.choice(['00', '17', '50', '75'])}"
+
+
+def make_case(rng) -> str:
+    n = rng.randint(1, 40)
+    saps = [rand_sap(rng) for _ in range(n)]
+    pcts = [rand_pct(rng) for _ in range(n)]
+    shape = rng.choice(["column", "pct_first", "row", "row_hours", "mixed", "shuffled"])
+    lines = []
+    if shape == "column":
+        lines = ["SAP"] + saps + ["Wydajnosc %"] + pcts
+    elif shape == "pct_first":
+        for s, p in zip(saps, pcts):
+            lines += [p, s]
+    elif shape == "row":
+        lines = [f"{s} {rng.choice(SURNAMES)} {p}" for s, p in zip(saps, pcts)]
+    elif shape == "row_hours":
+        lines = [f"{s} {p} {rand_hours(rng)} 1" for s, p in zip(saps, pcts)]
+    elif shape == "mixed":
+        for s, p in zip(saps, pcts):
+            lines.append(rng.choice([f"{s} - {p}", s, p, f"{p} {s}", rng.choice(SURNAMES), rand_hours(rng)]))
+    else:
+        tokens = saps + pcts + [rand_hours(rng) for _ in range(n // 3)] + rng.sample(SURNAMES, 2)
+        rng.shuffle(tokens)
+        per_line = rng.randint(1, 4)
+        lines = [" ".join(tokens[i:i + per_line]) for i in range(0, len(tokens), per_line)]
+    return "\n".join(lines)
+
+
+def dense_column_dump(rng, rows: int) -> str:
+    saps = [str(51000000 + i) for i in range(rows)]
+    pcts = [f"{rng.randint(60, 200)},{rng.randint(0, 99):02d}%" for _ in range(rows)]
+    hours = [rand_hours(rng) for _ in range(rows)]
+    return "\n".join(["SAP"] + saps + ["Godziny"] + hours + ["Wydajnosc"] + pcts)
+
+
+def timed(fn, text: str, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - started) / repeat
+
+
+def main_bench():
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 20261016
+    rng = random.Random(seed)
+    for i in range(cases):
+        text = make_case(rng)
+        expected = legacy_parse(text)
+        got = main.parse_sap_percent_from_text(text, pairing="nearest")
+        if got != expected:
+            print(f"MISMATCH in case {i} (seed {seed}):\n{text}\n--- expected\n{expected}\n--- got\n{got}")
+            sys.exit(1)
+    print(f"regression: {cases} cases identical to the original pairing")
+
+    for rows in (200, 500, 1000):
+        text = dense_column_dump(rng, rows)
+        repeat = max(1, 2000 // rows)
+        old = timed(legacy_parse, text, repeat)
+        new = timed(lambda t: main.parse_sap_percent_from_text(t, pairing="nearest"), text, repeat)
+        one = timed(lambda t: main.parse_sap_percent_from_text(t, pairing="one_to_one"), text, repeat)
+        print(
+            f"{rows:5d} rows: original {old * 1000:8.1f} ms | nearest {new * 1000:7.1f} ms "
+            f"(x{old / new:.0f}) | one_to_one {one * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,77 @@
+"""
+Regression check for the picker write-behind buffer: a buffered tap must never overwrite a newer direct write.
+
+    python bench/write_behind_order.py
+    STORAGE_BACKEND=sqlite python bench/write_behind_order.py
+
+Buffers a workplace tap (wp:set) for a worker, then writes the same row directly (group move, shift rebuild,
+restore) before the idle timer or "Готово" flushes, flushes, drops every cache and checks what is on disk.
+Exits 1 on the first wrong row.
+"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="locker-bench-"))
+os.environ.setdefault("PORT", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+DATE = "16.10.2026"
+ACTIVE = {"date": DATE, "shift_type": "day"}
+
+
+def tap(sap: str, hala: str, group: str):
+    """What a wp:set tap does: patch the cache and buffer the write."""
+    row = next(r for r in main.read_rows_for_date_shift("shifts", DATE, "day") if r["sap"] == sap)
+    wp = {"date": DATE, "shift_type": "day", "items": [{"sap": sap, "surname": row["surname"], "hala": "", "group": ""}]}
+    main.apply_workplace_to_shift(wp, 0, hala, group)
+
+
+def on_disk(sap: str):
+    main.flush_pending_updates()
+    main.invalidate_table_caches()
+    rows = [r for r in main.read_rows_for_date_shift("shifts", DATE, "day") if r["sap"] == sap]
+    return (rows[0]["hala"], rows[0]["group"]) if rows else None
+
+
+def check(name: str, got, expected):
+    if got != expected:
+        print(f"FAIL {name} ({main.STORAGE_BACKEND}): on disk {got}, expected {expected}")
+        sys.exit(1)
+    print(f"ok   {name}")
+
+
+def main_check():
+    main.ensure_all_files()
+    main.merge_seed_sap()
+    main.set_shift_members_for_date(DATE, "day", list(range(5)))
+    sap = main.read_rows_for_date_shift("shifts", DATE, "day")[0]["sap"]
+
+    tap(sap, "HALA 1", "G1")
+    index = [r["sap"] for r in sorted(
+        main.read_rows_for_date_shift("shifts", DATE, "day"),
+        key=lambda r: (0 if not r["hala"] and not r["group"] else 1, main.safe_lower(r["hala"]), main.safe_lower(r["group"]), main.safe_lower(r["surname"])),
+    )].index(sap)
+    main.move_selected_workers_to_group(ACTIVE, [index], "HALA 3", "G3")
+    check("tap, then group move", on_disk(sap), ("HALA 3", "G3"))
+
+    tap(sap, "HALA 2", "G2")
+    main.set_shift_members_for_date(DATE, "day", list(range(5)))
+    check("tap, then shift rebuild keeps the tapped group", on_disk(sap), ("HALA 2", "G2"))
+
+    backup = os.path.join(main.DATA_DIR, "shifts_backup.csv")
+    main.export_table_to_csv("shifts", backup)
+    tap(sap, "HALA 4", "G4")
+    main.import_table_from_csv("shifts", backup)
+    main.invalidate_table_caches()
+    check("tap, then restore", on_disk(sap), ("HALA 2", "G2"))
+
+    tap(sap, "HALA 1", "G5")
+    check("tap alone is flushed", on_disk(sap), ("HALA 1", "G5"))
+    print(f"write-behind ordering ok ({main.STORAGE_BACKEND})")
+
+
+if __name__ == "__main__":
+    main_check()
@@ -1,14 +1,32 @@
 import os
+import sys
+import atexit
 import csv
 import re
+import json
+import gzip
+import hashlib
+import shutil
+import tempfile
+import time
+import asyncio
 import zipfile
+import sqlite3
 import threading
+import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from io import StringIO
 import io
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+import httpx
 import requests
+from telegram.error import RetryAfter
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, Document, InputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     ApplicationBuilder,
@@ -44,6 +62,22 @@ threading.Thread(target=run_http_server, daemon=True).start()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY", "").strip()
+# OCR engine for photo import (see OCR_PROVIDERS); OCR_SPACE_URL can point at bench/fake_ocr_server.py.
+OCR_PROVIDER = os.getenv("OCR_PROVIDER", "ocrspace").strip()
+OCR_SPACE_URL = os.getenv("OCR_SPACE_URL", "https://api.ocr.space/parse/image").strip()
+OCR_TIMEOUT_SEC = float(os.getenv("OCR_TIMEOUT_SEC", "60"))
+OCR_RETRIES = int(os.getenv("OCR_RETRIES", "2"))
+OCR_MAX_CONNECTIONS = int(os.getenv("OCR_MAX_CONNECTIONS", "4"))
+# Raw OCR text of photos already recognized, so a resent photo skips the paid OCR call (LRU beyond the limits).
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "500"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+# Albums: photos of one media group are collected until none arrived for ALBUM_COLLECT_SEC,
+# then OCR'd with at most OCR_CONCURRENCY requests in flight per album.
+ALBUM_COLLECT_SEC = float(os.getenv("ALBUM_COLLECT_SEC", "1.5"))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "3"))
+# How OCR text pairs stray SAP and % tokens: "nearest" (each SAP takes the closest %, a % may serve several SAPs)
+# or "one_to_one" (tokens are matched in reading order and every % is used once; suits column-split tables).
+OCR_PAIRING = os.getenv("OCR_PAIRING", "nearest").strip()
 CSV_URL = os.getenv(
     "CSV_URL",
     "https://docs.google.com/spreadsheets/d/1blFK5rFOZ2PzYAQldcQd8GkmgKmgqr1G5BkD40wtOMI/export?format=csv"
@@ -63,19 +97,141 @@ PERF_DB_PATH = os.getenv("PERF_DB_PATH", os.path.join(DATA_DIR, "performance.csv
 SHIFT_SUMMARY_DB_PATH = os.getenv("SHIFT_SUMMARY_DB_PATH", os.path.join(DATA_DIR, "shift_summary.csv")).strip()
 WEEKLY_SHIFT_DB_PATH = os.getenv("WEEKLY_SHIFT_DB_PATH", os.path.join(DATA_DIR, "weekly_shifts.csv")).strip()
 
+# Storage engine for all tables: "csv" (files above) or "sqlite" (one WAL-mode file in DATA_DIR).
+# CSV files stay the import/export format for backups and restore in both modes.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "csv").strip().lower()
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", os.path.join(DATA_DIR, "locker_bot.sqlite3")).strip()
+
+# CSV engine: shifts and performance are stored as one CSV per month (e.g. performance/2026-10.csv).
+SHIFTS_PARTITION_DIR = os.getenv("SHIFTS_PARTITION_DIR", os.path.join(DATA_DIR, "shifts")).strip()
+PERF_PARTITION_DIR = os.getenv("PERF_PARTITION_DIR", os.path.join(DATA_DIR, "performance")).strip()
+
+# CSV engine: performance changes are appended here and folded into the month partitions in the background.
+PERF_JOURNAL_PATH = os.getenv("PERF_JOURNAL_PATH", os.path.join(DATA_DIR, "performance.journal")).strip()
+PERF_COMPACT_INTERVAL_SEC = int(os.getenv("PERF_COMPACT_INTERVAL_SEC", "120"))
+PERF_COMPACT_MAX_BYTES = int(os.getenv("PERF_COMPACT_MAX_BYTES", str(512 * 1024)))
+# Recent shifts kept per SAP for the trend on the employee card.
+SAP_RECENT_SHIFTS = int(os.getenv("SAP_RECENT_SHIFTS", "5"))
+
+# Inline pickers buffer their taps and write once: on "Готово", after this many idle seconds, or on shutdown.
+PICKER_FLUSH_IDLE_SEC = float(os.getenv("PICKER_FLUSH_IDLE_SEC", "15"))
+
+# Worker threads for blocking file work (CSV/SQLite/backups) and for blocking HTTP calls (OCR itself is async).
+DISK_POOL_WORKERS = int(os.getenv("DISK_POOL_WORKERS", "4"))
+NET_POOL_WORKERS = int(os.getenv("NET_POOL_WORKERS", "4"))
+
+# Updates handled at once; writes to the same table serialize on that table's lock.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))
+
+# Rendered shift/list texts kept for repeat taps (LRU), valid until a table they show is written.
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "256"))
+
 BACKUP_CHAT_ID_RAW = os.getenv("BACKUP_CHAT_ID", "").strip()
 BACKUP_CHAT_ID = int(BACKUP_CHAT_ID_RAW) if BACKUP_CHAT_ID_RAW else None
 
 BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(DATA_DIR, "backups")).strip()
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
-WRITE_LOCK = threading.RLock()
+# Content-addressed backups: every distinct table file is stored once (gzip) under blobs/,
+# a backup itself is a small JSON manifest {basename: sha256} under manifests/.
+BACKUP_BLOB_DIR = os.path.join(BACKUP_DIR, "blobs")
+BACKUP_MANIFEST_DIR = os.path.join(BACKUP_DIR, "manifests")
+os.makedirs(BACKUP_BLOB_DIR, exist_ok=True)
+os.makedirs(BACKUP_MANIFEST_DIR, exist_ok=True)
+
+# Uploads to BACKUP_CHAT_ID run in the background: a burst within this window becomes one upload.
+BACKUP_UPLOAD_WINDOW_SEC = float(os.getenv("BACKUP_UPLOAD_WINDOW_SEC", "20"))
+BACKUP_UPLOAD_RETRIES = int(os.getenv("BACKUP_UPLOAD_RETRIES", "5"))
+
+# Differential backups: a full snapshot at most this old is the base, later manifests store row diffs
+# against it. A table whose diff would exceed this share of its rows is stored whole instead.
+BACKUP_FULL_EVERY_HOURS = float(os.getenv("BACKUP_FULL_EVERY_HOURS", "24"))
+BACKUP_DIFF_MAX_RATIO = float(os.getenv("BACKUP_DIFF_MAX_RATIO", "0.5"))
+
+# Retention: everything from the last BACKUP_KEEP_ALL_HOURS, then the newest backup of each hour for
+# BACKUP_HOURLY_DAYS and of each day for BACKUP_DAILY_DAYS; older ones are evicted, and while BACKUP_DIR
+# is still over BACKUP_MAX_BYTES the oldest go first. The evictor deletes BACKUP_EVICT_BATCH files per step.
+BACKUP_MAX_BYTES = int(os.getenv("BACKUP_MAX_BYTES", str(512 * 1024 * 1024)))
+BACKUP_KEEP_ALL_HOURS = float(os.getenv("BACKUP_KEEP_ALL_HOURS", "24"))
+BACKUP_HOURLY_DAYS = float(os.getenv("BACKUP_HOURLY_DAYS", "7"))
+BACKUP_DAILY_DAYS = float(os.getenv("BACKUP_DAILY_DAYS", "90"))
+BACKUP_RETENTION_INTERVAL_SEC = int(os.getenv("BACKUP_RETENTION_INTERVAL_SEC", "600"))
+BACKUP_EVICT_BATCH = int(os.getenv("BACKUP_EVICT_BATCH", "50"))
+
+# Every table has its own lock next to its cache (see table_lock / table_txn).
+_employee_cache = {"mtime": None, "rows": [], "gen": 0, "lock": threading.RLock()}
+_shift_cache = {"mtime": None, "rows": [], "gen": 0, "lock": threading.RLock()}
+_perf_cache = {"mtime": None, "rows": [], "gen": 0, "lock": threading.RLock()}
+_summary_cache = {"mtime": None, "rows": [], "gen": 0, "lock": threading.RLock()}
+_weekly_cache = {"mtime": None, "rows": [], "gen": 0, "lock": threading.RLock()}
 
-_employee_cache = {"mtime": None, "rows": []}
-_shift_cache = {"mtime": None, "rows": []}
-_perf_cache = {"mtime": None, "rows": []}
-_summary_cache = {"mtime": None, "rows": []}
-_weekly_cache = {"mtime": None, "rows": []}
+# ==============================
+# I/O POOLS
+# ==============================
+
+# Handlers run on one asyncio loop: every blocking disk or HTTP call goes through run_disk/run_net,
+# so a slow OCR request or a backup never freezes other users.
+
+def _io_pool(prefix: str, workers: int) -> dict:
+    return {
+        "executor": ThreadPoolExecutor(max_workers=workers, thread_name_prefix=prefix),
+        "workers": workers,
+        "queued": 0,
+        "running": 0,
+        "done": 0,
+        "failed": 0,
+        "max_queued": 0,
+        "max_wait": 0.0,
+        "busy_sec": 0.0,
+    }
+
+IO_POOLS = {
+    "disk": _io_pool("disk-io", DISK_POOL_WORKERS),
+    "net": _io_pool("net-io", NET_POOL_WORKERS),
+}
+_io_stats_lock = threading.Lock()
+
+async def run_io(pool_name: str, fn, *args, **kwargs):
+    pool = IO_POOLS[pool_name]
+    submitted = time.monotonic()
+    with _io_stats_lock:
+        pool["queued"] += 1
+        pool["max_queued"] = max(pool["max_queued"], pool["queued"])
+
+    def job():
+        started = time.monotonic()
+        with _io_stats_lock:
+            pool["queued"] -= 1
+            pool["running"] += 1
+            pool["max_wait"] = max(pool["max_wait"], started - submitted)
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with _io_stats_lock:
+                pool["running"] -= 1
+                pool["done" if ok else "failed"] += 1
+                pool["busy_sec"] += time.monotonic() - started
+
+    return await asyncio.get_running_loop().run_in_executor(pool["executor"], job)
+
+async def run_disk(fn, *args, **kwargs):
+    return await run_io("disk", fn, *args, **kwargs)
+
+async def run_net(fn, *args, **kwargs):
+    return await run_io("net", fn, *args, **kwargs)
+
+def io_stats_text() -> str:
+    lines = ["⚙️ I/O пули", ""]
+    for name, p in IO_POOLS.items():
+        lines.append(
+            f"{name}: потоків {p['workers']} | у черзі {p['queued']} (макс {p['max_queued']}) | "
+            f"виконується {p['running']} | готово {p['done']} | помилок {p['failed']} | "
+            f"макс. очікування {p['max_wait']:.2f} с | зайнято {p['busy_sec']:.1f} с"
+        )
+    return "\n".join(lines)
 
 # ==============================
 # FIXED SAP LIST
@@ -196,6 +352,7 @@ BTN_GROUPS_OVERVIEW = "📦 Групи зміни"
 BTN_GROUP_ADD_WORKERS = "👥 Додати працівників у групу"
 BTN_IMPORT_PERCENT = "📥 Імпорт % за датою"
 BTN_IMPORT_PHOTO = "📸 Фото % за датою"
+BTN_IMPORT_FILE = "📄 Імпорт % з файлу"
 BTN_CLEAR_PERCENT_DATE = "🧹 Очистити % за дату"
 BTN_CONFIRM_SAVE_IMPORT = "✅ Зберегти OCR"
 BTN_CANCEL_IMPORT = "❌ Скасувати OCR"
@@ -214,6 +371,7 @@ WORK_KB = ReplyKeyboardMarkup(
         [BTN_DISTRIBUTE_WORKERS, BTN_GROUPS_OVERVIEW],
         [BTN_GROUP_ADD_WORKERS],
         [BTN_IMPORT_PERCENT, BTN_IMPORT_PHOTO],
+        [BTN_IMPORT_FILE],
         [BTN_GROUP_SET_PERCENT],
         [BTN_CLEAR_PERCENT_DATE],
         [BTN_SHIFT_SUMMARY],
@@ -245,21 +403,33 @@ def now_ts() -> str:
 def today_ddmmyyyy() -> str:
     return datetime.now().strftime("%d.%m.%Y")
 
-def _file_mtime(path: str):
+def _file_sig(path: str):
+    """(mtime_ns, size, inode): also catches same-second rewrites and atomic replaces."""
     try:
-        return os.path.getmtime(path)
+        st = os.stat(path)
     except Exception:
         return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except Exception:
+        return 0
 
 def atomic_write_csv(path: str, fieldnames: list, rows: list):
     tmp_path = path + ".tmp"
     with open(tmp_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+        # Plain writer: DictWriter re-checks every row's keys through the Mapping ABC, the bulk of a big export.
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        writer.writerows([r.get(k, "") for k in fieldnames] for r in rows)
     os.replace(tmp_path, path)
 
+def write_text_file(path: str, text: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
 def parse_ddmmyyyy(s: str):
     try:
         return datetime.strptime(normalize_text(s), "%d.%m.%Y")
@@ -416,7 +586,65 @@ def _extract_numeric_tokens_with_positions(text: str) -> list:
                 tokens.append({"type": "pct", "value": str(val), "pos": m.start(), "raw": raw})
     return tokens
 
-def parse_sap_percent_from_text(text: str) -> list:
+def _nearest_pct_index(pct_pos: list, pos: int):
+    """Index of the % token closest to pos (the one before wins a tie), by bisect over sorted positions."""
+    i = bisect_left(pct_pos, pos)
+    best = i - 1 if i > 0 else None
+    if i < len(pct_pos) and (best is None or pct_pos[i] - pos < pos - pct_pos[best]):
+        best = i
+    return best
+
+def _pair_tokens_nearest(sap_tokens: list, pct_tokens: list, seen_sap: set) -> list:
+    """Each new SAP takes its nearest % token before or after it. O((S + P) log P)."""
+    pct_pos = [p["pos"] for p in pct_tokens]
+    pairs = []
+    for sap_t in sap_tokens:
+        if sap_t["value"] in seen_sap:
+            continue
+        i = _nearest_pct_index(pct_pos, sap_t["pos"])
+        if i is None:
+            continue
+        pairs.append((sap_t, pct_tokens[i]))
+        seen_sap.add(sap_t["value"])
+    return pairs
+
+def _pair_tokens_one_to_one(sap_tokens: list, pct_tokens: list, seen_sap: set) -> list:
+    """
+    Two-pointer merge over the token stream: a SAP pairs with the oldest unpaired % before it, or waits for
+    the next % after it, so every % is claimed once and column-split dumps pair in reading order.
+    % tokens next to SAPs the line parser already took are left out. O(S + P).
+    """
+    pct_pos = [p["pos"] for p in pct_tokens]
+    used = {_nearest_pct_index(pct_pos, t["pos"]) for t in sap_tokens if t["value"] in seen_sap}
+    claimed = set(seen_sap)
+    waiting_sap, waiting_pct = deque(), deque()
+    pairs = []
+    si = pi = 0
+    while si < len(sap_tokens) or pi < len(pct_tokens):
+        if pi == len(pct_tokens) or (si < len(sap_tokens) and sap_tokens[si]["pos"] < pct_pos[pi]):
+            sap_t = sap_tokens[si]
+            si += 1
+            if sap_t["value"] in claimed:
+                continue
+            claimed.add(sap_t["value"])
+            if waiting_pct:
+                pairs.append((sap_t, waiting_pct.popleft()))
+            else:
+                waiting_sap.append(sap_t)
+        else:
+            pct_t = pct_tokens[pi]
+            pi += 1
+            if pi - 1 in used:
+                continue
+            if waiting_sap:
+                pairs.append((waiting_sap.popleft(), pct_t))
+            else:
+                waiting_pct.append(pct_t)
+    pairs.sort(key=lambda x: x[0]["pos"])
+    seen_sap.update(sap_t["value"] for sap_t, _ in pairs)
+    return pairs
+
+def parse_sap_percent_from_text(text: str, pairing: str = None) -> list:
     """
     Strong parser for pasted text or OCR text.
 
@@ -424,7 +652,7 @@ def parse_sap_percent_from_text(text: str) -> list:
     51009998 - 156,44
     51009998 156,44 10,17 1
     156,44% 51009998
-    OCR columns where SAP and % are separated: finds nearest % before/after SAP.
+    OCR columns where SAP and % are separated: pairs them per `pairing` (default OCR_PAIRING).
     """
     results = []
     seen_sap = set()
@@ -465,94 +693,81 @@ def parse_sap_percent_from_text(text: str) -> list:
                 seen_sap.add(sap)
             continue
 
-    # 2) OCR fallback: token stream, pair SAP with nearest % before/after.
+    # 2) OCR fallback: token stream, pair leftover SAP tokens with % tokens.
     tokens = _extract_numeric_tokens_with_positions(text)
     sap_tokens = [t for t in tokens if t["type"] == "sap"]
     pct_tokens = [t for t in tokens if t["type"] == "pct"]
+    pair = _pair_tokens_one_to_one if (pairing or OCR_PAIRING) == "one_to_one" else _pair_tokens_nearest
 
-    for sap_t in sap_tokens:
-        sap = sap_t["value"]
-        if sap in seen_sap:
-            continue
-
-        before = [p for p in pct_tokens if p["pos"] < sap_t["pos"]]
-        after = [p for p in pct_tokens if p["pos"] > sap_t["pos"]]
-
-        candidates = []
-        if before:
-            p_before = min(before, key=lambda x: sap_t["pos"] - x["pos"])
-            candidates.append((sap_t["pos"] - p_before["pos"], p_before, "before"))
-        if after:
-            p_after = min(after, key=lambda x: x["pos"] - sap_t["pos"])
-            candidates.append((p_after["pos"] - sap_t["pos"], p_after, "after"))
-
-        if not candidates:
-            continue
-
-        candidates.sort(key=lambda x: x[0])
-        pct = candidates[0][1]["value"]
-        val = safe_float(pct)
-
-        if val is not None and 50 <= val <= 250:
-            results.append({
-                "sap": sap,
-                "percent": pct,
-                "raw": f"near-token: {sap} -> {fmt_percent(pct)}%"
-            })
-            seen_sap.add(sap)
+    for sap_t, pct_t in pair(sap_tokens, pct_tokens, seen_sap):
+        results.append({
+            "sap": sap_t["value"],
+            "percent": pct_t["value"],
+            "raw": f"near-token: {sap_t['value']} -> {fmt_percent(pct_t['value'])}%"
+        })
 
     return results
 
-def import_percent_rows_by_date(date_str: str, parsed_rows: list) -> dict:
+def merge_parsed_rows(parsed_lists: list) -> tuple:
     """
-    Date-based import: find SAP in day/night shifts for this date and write percent to correct shift.
-    If SAP exists in both day and night, mark ambiguous and do not write.
-    If SAP is not in any shift for this date, mark missing and do not write.
+    Merge parser results of several photos, one row per SAP (first photo wins, screenshots overlap).
+    Returns (rows, conflicts) where conflicts lists SAPs that came with different percents.
     """
-    employees = read_employees(force=True)
-    emp_by_sap, _ = build_employee_lookup(employees)
-
-    shifts = read_shifts(force=True)
-    shift_matches_by_sap = {}
-    for s in shifts:
-        if s["date"] != date_str or not s.get("sap"):
-            continue
-        shift_matches_by_sap.setdefault(s["sap"], []).append(s)
+    merged = {}
+    conflicts = []
+    for parsed in parsed_lists:
+        for item in parsed:
+            first = merged.setdefault(item["sap"], item)
+            if first is not item and safe_float(first["percent"]) != safe_float(item["percent"]):
+                conflicts.append(f"{item['sap']}: {fmt_percent(first['percent'])}% / {fmt_percent(item['percent'])}%")
+    return list(merged.values()), conflicts
+
+def shift_index_for_date(date_str: str) -> dict:
+    """{sap: [shift rows]} of one date, one row per (shift_type, hala, group)."""
+    index = {}
+    for s in read_rows_for_date("shifts", date_str):
+        if s.get("sap"):
+            index.setdefault(s["sap"], {})[(s["shift_type"], s["hala"], s["group"])] = s
+    return {sap: list(matches.values()) for sap, matches in index.items()}
+
+def _import_plan_gens() -> dict:
+    return {name: table_spec(name)["cache"]["gen"] for name in ("employees", "shifts")}
+
+def plan_percent_import(date_str: str, parsed_rows: list) -> dict:
+    """
+    Date-based import plan: find each SAP in day/night shifts of this date, write nothing.
+    SAP in both day and night -> ambiguous, in no shift -> missing, not in employees -> unknown_sap.
+    The same plan feeds the preview report and commit_percent_import.
+    """
+    with table_txn("employees", "shifts"):
+        emp_by_sap, _ = build_employee_lookup(read_employees())
+        shifts_by_sap = shift_index_for_date(date_str)
+        gens = _import_plan_gens()
 
-    old_perf = read_perf(force=True)
-    to_write = []
+    rows = []
     missing = []
     ambiguous = []
     unknown_sap = []
-    imported = []
 
     for item in parsed_rows:
         sap = item["sap"]
         percent = item["percent"]
         emp = emp_by_sap.get(sap)
-        matches = shift_matches_by_sap.get(sap, [])
-
         if not emp:
             unknown_sap.append(sap)
             continue
 
-        # Deduplicate same shift_type if somehow duplicated in same date.
-        unique = {}
-        for m in matches:
-            unique[(m["shift_type"], m["hala"], m["group"])] = m
-        matches = list(unique.values())
-
-        shift_types = sorted(set(m["shift_type"] for m in matches))
-        if len(shift_types) == 0:
+        matches = shifts_by_sap.get(sap, [])
+        shift_types = set(m["shift_type"] for m in matches)
+        if not shift_types:
             missing.append(f"{sap} — {emp['surname']} — {fmt_percent(percent)}%")
             continue
-
         if len(shift_types) > 1:
             ambiguous.append(f"{sap} — {emp['surname']} — є day і night")
             continue
 
         m = matches[0]
-        row = ensure_perf_columns({
+        rows.append(ensure_perf_columns({
             "date": date_str,
             "shift_type": m["shift_type"],
             "hala": m["hala"],
@@ -560,27 +775,49 @@ def import_percent_rows_by_date(date_str: str, parsed_rows: list) -> dict:
             "sap": sap,
             "surname": emp["surname"],
             "percent": percent,
-        })
-        to_write.append(row)
-        imported.append(row)
-
-    # Replace only rows for same date+shift+sap being imported.
-    keys = {(r["date"], r["shift_type"], r["sap"]) for r in to_write}
-    kept = [r for r in old_perf if (r["date"], r["shift_type"], r["sap"]) not in keys]
-    if to_write:
-        write_perf(kept + to_write)
+        }))
 
     return {
-        "imported": imported,
+        "date": date_str,
+        "parsed": [{"sap": item["sap"], "percent": item["percent"]} for item in parsed_rows],
+        "parsed_count": len(parsed_rows),
+        "rows": rows,
         "missing": missing,
         "ambiguous": ambiguous,
         "unknown_sap": unknown_sap,
-        "parsed_count": len(parsed_rows),
-        "written_count": len(to_write),
+        "gens": gens,
     }
 
+def _plan_outcome(plan: dict) -> tuple:
+    targets = [(r["sap"], r["shift_type"], r["hala"], r["group"], r["percent"]) for r in plan["rows"]]
+    return targets, plan["missing"], plan["ambiguous"], plan["unknown_sap"]
+
+def commit_percent_import(plan: dict) -> dict:
+    """
+    Write the rows of a plan, replacing only the same date+shift+SAP.
+    If employees or shifts changed since the plan was built, it is resolved again first;
+    "replanned" is True when that changed what gets written.
+    """
+    with table_txn("employees", "shifts", "perf"):
+        # Cheap signature checks that reload the caches if the files changed under us.
+        read_employees()
+        read_rows_for_date("shifts", plan["date"])
+        replanned = False
+        if plan.get("gens") != _import_plan_gens():
+            fresh = plan_percent_import(plan["date"], plan["parsed"])
+            replanned = _plan_outcome(fresh) != _plan_outcome(plan)
+            plan = fresh
+        if plan["rows"]:
+            upsert_rows("perf", plan["rows"], PERF_KEY)
+    return dict(plan, written_count=len(plan["rows"]), replanned=replanned)
+
+def import_percent_rows_by_date(date_str: str, parsed_rows: list) -> dict:
+    """Plan and write in one transaction (pasted text, no preview)."""
+    with table_txn("employees", "shifts", "perf"):
+        return commit_percent_import(plan_percent_import(date_str, parsed_rows))
+
 def format_import_by_date_report(date_str: str, result: dict) -> str:
-    imported = result["imported"]
+    imported = result["rows"]
     msg = [
         f"✅ Імпорт за дату {date_str}",
         f"Розпізнано рядків: {result['parsed_count']}",
@@ -611,71 +848,8 @@ def format_import_by_date_report(date_str: str, result: dict) -> str:
     return "\n".join(msg)
 
 
-def build_import_preview_by_date(date_str: str, parsed_rows: list) -> dict:
-    """
-    Build preview only. Does not write performance.csv.
-    """
-    employees = read_employees(force=True)
-    emp_by_sap, _ = build_employee_lookup(employees)
-
-    shifts = read_shifts(force=True)
-    shift_matches_by_sap = {}
-    for s in shifts:
-        if s["date"] != date_str or not s.get("sap"):
-            continue
-        shift_matches_by_sap.setdefault(s["sap"], []).append(s)
-
-    preview = []
-    missing = []
-    ambiguous = []
-    unknown_sap = []
-
-    for item in parsed_rows:
-        sap = item["sap"]
-        percent = item["percent"]
-        emp = emp_by_sap.get(sap)
-        matches = shift_matches_by_sap.get(sap, [])
-
-        if not emp:
-            unknown_sap.append(sap)
-            continue
-
-        unique = {}
-        for m in matches:
-            unique[(m["shift_type"], m["hala"], m["group"])] = m
-        matches = list(unique.values())
-
-        shift_types = sorted(set(m["shift_type"] for m in matches))
-        if len(shift_types) == 0:
-            missing.append(f"{sap} — {emp['surname']} — {fmt_percent(percent)}%")
-            continue
-
-        if len(shift_types) > 1:
-            ambiguous.append(f"{sap} — {emp['surname']} — є day і night")
-            continue
-
-        m = matches[0]
-        preview.append(ensure_perf_columns({
-            "date": date_str,
-            "shift_type": m["shift_type"],
-            "hala": m["hala"],
-            "group": m["group"],
-            "sap": sap,
-            "surname": emp["surname"],
-            "percent": percent,
-        }))
-
-    return {
-        "date": date_str,
-        "parsed_count": len(parsed_rows),
-        "preview": preview,
-        "missing": missing,
-        "ambiguous": ambiguous,
-        "unknown_sap": unknown_sap,
-    }
-
 def format_import_preview_report(result: dict) -> str:
-    preview = result["preview"]
+    preview = result["rows"]
     date_str = result["date"]
 
     msg = [
@@ -708,46 +882,410 @@ def format_import_preview_report(result: dict) -> str:
 
     return "\\n".join(msg)
 
-def save_import_preview_rows(rows: list):
-    old_perf = read_perf(force=True)
-    keys = {(r["date"], r["shift_type"], r["sap"]) for r in rows}
-    kept = [r for r in old_perf if (r["date"], r["shift_type"], r["sap"]) not in keys]
-    write_perf(kept + [ensure_perf_columns(r) for r in rows])
-    return len(rows)
+# Header names accepted for the bulk file import, compared after safe_lower().
+PERCENT_FILE_COLUMNS = {
+    "date": {"date", "data", "дата", "day", "dzien", "dzień"},
+    "sap": {"sap", "sap nr", "nr sap", "sap number", "сап", "табельний"},
+    "percent": {"percent", "%", "pct", "wydajnosc", "wydajność", "wydajnosc %", "відсоток", "продуктивність"},
+}
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+def _iter_csv_records(path: str):
+    """
+    (line number, row as a list) of a CSV. The delimiter (; , or tab) is sniffed from the first ~4 KB,
+    so a title line above the header (which has no delimiters) does not decide it; if sniffing fails,
+    the most frequent of the three in that sample wins.
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        if "\n" in sample:
+            sample = sample[:sample.rindex("\n")]  # a cut-off last line would skew the sniffer
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=";,\t").delimiter
+        except csv.Error:
+            delimiter = max([";", ",", "\t"], key=sample.count)
+        f.seek(0)
+        reader = csv.reader(f, delimiter=delimiter)
+        for record in reader:
+            yield reader.line_num, record
+
+def _xlsx_first_sheet(zf) -> str:
+    with zf.open("xl/workbook.xml") as f:
+        sheet = next(ET.parse(f).getroot().iter(XLSX_NS + "sheet"), None)
+    if sheet is None:
+        raise ValueError("у XLSX немає аркушів")
+    rel_id = sheet.get(XLSX_REL_NS + "id")
+    with zf.open("xl/_rels/workbook.xml.rels") as f:
+        for rel in ET.parse(f).getroot():
+            if rel.get("Id") == rel_id:
+                target = rel.get("Target").lstrip("/")
+                return target if target.startswith("xl/") else "xl/" + target
+    raise ValueError("не знайшов перший аркуш XLSX")
+
+def _xlsx_column(ref: str) -> int:
+    col = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        col = col * 26 + ord(ch.upper()) - 64
+    return col - 1
+
+def _iter_xlsx_records(path: str):
+    """
+    (sheet row number, row as a list of strings) of the first sheet, parsed with iterparse
+    so a big sheet is never in memory whole.
+    """
+    with zipfile.ZipFile(path) as zf:
+        shared = []
+        if "xl/sharedStrings.xml" in zf.namelist():
+            with zf.open("xl/sharedStrings.xml") as f:
+                for _, el in ET.iterparse(f):
+                    if el.tag == XLSX_NS + "si":
+                        shared.append("".join(t.text or "" for t in el.iter(XLSX_NS + "t")))
+                        el.clear()
+        with zf.open(_xlsx_first_sheet(zf)) as f:
+            row_no = 0
+            for _, el in ET.iterparse(f):
+                if el.tag != XLSX_NS + "row":
+                    continue
+                # Empty rows are left out of the sheet XML, so the number comes from r="..." when present.
+                row_no = int(el.get("r")) if (el.get("r") or "").isdigit() else row_no + 1
+                record = []
+                for c in el.iter(XLSX_NS + "c"):
+                    col = _xlsx_column(c.get("r", "")) if c.get("r") else len(record)
+                    kind = c.get("t")
+                    if kind == "inlineStr":
+                        value = "".join(t.text or "" for t in c.iter(XLSX_NS + "t"))
+                    else:
+                        value = c.findtext(XLSX_NS + "v") or ""
+                        if kind == "s" and value:
+                            value = shared[int(value)]
+                    record.extend([""] * (col + 1 - len(record)))
+                    record[col] = value
+                yield row_no, record
+                el.clear()
+
+def _percent_file_columns(record: list):
+    """{"date": i, "sap": i, "percent": i} if the record is a header row, else None."""
+    found = {}
+    for i, cell in enumerate(record):
+        name = safe_lower(cell)
+        for key, names in PERCENT_FILE_COLUMNS.items():
+            if name in names and key not in found:
+                found[key] = i
+    return found if len(found) == 3 else None
+
+def _percent_file_date(value: str) -> str:
+    """DD.MM.YYYY from DD.MM.YYYY, YYYY-MM-DD, DD/MM/YYYY or an Excel date serial; "" if none fits."""
+    value = normalize_text(value)
+    if re.fullmatch(r"\d{5}(\.\d+)?", value):
+        # The fraction is a time of day.
+        return (EXCEL_EPOCH + timedelta(days=int(float(value)))).strftime("%d.%m.%Y")
+    value = value.split(" ")[0].split("T")[0]
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%d.%m.%Y")
+        except ValueError:
+            pass
+    return ""
+
+def iter_percent_file_rows(path: str, filename: str = ""):
+    """
+    Streams (line_no, date, sap, percent) from a CSV or XLSX with date, sap and percent columns.
+    The header may sit below a title block; without one the first three columns are used.
+    A percent of at most 5 is an Excel percent cell (1,5644 = 156,44%).
+    line_no is the row number in the file/sheet. Unusable rows, including a percent
+    outside 50..250, come out with percent None.
+    """
+    low = (filename or path).lower()
+    records = _iter_xlsx_records(path) if low.endswith(".xlsx") else _iter_csv_records(path)
+    columns = None
+    for line_no, record in records:
+        if not any(normalize_text(c) for c in record):
+            continue
+        if columns is None:
+            columns = _percent_file_columns(record)
+            if columns:
+                continue
+            if _percent_file_date(record[0]):
+                columns = {"date": 0, "sap": 1, "percent": 2}
+            elif line_no >= 10:
+                raise ValueError("не знайшов колонок date, sap, percent")
+            else:
+                continue
+
+        cells = [record[columns[k]] if columns[k] < len(record) else "" for k in ("date", "sap", "percent")]
+        date_str = _percent_file_date(cells[0])
+        sap = re.sub(r"\.0+$", "", normalize_text(cells[1]))
+        val = safe_float(cells[2])
+        if val is not None and 0 < val <= 5:
+            val *= 100
+        if not date_str or not re.fullmatch(r"\d{6,12}", sap) or val is None or not 50 <= val <= 250:
+            yield line_no, date_str, sap, None
+            continue
+        yield line_no, date_str, sap, str(round(val, 2))
+    if columns is None:
+        raise ValueError("не знайшов колонок date, sap, percent")
+
+def import_percent_file(path: str, filename: str = "") -> dict:
+    """
+    Bulk import of many dates from one file: rows are streamed and grouped per date (last value
+    of a SAP wins), then every date is resolved against its shift index and written in its own transaction.
+    """
+    started = time.perf_counter()
+    by_date = {}
+    bad = []
+    rows_read = 0
+    for line_no, date_str, sap, percent in iter_percent_file_rows(path, filename):
+        rows_read += 1
+        if percent is None:
+            bad.append(str(line_no))
+            continue
+        by_date.setdefault(date_str, {})[sap] = {"sap": sap, "percent": percent}
+
+    written = 0
+    missing, ambiguous, unknown_sap = [], [], set()
+    for date_str in sorted(by_date, key=parse_ddmmyyyy):
+        result = import_percent_rows_by_date(date_str, list(by_date[date_str].values()))
+        written += result["written_count"]
+        missing.extend(f"{date_str}: {m}" for m in result["missing"])
+        ambiguous.extend(f"{date_str}: {m}" for m in result["ambiguous"])
+        unknown_sap.update(result["unknown_sap"])
+
+    elapsed = time.perf_counter() - started
+    return {
+        "rows_read": rows_read,
+        "dates": sorted(by_date, key=parse_ddmmyyyy),
+        "written_count": written,
+        "missing": missing,
+        "ambiguous": ambiguous,
+        "unknown_sap": sorted(unknown_sap),
+        "bad_lines": bad,
+        "elapsed": elapsed,
+    }
+
+def format_percent_file_report(result: dict) -> str:
+    dates = result["dates"]
+    rate = result["rows_read"] / result["elapsed"] if result["elapsed"] else 0
+    msg = [
+        "✅ Імпорт % з файлу",
+        f"Рядків у файлі: {result['rows_read']}",
+        f"Дат: {len(dates)}" + (f" ({dates[0]} — {dates[-1]})" if dates else ""),
+        f"Записано: {result['written_count']}",
+        f"Час: {result['elapsed']:.1f} с ({rate:.0f} рядків/с)",
+    ]
+    if result["missing"]:
+        msg.append(f"\n⚠️ SAP не доданий у day/night на свою дату: {len(result['missing'])}")
+        msg.extend(result["missing"][:20])
+        if len(result["missing"]) > 20:
+            msg.append(f"... ще {len(result['missing'])-20}")
+    if result["ambiguous"]:
+        msg.append(f"\n⚠️ SAP і в day, і в night — не записано: {len(result['ambiguous'])}")
+        msg.extend(result["ambiguous"][:20])
+    if result["unknown_sap"]:
+        msg.append(f"\n❌ SAP немає в базі: {len(result['unknown_sap'])}")
+        msg.extend(result["unknown_sap"][:20])
+    if result["bad_lines"]:
+        msg.append(f"\n⚠️ Не розпізнано рядки файлу: {', '.join(result['bad_lines'][:30])}")
+    return "\n".join(msg)
 
 def clear_percent_for_date(date_str: str) -> int:
-    old = read_perf(force=True)
-    kept = [r for r in old if r.get("date") != date_str]
-    removed = len(old) - len(kept)
-    write_perf(kept)
-    return removed
-
-def ocr_space_image_bytes(image_bytes: bytes, filename: str = "photo.jpg") -> str:
-    if not OCR_SPACE_API_KEY:
-        raise RuntimeError("OCR_SPACE_API_KEY is missing")
-
-    resp = requests.post(
-        "https://api.ocr.space/parse/image",
-        files={"file": (filename, image_bytes)},
-        data={
-            "apikey": OCR_SPACE_API_KEY,
+    return change_rows("perf", delete_where=[{"date": date_str}])["removed"]
+
+# ==============================
+# OCR
+# ==============================
+
+class OcrProvider:
+    """Turns an image into plain text. Implementations are async and reuse their connections."""
+
+    name = ""
+
+    def available(self) -> bool:
+        return True
+
+    async def recognize(self, image_bytes: bytes, filename: str = "photo.jpg") -> str:
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+class OcrSpaceProvider(OcrProvider):
+    """OCR.space HTTP API: one pooled AsyncClient, per-request timeout, retries on network errors, 429 and 5xx."""
+
+    name = "ocrspace"
+
+    def __init__(self, url: str = OCR_SPACE_URL, api_key: str = OCR_SPACE_API_KEY):
+        self.url = url
+        self.api_key = api_key
+        self.client = None
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(OCR_TIMEOUT_SEC, connect=10.0),
+                limits=httpx.Limits(max_connections=OCR_MAX_CONNECTIONS, max_keepalive_connections=OCR_MAX_CONNECTIONS),
+            )
+        return self.client
+
+    async def recognize(self, image_bytes: bytes, filename: str = "photo.jpg") -> str:
+        if not self.api_key:
+            raise RuntimeError("OCR_SPACE_API_KEY is missing")
+        data = {
+            "apikey": self.api_key,
             "language": "eng",
             "isOverlayRequired": "false",
             "OCREngine": "2",
             "scale": "true",
             "detectOrientation": "true",
             "isTable": "true",
-        },
-        timeout=60,
-    )
-    data = resp.json()
-    if data.get("IsErroredOnProcessing"):
-        raise RuntimeError(str(data.get("ErrorMessage") or data.get("ErrorDetails") or "OCR error"))
-    texts = []
-    for pr in data.get("ParsedResults", []) or []:
-        if pr.get("ParsedText"):
-            texts.append(pr["ParsedText"])
-    return "\n".join(texts).strip()
+        }
+        delay = 1.0
+        attempts = max(OCR_RETRIES, 0) + 1
+        for attempt in range(attempts):
+            try:
+                resp = await self._client().post(self.url, files={"file": (filename, image_bytes)}, data=data)
+                if resp.status_code == 429 or resp.status_code >= 500:
+                    raise httpx.HTTPStatusError(f"OCR HTTP {resp.status_code}", request=resp.request, response=resp)
+                result = resp.json()
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError, ValueError) as e:
+                # ValueError: a truncated or HTML body from a gateway, retried like a 5xx.
+                if attempt == attempts - 1:
+                    if isinstance(e, ValueError):
+                        raise RuntimeError("OCR: invalid JSON response") from e
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+        if result.get("IsErroredOnProcessing"):
+            raise RuntimeError(str(result.get("ErrorMessage") or result.get("ErrorDetails") or "OCR error"))
+        texts = []
+        for pr in result.get("ParsedResults", []) or []:
+            if pr.get("ParsedText"):
+                texts.append(pr["ParsedText"])
+        return "\n".join(texts).strip()
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+OCR_PROVIDERS = {
+    OcrSpaceProvider.name: OcrSpaceProvider,
+}
+_ocr_provider = {"provider": None}
+
+def get_ocr_provider() -> OcrProvider:
+    if _ocr_provider["provider"] is None:
+        if OCR_PROVIDER not in OCR_PROVIDERS:
+            raise RuntimeError(f"Unknown OCR_PROVIDER {OCR_PROVIDER!r}, expected one of: {', '.join(OCR_PROVIDERS)}")
+        _ocr_provider["provider"] = OCR_PROVIDERS[OCR_PROVIDER]()
+    return _ocr_provider["provider"]
+
+async def ocr_image(image_bytes: bytes, filename: str = "photo.jpg") -> str:
+    return await get_ocr_provider().recognize(image_bytes, filename)
+
+async def close_ocr_provider():
+    if _ocr_provider["provider"] is not None:
+        await _ocr_provider["provider"].aclose()
+
+# index.json: {"keys": {"fid:<file_unique_id>" | "img:<sha256>": sha256}, "entries": {sha256: {"size", "used"}}};
+# the text of an entry is in <sha256>.txt. Entries are keyed by image content, file ids are aliases.
+OCR_CACHE_DIR = os.path.join(DATA_DIR, "ocr_cache")
+OCR_CACHE_LOCK = threading.Lock()
+_ocr_cache = {"index": None}
+
+def _ocr_cache_index() -> dict:
+    if _ocr_cache["index"] is None:
+        index = {"keys": {}, "entries": {}}
+        try:
+            with open(os.path.join(OCR_CACHE_DIR, "index.json"), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"WARNING: OCR cache index unreadable, starting empty: {e}")
+        _ocr_cache["index"] = index
+    return _ocr_cache["index"]
+
+def _save_ocr_cache_index(index: dict):
+    os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+    path = os.path.join(OCR_CACHE_DIR, "index.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+def ocr_cache_get(file_unique_id: str = "", image_sha: str = ""):
+    """Cached OCR text by Telegram file_unique_id, else by image hash; None on a miss (a blank entry is one too)."""
+    with OCR_CACHE_LOCK:
+        index = _ocr_cache_index()
+        sha = index["keys"].get(f"fid:{file_unique_id}") if file_unique_id else None
+        if sha is None and image_sha:
+            sha = index["keys"].get(f"img:{image_sha}")
+        entry = index["entries"].get(sha) if sha else None
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(OCR_CACHE_DIR, f"{sha}.txt"), "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        if not text.strip():
+            # Left by older versions that cached failed recognitions.
+            return None
+        # The LRU timestamp stays in memory and is saved with the next put; only a new key is worth a rewrite.
+        entry["used"] = time.time()
+        key = f"fid:{file_unique_id}"
+        if file_unique_id and index["keys"].get(key) != sha:
+            index["keys"][key] = sha
+            _save_ocr_cache_index(index)
+        return text
+
+def ocr_cache_put(text: str, file_unique_id: str, image_sha: str):
+    with OCR_CACHE_LOCK:
+        index = _ocr_cache_index()
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        write_text_file(os.path.join(OCR_CACHE_DIR, f"{image_sha}.txt"), text)
+        index["entries"][image_sha] = {"size": len(text.encode("utf-8")), "used": time.time()}
+        index["keys"][f"img:{image_sha}"] = image_sha
+        if file_unique_id:
+            index["keys"][f"fid:{file_unique_id}"] = image_sha
+        entries = index["entries"]
+        total = sum(e["size"] for e in entries.values())
+        while entries and (len(entries) > OCR_CACHE_MAX_ENTRIES or total > OCR_CACHE_MAX_BYTES):
+            oldest = min(entries, key=lambda k: entries[k]["used"])
+            total -= entries.pop(oldest)["size"]
+            try:
+                os.remove(os.path.join(OCR_CACHE_DIR, f"{oldest}.txt"))
+            except FileNotFoundError:
+                pass
+        index["keys"] = {k: v for k, v in index["keys"].items() if v in entries}
+        _save_ocr_cache_index(index)
+
+async def recognize_photo(photo) -> tuple:
+    """
+    OCR text of a Telegram photo: cache by file_unique_id (no download), then by image hash, then the provider.
+    Returns (text, from_cache).
+    """
+    text = await run_disk(ocr_cache_get, photo.file_unique_id)
+    if text is not None:
+        return text, True
+    tg_file = await photo.get_file()
+    content = bytes(await tg_file.download_as_bytearray())
+    image_sha = hashlib.sha256(content).hexdigest()
+    text = await run_disk(ocr_cache_get, photo.file_unique_id, image_sha)
+    if text is not None:
+        return text, True
+    text = await ocr_image(content, "telegram_photo.jpg")
+    # Empty text is a failed recognition (e.g. a per-page error code); caching it would pin the failure.
+    if text.strip():
+        await run_disk(ocr_cache_put, text, photo.file_unique_id, image_sha)
+    return text, False
 
 # ==============================
 # CSV COLUMNS
@@ -759,72 +1297,179 @@ PERF_FIELDS = ["date", "shift_type", "hala", "group", "sap", "surname", "percent
 SUMMARY_FIELDS = ["date", "shift_type", "total_percent", "agency_percent"]
 WEEKLY_FIELDS = ["weekday", "sap", "surname", "default_shift"]
 
-def ensure_employee_columns(r: dict) -> dict:
+class Row(MutableMapping):
+    """
+    Compact table row: one slot per column instead of a per-row dict.
+    Keeps the dict API (r["sap"], r.get, r.copy, r.update, csv.DictWriter) so callers do not change.
+    """
+    __slots__ = ()
+    FIELDS = ()
+    _FIELD_SET = frozenset()
+
+    def __init__(self, *values):
+        for k, v in zip(self.FIELDS, values):
+            setattr(self, k, v)
+
+    def __getitem__(self, k):
+        if k not in self._FIELD_SET:
+            raise KeyError(k)
+        return getattr(self, k)
+
+    def get(self, k, default=None):
+        if k not in self._FIELD_SET:
+            return default
+        return getattr(self, k)
+
+    def __setitem__(self, k, v):
+        if k not in self._FIELD_SET:
+            raise KeyError(k)
+        setattr(self, k, v)
+
+    def __delitem__(self, k):
+        raise TypeError("row columns cannot be deleted")
+
+    def __contains__(self, k):
+        return k in self._FIELD_SET
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def copy(self):
+        return type(self)(*[getattr(self, k) for k in self.FIELDS])
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+class EmployeeRow(Row):
+    FIELDS = tuple(EMPLOYEE_FIELDS)
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = FIELDS
+
+class ShiftRow(Row):
+    FIELDS = tuple(SHIFT_FIELDS)
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = FIELDS
+
+_date_keys_cache = {}
+
+def date_keys(date_str: str) -> tuple:
+    """(ordinal, 'MM.YYYY') of a DD.MM.YYYY date, (0, '') when it does not parse. Memoized per date."""
+    keys = _date_keys_cache.get(date_str)
+    if keys is None:
+        dt = parse_ddmmyyyy(date_str)
+        keys = (dt.toordinal(), dt.strftime("%m.%Y")) if dt else (0, "")
+        if len(_date_keys_cache) < 20000:
+            _date_keys_cache[date_str] = keys
+    return keys
+
+class PerfRow(Row):
+    """
+    Besides the CSV columns it carries values parsed once at load/write time:
+    pct (float or None), day (date ordinal, 0 if no valid date) and month ('MM.YYYY').
+    """
+    FIELDS = tuple(PERF_FIELDS)
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = FIELDS + ("pct", "day", "month")
+
+    def __init__(self, *values):
+        super().__init__(*values)
+        self.pct = safe_float(self.percent)
+        self.day, self.month = date_keys(self.date)
+
+    def __setitem__(self, k, v):
+        super().__setitem__(k, v)
+        if k == "percent":
+            self.pct = safe_float(v)
+        elif k == "date":
+            self.day, self.month = date_keys(v)
+
+class SummaryRow(Row):
+    FIELDS = tuple(SUMMARY_FIELDS)
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = FIELDS
+
+class WeeklyRow(Row):
+    FIELDS = tuple(WEEKLY_FIELDS)
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = FIELDS
+
+# Dates, shift types, halls, groups, SAPs and names repeat across thousands of rows:
+# interned, every row points at one shared string.
+_intern = sys.intern
+
+def ensure_employee_columns(r) -> EmployeeRow:
     sap = normalize_text(r.get("sap", "") or r.get("SAP", ""))
-    return {
-        "sap": sap,
-        "surname": normalize_text(r.get("surname", "") or r.get("name", "")).upper(),
-        "locker": normalize_text(r.get("locker", "")),
-        "knife": normalize_text(r.get("knife", "")),
-        "shoe_size": normalize_text(r.get("shoe_size", "")),
-        "shoe_type": normalize_text(r.get("shoe_type", "")) or "unknown",
-        "address": normalize_text(r.get("address", "") or r.get("Address", "")),
-        "status": normalize_text(r.get("status", "")) or "active",
-    }
-
-def ensure_shift_columns(r: dict) -> dict:
-    return {
-        "date": normalize_text(r.get("date", "")),
-        "shift_type": normalize_shift_type(r.get("shift_type", "")) or normalize_text(r.get("shift_type", "")),
-        "hala": normalize_text(r.get("hala", "")),
-        "group": normalize_text(r.get("group", "")),
-        "sap": normalize_text(r.get("sap", "")),
-        "surname": normalize_text(r.get("surname", "")).upper(),
-    }
+    return EmployeeRow(
+        _intern(sap),
+        _intern(normalize_text(r.get("surname", "") or r.get("name", "")).upper()),
+        normalize_text(r.get("locker", "")),
+        normalize_text(r.get("knife", "")),
+        _intern(normalize_text(r.get("shoe_size", ""))),
+        _intern(normalize_text(r.get("shoe_type", "")) or "unknown"),
+        normalize_text(r.get("address", "") or r.get("Address", "")),
+        _intern(normalize_text(r.get("status", "")) or "active"),
+    )
 
-def ensure_perf_columns(r: dict) -> dict:
-    return {
-        "date": normalize_text(r.get("date", "")),
-        "shift_type": normalize_shift_type(r.get("shift_type", "")) or normalize_text(r.get("shift_type", "")),
-        "hala": normalize_text(r.get("hala", "")),
-        "group": normalize_text(r.get("group", "")),
-        "sap": normalize_text(r.get("sap", "")),
-        "surname": normalize_text(r.get("surname", "")).upper(),
-        "percent": normalize_text(r.get("percent", "")),
-    }
+def ensure_shift_columns(r) -> ShiftRow:
+    return ShiftRow(
+        _intern(normalize_text(r.get("date", ""))),
+        _intern(normalize_shift_type(r.get("shift_type", "")) or normalize_text(r.get("shift_type", ""))),
+        _intern(normalize_text(r.get("hala", ""))),
+        _intern(normalize_text(r.get("group", ""))),
+        _intern(normalize_text(r.get("sap", ""))),
+        _intern(normalize_text(r.get("surname", "")).upper()),
+    )
 
-def ensure_summary_columns(r: dict) -> dict:
-    return {
-        "date": normalize_text(r.get("date", "")),
-        "shift_type": normalize_shift_type(r.get("shift_type", "")) or normalize_text(r.get("shift_type", "")),
-        "total_percent": normalize_text(r.get("total_percent", "")),
-        "agency_percent": normalize_text(r.get("agency_percent", "")),
-    }
+def ensure_perf_columns(r) -> PerfRow:
+    return PerfRow(
+        _intern(normalize_text(r.get("date", ""))),
+        _intern(normalize_shift_type(r.get("shift_type", "")) or normalize_text(r.get("shift_type", ""))),
+        _intern(normalize_text(r.get("hala", ""))),
+        _intern(normalize_text(r.get("group", ""))),
+        _intern(normalize_text(r.get("sap", ""))),
+        _intern(normalize_text(r.get("surname", "")).upper()),
+        normalize_text(r.get("percent", "")),
+    )
 
+def ensure_summary_columns(r) -> SummaryRow:
+    return SummaryRow(
+        _intern(normalize_text(r.get("date", ""))),
+        _intern(normalize_shift_type(r.get("shift_type", "")) or normalize_text(r.get("shift_type", ""))),
+        normalize_text(r.get("total_percent", "")),
+        normalize_text(r.get("agency_percent", "")),
+    )
 
-def ensure_weekly_columns(r: dict) -> dict:
-    return {
-        "weekday": normalize_text(r.get("weekday", "")),
-        "sap": normalize_text(r.get("sap", "")),
-        "surname": normalize_text(r.get("surname", "")).upper(),
-        "default_shift": normalize_shift_type(r.get("default_shift", "")) or "none",
-    }
+def ensure_weekly_columns(r) -> WeeklyRow:
+    return WeeklyRow(
+        _intern(normalize_text(r.get("weekday", ""))),
+        _intern(normalize_text(r.get("sap", ""))),
+        _intern(normalize_text(r.get("surname", "")).upper()),
+        _intern(normalize_shift_type(r.get("default_shift", "")) or "none"),
+    )
 
 # ==============================
 # DB
 # ==============================
 
+FILE_CREATE_LOCK = threading.Lock()
+
 def ensure_file(path, fields):
     if os.path.exists(path):
         return
-    with WRITE_LOCK:
+    with FILE_CREATE_LOCK:
         if not os.path.exists(path):
             atomic_write_csv(path, fields, [])
 
 def ensure_all_files():
+    if STORAGE_BACKEND == "sqlite":
+        sqlite_init_schema()
+        return
     ensure_file(EMPLOYEES_DB_PATH, EMPLOYEE_FIELDS)
-    ensure_file(SHIFTS_DB_PATH, SHIFT_FIELDS)
-    ensure_file(PERF_DB_PATH, PERF_FIELDS)
+    os.makedirs(SHIFTS_PARTITION_DIR, exist_ok=True)
+    os.makedirs(PERF_PARTITION_DIR, exist_ok=True)
     ensure_file(SHIFT_SUMMARY_DB_PATH, SUMMARY_FIELDS)
     ensure_file(WEEKLY_SHIFT_DB_PATH, WEEKLY_FIELDS)
 
@@ -861,6 +1506,10 @@ def copy_legacy_root_files_to_data_if_needed():
             continue
         if _csv_has_rows(target_path):
             continue
+        if target_path == SHIFTS_DB_PATH and _disk_partitions("shifts"):
+            continue
+        if target_path == PERF_DB_PATH and _disk_partitions("perf"):
+            continue
         try:
             os.makedirs(os.path.dirname(target_path), exist_ok=True)
             with open(legacy_name, "rb") as src, open(target_path, "wb") as dst:
@@ -870,55 +1519,1054 @@ def copy_legacy_root_files_to_data_if_needed():
             print(f"Legacy copy warning for {legacy_name}: {e}")
 
 def read_csv_cached(path, fields, cache, normalizer, force=False):
+    """
+    Cached rows stay valid while the file stat signature matches.
+    cache["gen"] counts content changes of the cache; it is bumped by every reload and write.
+    """
     ensure_file(path, fields)
-    mtime = _file_mtime(path)
-    if not force and cache["mtime"] is not None and cache["mtime"] == mtime:
+    sig = _file_sig(path)
+    if not force and cache["mtime"] is not None and cache["mtime"] == sig:
         return cache["rows"]
+    gen = cache["gen"]
     rows = []
     with open(path, "r", encoding="utf-8", newline="") as f:
         reader = csv.DictReader(f)
         for r in reader:
             rows.append(normalizer(r))
-    cache["rows"] = rows
-    cache["mtime"] = mtime
+    with cache["lock"]:
+        if cache["gen"] != gen:
+            # A write landed while we were parsing; its rows are at least as new as ours.
+            return cache["rows"]
+        cache["rows"] = rows
+        cache["index"] = build_row_index(rows)
+        cache["mtime"] = sig
+        cache["gen"] += 1
     return rows
 
 def write_csv_db(path, fields, rows, cache, normalizer):
-    with WRITE_LOCK:
+    with cache["lock"]:
         norm = [normalizer(r) for r in rows]
         atomic_write_csv(path, fields, norm)
         cache["rows"] = norm
-        cache["mtime"] = _file_mtime(path)
+        cache["index"] = build_row_index(norm)
+        cache["mtime"] = _file_sig(path)
+        cache["gen"] += 1
+
+# ==============================
+# STORAGE ENGINE
+# ==============================
+
+# Key of one performance value: a worker has at most one % per date and shift.
+PERF_KEY = ("date", "shift_type", "sap")
+SHIFT_KEY = ("date", "shift_type", "sap")
+SUMMARY_KEY = ("date", "shift_type")
+
+SQLITE_INDEXES = {
+    "shifts": [("date", "shift_type"), ("sap",)],
+    "perf": [("date", "shift_type", "sap"), ("sap",)],
+    "summary": [("date", "shift_type")],
+    "weekly": [("weekday",), ("sap",)],
+    "employees": [("sap",)],
+}
+
+_sqlite_local = threading.local()
+
+def table_spec(name: str) -> dict:
+    return {
+        "employees": {"path": EMPLOYEES_DB_PATH, "fields": EMPLOYEE_FIELDS, "cache": _employee_cache, "normalizer": ensure_employee_columns},
+        "shifts": {"path": SHIFTS_DB_PATH, "fields": SHIFT_FIELDS, "cache": _shift_cache, "normalizer": ensure_shift_columns, "partition_dir": SHIFTS_PARTITION_DIR},
+        "perf": {"path": PERF_DB_PATH, "fields": PERF_FIELDS, "cache": _perf_cache, "normalizer": ensure_perf_columns, "partition_dir": PERF_PARTITION_DIR},
+        "summary": {"path": SHIFT_SUMMARY_DB_PATH, "fields": SUMMARY_FIELDS, "cache": _summary_cache, "normalizer": ensure_summary_columns},
+        "weekly": {"path": WEEKLY_SHIFT_DB_PATH, "fields": WEEKLY_FIELDS, "cache": _weekly_cache, "normalizer": ensure_weekly_columns},
+    }[name]
+
+TABLE_NAMES = ["employees", "shifts", "perf", "summary", "weekly"]
+
+def table_lock(name: str):
+    """
+    Lock of one table: held by every write and by reloads of its cache.
+    A thread holding several table locks must take them in TABLE_NAMES order.
+    """
+    return table_spec(name)["cache"]["lock"]
+
+@contextmanager
+def table_txn(*names):
+    """
+    Read-modify-write transaction over one or more tables:
+        with table_txn("employees"):
+            write_employees(upsert_employee(read_employees(), emp))
+    Locks are taken in TABLE_NAMES order, so two transactions never deadlock.
+    """
+    locks = [table_lock(n) for n in TABLE_NAMES if n in names]
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+def _q(ident: str) -> str:
+    return '"' + ident.replace('"', '""') + '"'
+
+def sqlite_conn():
+    """One connection per thread, WAL mode so readers never block the writer."""
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _sqlite_local.conn = conn
+    return conn
+
+def sqlite_init_schema():
+    conn = sqlite_conn()
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS _table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        for name in TABLE_NAMES:
+            fields = table_spec(name)["fields"]
+            cols = ", ".join(f"{_q(c)} TEXT NOT NULL DEFAULT ''" for c in fields)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {_q(name)} ({cols})")
+            for cols_idx in SQLITE_INDEXES.get(name, []):
+                idx_name = f"idx_{name}_" + "_".join(cols_idx)
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {_q(idx_name)} ON {_q(name)} ({', '.join(_q(c) for c in cols_idx)})")
+            conn.execute("INSERT OR IGNORE INTO _table_versions (name, version) VALUES (?, 0)", (name,))
+
+def _sqlite_version(conn, name: str) -> int:
+    row = conn.execute("SELECT version FROM _table_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def _sqlite_bump_version(conn, name: str) -> int:
+    conn.execute("UPDATE _table_versions SET version = version + 1 WHERE name = ?", (name,))
+    return _sqlite_version(conn, name)
+
+def _sqlite_insert(conn, name: str, fields: list, rows: list):
+    sql = f"INSERT INTO {_q(name)} ({', '.join(_q(c) for c in fields)}) VALUES ({', '.join('?' for _ in fields)})"
+    conn.executemany(sql, [tuple(r.get(c, "") for c in fields) for r in rows])
+
+def _sqlite_where(where: dict):
+    keys = sorted(where)
+    return " AND ".join(f"{_q(k)} = ?" for k in keys), tuple(where[k] for k in keys)
+
+def read_sqlite_cached(name, force=False):
+    spec = table_spec(name)
+    cache = spec["cache"]
+    conn = sqlite_conn()
+    version = _sqlite_version(conn, name)
+    if not force and cache["mtime"] is not None and cache["mtime"] == version:
+        return cache["rows"]
+    fields = spec["fields"]
+    normalizer = spec["normalizer"]
+    cur = conn.execute(f"SELECT {', '.join(_q(c) for c in fields)} FROM {_q(name)} ORDER BY rowid")
+    rows = [normalizer(dict(zip(fields, r))) for r in cur]
+    cache["rows"] = rows
+    cache["index"] = build_row_index(rows)
+    _overlay_pending_updates(name, cache)
+    cache["mtime"] = version
+    cache["gen"] += 1
+    if name == "perf":
+        perf_aggs_forget()
+    return rows
+
+def write_sqlite_db(name, rows):
+    spec = table_spec(name)
+    cache = spec["cache"]
+    with cache["lock"]:
+        norm = [spec["normalizer"](r) for r in rows]
+        conn = sqlite_conn()
+        with conn:
+            conn.execute(f"DELETE FROM {_q(name)}")
+            _sqlite_insert(conn, name, spec["fields"], norm)
+            version = _sqlite_bump_version(conn, name)
+        cache["rows"] = norm
+        cache["index"] = build_row_index(norm)
+        cache["mtime"] = version
+        cache["gen"] += 1
+        if name == "perf":
+            perf_aggs_forget()
+
+def build_row_index(rows: list) -> dict:
+    """
+    Lookup dicts over cached rows: by date, (date, shift_type), sap and month MM.YYYY.
+    Buckets hold the cached row dicts themselves, in table order.
+    """
+    index = {"date": {}, "date_shift": {}, "sap": {}, "month": {}}
+    for r in rows:
+        d = r.get("date", "")
+        if d:
+            index["date"].setdefault(d, []).append(r)
+            index["date_shift"].setdefault((d, safe_lower(r.get("shift_type", ""))), []).append(r)
+            month = date_keys(d)[1]
+            if month:
+                index["month"].setdefault(month, []).append(r)
+        sap = r.get("sap", "")
+        if sap:
+            index["sap"].setdefault(sap, []).append(r)
+    return index
+
+def row_matches(r, where: dict) -> bool:
+    for k, v in where.items():
+        if r.get(k, "") != v:
+            return False
+    return True
+
+def _delete_matcher(delete_where):
+    """
+    Row predicate for a list of delete filters. Filters over the same fields (every upsert) become
+    one key set, so a batch of N keys against M rows costs N + M instead of N x M.
+    """
+    if not delete_where:
+        return lambda r: False
+    fields = sorted(delete_where[0])
+    if all(sorted(w) == fields for w in delete_where):
+        keys = {tuple(w[k] for k in fields) for w in delete_where}
+        return lambda r: tuple(r.get(k, "") for k in fields) in keys
+    return lambda r: any(row_matches(r, w) for w in delete_where)
+
+def _apply_changes_in_memory(rows: list, delete_where, update_where, insert_rows) -> tuple:
+    """Returns (new_rows, removed_count, updated_count). Updates mutate matching rows in place."""
+    removed = 0
+    updated = 0
+    out = []
+    deleted = _delete_matcher(delete_where)
+    for r in rows:
+        if deleted(r):
+            removed += 1
+            continue
+        for w, values in update_where:
+            if row_matches(r, w):
+                r.update(values)
+                updated += 1
+        out.append(r)
+    out.extend(insert_rows)
+    return out, removed, updated
+
+def change_rows(name, delete_where=(), insert_rows=(), update_where=()) -> dict:
+    """
+    Row-level change of one table: delete rows matching any filter in delete_where,
+    apply (filter, values) updates, then append insert_rows.
+    SQLite touches only the affected rows; the CSV engine rewrites the file once.
+    """
+    spec = table_spec(name)
+    normalizer = spec["normalizer"]
+    delete_where = [dict(w) for w in delete_where]
+    update_where = [(dict(w), dict(v)) for w, v in update_where]
+    insert_rows = [normalizer(r) for r in insert_rows]
+
+    with table_lock(name):
+        flush_pending_before_write(name)
+        if name != "perf":
+            return _change_rows_locked(name, delete_where, update_where, insert_rows)
+        # Monthly aggregates follow the change: minus the rows it removes, plus the inserted ones.
+        removed_rows = None if update_where else _perf_rows_matching(delete_where)
+        result = _change_rows_locked(name, delete_where, update_where, insert_rows)
+        _perf_aggs_apply(removed_rows, insert_rows)
+        return result
+
+def _change_rows_locked(name, delete_where, update_where, insert_rows) -> dict:
+    spec = table_spec(name)
+    normalizer = spec["normalizer"]
+    if STORAGE_BACKEND == "sqlite":
+        cache = spec["cache"]
+        conn = sqlite_conn()
+        with conn:
+            cached_ok = cache["mtime"] is not None and cache["mtime"] == _sqlite_version(conn, name)
+            removed = 0
+            updated = 0
+            for w in delete_where:
+                clause, params = _sqlite_where(w)
+                removed += conn.execute(f"DELETE FROM {_q(name)} WHERE {clause}", params).rowcount
+            for w, values in update_where:
+                clause, params = _sqlite_where(w)
+                sets = ", ".join(f"{_q(k)} = ?" for k in values)
+                updated += conn.execute(
+                    f"UPDATE {_q(name)} SET {sets} WHERE {clause}",
+                    tuple(values.values()) + params,
+                ).rowcount
+            _sqlite_insert(conn, name, spec["fields"], insert_rows)
+            version = _sqlite_bump_version(conn, name)
+        if cached_ok:
+            cache["rows"], _, _ = _apply_changes_in_memory(cache["rows"], delete_where, update_where, insert_rows)
+            cache["index"] = build_row_index(cache["rows"])
+            cache["mtime"] = version
+            cache["gen"] += 1
+        else:
+            cache["mtime"] = None
+        return {"removed": removed, "updated": updated, "inserted": len(insert_rows)}
+
+    if name == "perf":
+        return append_perf_journal(delete_where, update_where, insert_rows)
+    if spec.get("partition_dir"):
+        return change_partitioned_rows(name, delete_where, update_where, insert_rows)
+
+    rows = [r.copy() for r in read_table(name)]
+    new_rows, removed, updated = _apply_changes_in_memory(rows, delete_where, update_where, insert_rows)
+    if removed or updated or insert_rows:
+        write_csv_db(spec["path"], spec["fields"], new_rows, spec["cache"], normalizer)
+    return {"removed": removed, "updated": updated, "inserted": len(insert_rows)}
+
+def upsert_rows(name, rows, key_fields) -> dict:
+    """Replace rows with the same key (e.g. date+shift_type+sap), insert the rest."""
+    rows = list(rows)
+    keys = {tuple(r[k] for k in key_fields) for r in rows}
+    return change_rows(
+        name,
+        delete_where=[dict(zip(key_fields, key)) for key in keys],
+        insert_rows=rows,
+    )
+
+# ==============================
+# PERFORMANCE AGGREGATES
+# ==============================
+
+# Materialized perf aggregates, built on first use and then kept current by change_rows("perf"):
+#   "months": {"MM.YYYY": {sap: agg}}, "dirty": {"MM.YYYY": {sap}} -- monthly rankings;
+#   "saps": {sap: stats}, "saps_dirty": {sap} -- employee card (running totals + recent shifts).
+# A dirty entry lost its min/max/last/recent row and is recomputed on the next read.
+_perf_aggs = {"months": {}, "dirty": {}, "saps": {}, "saps_dirty": set()}
+
+def _agg_add(aggs: dict, r):
+    p = r.pct
+    if p is None or not r["sap"]:
+        return
+    a = aggs.get(r["sap"])
+    if a is None:
+        aggs[r["sap"]] = {"sum": p, "count": 1, "min": p, "max": p, "last": r["date"], "last_day": r.day, "surname": r["surname"]}
+        return
+    a["sum"] += p
+    a["count"] += 1
+    a["min"] = min(a["min"], p)
+    a["max"] = max(a["max"], p)
+    if r.day >= a["last_day"]:
+        a["last"], a["last_day"], a["surname"] = r["date"], r.day, r["surname"]
+
+def _agg_remove(aggs: dict, dirty: set, r):
+    p = r.pct
+    a = aggs.get(r["sap"]) if p is not None else None
+    if a is None:
+        return
+    a["sum"] -= p
+    a["count"] -= 1
+    if a["count"] <= 0:
+        del aggs[r["sap"]]
+        dirty.discard(r["sap"])
+    elif p <= a["min"] or p >= a["max"] or r.day == a["last_day"]:
+        dirty.add(r["sap"])
+
+def _sap_stats_empty() -> dict:
+    return {"count": 0, "sum": 0.0, "last": "", "last_percent": "", "last_key": None, "recent": deque(maxlen=SAP_RECENT_SHIFTS)}
+
+def _sap_stats_key(r) -> tuple:
+    return (r.day, safe_lower(r["shift_type"]) == "night", r["date"], r.pct)
+
+def _sap_stats_add(s: dict, r):
+    key = _sap_stats_key(r)
+    s["count"] += 1
+    s["sum"] += r.pct
+    if s["last_key"] is None or key[:2] >= s["last_key"][:2]:
+        s["last"], s["last_percent"], s["last_key"] = r["date"], r["percent"], key
+    recent = s["recent"]
+    if not recent or key >= recent[-1]:
+        recent.append(key)
+    elif len(recent) < recent.maxlen or key > recent[0]:
+        s["recent"] = deque(sorted([*recent, key])[-recent.maxlen:], maxlen=recent.maxlen)
+
+def _sap_stats_remove(s: dict, r):
+    key = _sap_stats_key(r)
+    s["count"] -= 1
+    s["sum"] -= r.pct
+    if s["count"] <= 0:
+        s.update(_sap_stats_empty())
+    elif key == s["last_key"] or key in s["recent"]:
+        _perf_aggs["saps_dirty"].add(r["sap"])
+
+def perf_aggs_forget(month: str = None):
+    """
+    Drop the aggregates of one month MM.YYYY (or all); they are rebuilt on the next read.
+    Per-SAP stats span every month, so they are dropped either way.
+    """
+    if month is None:
+        _perf_aggs["months"].clear()
+        _perf_aggs["dirty"].clear()
+    else:
+        _perf_aggs["months"].pop(month, None)
+        _perf_aggs["dirty"].pop(month, None)
+    _perf_aggs["saps"].clear()
+    _perf_aggs["saps_dirty"].clear()
+
+def _perf_rows_matching(delete_where):
+    """Perf rows a delete would remove, or None when some filter has no date."""
+    by_date = {}
+    for w in delete_where:
+        if "date" not in w:
+            return None
+        by_date.setdefault(w["date"], []).append(w)
+    out = []
+    for date_str, filters in by_date.items():
+        deleted = _delete_matcher(filters)
+        out.extend(r for r in read_rows_for_date("perf", date_str) if deleted(r))
+    return out
+
+def _perf_aggs_apply(removed, inserted):
+    if removed is None:
+        perf_aggs_forget()
+        return
+    months = _perf_aggs["months"]
+    saps = _perf_aggs["saps"]
+    for r in removed:
+        if r.month in months:
+            _agg_remove(months[r.month], _perf_aggs["dirty"].setdefault(r.month, set()), r)
+        if r["sap"] in saps and r.pct is not None:
+            _sap_stats_remove(saps[r["sap"]], r)
+    for r in inserted:
+        if r.month in months:
+            _agg_add(months[r.month], r)
+        if r["sap"] in saps and r.pct is not None:
+            _sap_stats_add(saps[r["sap"]], r)
+
+def sap_stats(sap: str) -> dict:
+    """
+    {"count", "sum", "last", "last_percent", "last_key", "recent"} of one SAP over all perf history.
+    "recent" holds the newest SAP_RECENT_SHIFTS shifts as (day, is_night, date, pct), oldest first.
+    """
+    with table_lock("perf"):
+        # Signature check of every month; a reload from disk forgets the stats. Months that exist
+        # only in the journal were written by this process and are cached already.
+        if STORAGE_BACKEND == "sqlite":
+            read_table("perf")
+        else:
+            for part in set(_disk_partitions("perf")) | set(_perf_cache.get("parts", {})):
+                _partition_entry("perf", part)
+        s = _perf_aggs["saps"].get(sap)
+        if s is None or sap in _perf_aggs["saps_dirty"]:
+            s = _sap_stats_empty()
+            for r in read_rows_for_sap("perf", sap):
+                if r.pct is not None:
+                    _sap_stats_add(s, r)
+            _perf_aggs["saps"][sap] = s
+            _perf_aggs["saps_dirty"].discard(sap)
+        return s
+
+def month_aggregates(month: str) -> dict:
+    """{sap: {"sum", "count", "min", "max", "last", "last_day", "surname"}} of one month MM.YYYY."""
+    with table_lock("perf"):
+        # Revalidates the cached month; a reload from disk forgets its aggregates.
+        _index_holders("perf", partition_for_month(month))
+        aggs = _perf_aggs["months"].get(month)
+        dirty = _perf_aggs["dirty"].pop(month, None)
+        if aggs is None:
+            aggs = {}
+            for r in read_rows_for_month("perf", month):
+                _agg_add(aggs, r)
+            _perf_aggs["months"][month] = aggs
+        elif dirty:
+            fresh = {}
+            for r in read_rows_for_month("perf", month):
+                if r["sap"] in dirty:
+                    _agg_add(fresh, r)
+            for sap in dirty:
+                if sap in fresh:
+                    aggs[sap] = fresh[sap]
+                else:
+                    aggs.pop(sap, None)
+        return aggs
+
+# ==============================
+# MONTH PARTITIONS (CSV ENGINE)
+# ==============================
+
+def partition_for_date(date_str: str) -> str:
+    """'15.10.2026' (or '5.10.2026') -> '2026-10'. Rows without a valid date go to 'undated'."""
+    d = date_str or ""
+    if len(d) == 10 and d[2] == "." and d[5] == "." and d[:2].isdigit() and d[3:5].isdigit() and d[6:].isdigit():
+        return f"{d[6:]}-{d[3:5]}"
+    month = date_keys(d)[1]
+    return f"{month[3:]}-{month[:2]}" if month else "undated"
+
+def partition_for_month(month: str) -> str:
+    """'10.2026' -> '2026-10'."""
+    return partition_for_date("01." + normalize_text(month))
+
+def month_for_partition(part: str) -> str:
+    """'2026-10' -> '10.2026'; 'undated' -> ''."""
+    return f"{part[5:]}.{part[:4]}" if part != "undated" else ""
+
+def partition_path(name, part) -> str:
+    return os.path.join(table_spec(name)["partition_dir"], part + ".csv")
+
+def _disk_partitions(name) -> list:
+    d = table_spec(name)["partition_dir"]
+    if not os.path.isdir(d):
+        return []
+    return sorted(fn[:-4] for fn in os.listdir(d) if fn.endswith(".csv"))
+
+def list_partitions(name) -> list:
+    parts = set(_disk_partitions(name))
+    if name == "perf":
+        # Months that so far exist only in the journal.
+        for e in perf_journal_entries():
+            for r in e.get("insert", []):
+                parts.add(partition_for_date(normalize_text(r.get("date", ""))))
+    return sorted(parts)
+
+def _affected_partitions(delete_where, update_where, insert_rows):
+    """Partitions a change can touch, or None when some filter has no date (then all of them)."""
+    parts = set()
+    for w in list(delete_where) + [w for w, _ in update_where]:
+        if "date" not in w:
+            return None
+        parts.add(partition_for_date(w["date"]))
+    for r in insert_rows:
+        parts.add(partition_for_date(normalize_text(r.get("date", ""))))
+    return parts
+
+def _partition_sig(name, part):
+    sig = _file_sig(partition_path(name, part))
+    if name == "perf":
+        return (sig, _file_size(PERF_JOURNAL_PATH))
+    return sig
+
+def _partition_entry(name, part, force=False) -> dict:
+    spec = table_spec(name)
+    parts = spec["cache"].setdefault("parts", {})
+    entry = parts.get(part)
+    if not force and entry is not None and entry["sig"] == _partition_sig(name, part):
+        return entry
+    with table_lock(name):
+        sig = _partition_sig(name, part)
+        path = partition_path(name, part)
+        rows = _load_csv_rows(path, spec["normalizer"]) if os.path.exists(path) else []
+        if name == "perf":
+            rows = [r for r in _replay_perf_journal(rows, perf_journal_entries()) if partition_for_date(r["date"]) == part]
+        entry = {"sig": sig, "rows": rows, "index": build_row_index(rows)}
+        _overlay_pending_updates(name, entry)
+        spec["cache"].setdefault("parts", {})[part] = entry
+        spec["cache"]["gen"] += 1
+        if name == "perf":
+            perf_aggs_forget(month_for_partition(part))
+    return entry
+
+def read_partition(name, part, force=False) -> list:
+    """Rows of one month. Only this partition file (plus the perf journal) is read."""
+    return _partition_entry(name, part, force)["rows"]
+
+def read_partitioned_table(name, force=False) -> list:
+    """Whole table. Unchanged partitions come from their cache, changed ones are re-read."""
+    cache = table_spec(name)["cache"]
+    names = list_partitions(name)
+    for part in names:
+        read_partition(name, part, force)
+    parts = cache.setdefault("parts", {})
+    for part in list(parts):
+        if part not in names:
+            parts.pop(part)
+    sig = tuple((part, parts[part]["sig"]) for part in names)
+    if not force and cache["mtime"] is not None and cache["mtime"] == sig:
+        return cache["rows"]
+    rows = []
+    for part in names:
+        rows.extend(parts[part]["rows"])
+    cache["rows"] = rows
+    cache["mtime"] = sig
+    return rows
+
+def _write_partition(name, part, rows):
+    spec = table_spec(name)
+    path = partition_path(name, part)
+    if rows:
+        os.makedirs(spec["partition_dir"], exist_ok=True)
+        atomic_write_csv(path, spec["fields"], rows)
+    elif os.path.exists(path):
+        os.remove(path)
+    spec["cache"].setdefault("parts", {})[part] = {"sig": _partition_sig(name, part), "rows": rows, "index": build_row_index(rows)}
+    spec["cache"]["mtime"] = None
+    spec["cache"]["gen"] += 1
+
+def write_partitioned_table(name, rows):
+    spec = table_spec(name)
+    with table_lock(name):
+        if name == "perf":
+            perf_aggs_forget()
+        by_part = {}
+        for r in rows:
+            r = spec["normalizer"](r)
+            by_part.setdefault(partition_for_date(r["date"]), []).append(r)
+        spec["cache"]["parts"] = {}
+        for part in sorted(set(_disk_partitions(name)) | set(by_part)):
+            _write_partition(name, part, by_part.get(part, []))
+        if name == "perf" and os.path.exists(PERF_JOURNAL_PATH):
+            # A full rewrite already contains every journaled change.
+            os.remove(PERF_JOURNAL_PATH)
+            for part, entry in spec["cache"]["parts"].items():
+                entry["sig"] = _partition_sig(name, part)
+
+def change_partitioned_rows(name, delete_where, update_where, insert_rows) -> dict:
+    """Rewrites only the months the change touches."""
+    affected = _affected_partitions(delete_where, update_where, insert_rows)
+    if affected is None:
+        affected = set(list_partitions(name)) | {partition_for_date(r["date"]) for r in insert_rows}
+    removed = 0
+    updated = 0
+    with table_lock(name):
+        for part in sorted(affected):
+            rows = [r.copy() for r in read_partition(name, part)]
+            ins = [r for r in insert_rows if partition_for_date(r["date"]) == part]
+            new_rows, rm, up = _apply_changes_in_memory(rows, delete_where, update_where, ins)
+            if rm or up or ins:
+                _write_partition(name, part, new_rows)
+            removed += rm
+            updated += up
+    return {"removed": removed, "updated": updated, "inserted": len(insert_rows)}
+
+def _index_holders(name, part=None) -> list:
+    """Cache entries whose indexes cover the lookup: the whole table, one month, or every month."""
+    spec = table_spec(name)
+    if STORAGE_BACKEND == "sqlite" or not spec.get("partition_dir"):
+        read_table(name)
+        return [spec["cache"]]
+    if part is not None:
+        return [_partition_entry(name, part)]
+    read_partitioned_table(name)
+    return list(spec["cache"]["parts"].values())
+
+def _index_lookup(name, kind, key, part=None) -> list:
+    out = []
+    for holder in _index_holders(name, part):
+        out.extend(holder["index"][kind].get(key, ()))
+    return out
+
+def read_rows_for_date(name, date_str: str) -> list:
+    """Rows of one date; on the CSV engine only that month's partition is touched."""
+    return _index_lookup(name, "date", date_str, partition_for_date(date_str))
+
+def read_rows_for_date_shift(name, date_str: str, shift_type: str) -> list:
+    return _index_lookup(name, "date_shift", (date_str, safe_lower(shift_type)), partition_for_date(date_str))
+
+def read_rows_for_month(name, month: str) -> list:
+    """Rows of one month MM.YYYY."""
+    return _index_lookup(name, "month", month, partition_for_month(month))
+
+def read_rows_for_sap(name, sap: str) -> list:
+    return _index_lookup(name, "sap", sap)
+
+def migrate_single_files_to_partitions():
+    """One-shot: split legacy shifts.csv / performance.csv into month partitions."""
+    if STORAGE_BACKEND == "sqlite":
+        return
+    for name in TABLE_NAMES:
+        spec = table_spec(name)
+        if not spec.get("partition_dir") or _disk_partitions(name):
+            continue
+        path = spec["path"]
+        if not _csv_has_rows(path):
+            continue
+        rows = _load_csv_rows(path, spec["normalizer"])
+        if name == "perf":
+            rows = _replay_perf_journal(rows, _read_perf_journal())
+        write_partitioned_table(name, rows)
+        os.replace(path, path + ".migrated")
+        print(f"Split {path} into {len(_disk_partitions(name))} month partitions in {spec['partition_dir']}")
+
+def repartition_undated_rows():
+    """
+    One-shot: rows with unpadded dates ('5.10.2026') used to be filed under 'undated'.
+    Moves them into their month partition before anything reads the partitions
+    (including the CSV -> SQLite migration).
+    """
+    for name in TABLE_NAMES:
+        spec = table_spec(name)
+        if not spec.get("partition_dir"):
+            continue
+        path = partition_path(name, "undated")
+        if not os.path.exists(path):
+            continue
+        by_part = {}
+        for r in _load_csv_rows(path, spec["normalizer"]):
+            by_part.setdefault(partition_for_date(r["date"]), []).append(r)
+        moved = {part: rows for part, rows in by_part.items() if part != "undated"}
+        if not moved:
+            continue
+        with table_lock(name):
+            for part, rows in moved.items():
+                target = partition_path(name, part)
+                existing = _load_csv_rows(target, spec["normalizer"]) if os.path.exists(target) else []
+                _write_partition(name, part, existing + rows)
+            _write_partition(name, "undated", by_part.get("undated", []))
+            # _write_partition caches the raw file rows; perf partitions still need the journal replayed.
+            spec["cache"]["parts"] = {}
+        print(f"Moved {sum(len(r) for r in moved.values())} {name} rows from undated into {len(moved)} month partitions")
+
+# ==============================
+# PERFORMANCE JOURNAL (CSV ENGINE)
+# ==============================
+
+PERF_COMPACT_LOCK = threading.Lock()
+_perf_compact_wakeup = threading.Event()
+_perf_journal_cache = {"size": None, "entries": []}
+
+def _load_csv_rows(path, normalizer) -> list:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [normalizer(r) for r in csv.DictReader(f)]
+
+def _read_perf_journal(limit: int = None) -> list:
+    """Journal entries in write order. A torn last line (crash mid-append) is skipped."""
+    if not os.path.exists(PERF_JOURNAL_PATH):
+        return []
+    with open(PERF_JOURNAL_PATH, "rb") as f:
+        data = f.read() if limit is None else f.read(limit)
+    entries = []
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+def perf_journal_entries() -> list:
+    size = _file_size(PERF_JOURNAL_PATH)
+    if _perf_journal_cache["size"] != size:
+        _perf_journal_cache["entries"] = _read_perf_journal()
+        _perf_journal_cache["size"] = size
+    return _perf_journal_cache["entries"]
+
+def _replay_perf_journal(rows: list, entries: list) -> list:
+    for e in entries:
+        rows, _, _ = _apply_changes_in_memory(
+            rows,
+            e.get("delete", []),
+            [(w, v) for w, v in e.get("update", [])],
+            [ensure_perf_columns(r) for r in e.get("insert", [])],
+        )
+    return rows
+
+def append_perf_journal(delete_where, update_where, insert_rows) -> dict:
+    """Cost depends on the size of the change, not on the size of the performance history."""
+    with table_lock("perf"):
+        affected = _affected_partitions(delete_where, update_where, insert_rows)
+        if affected is None:
+            affected = set(list_partitions("perf")) | {partition_for_date(r["date"]) for r in insert_rows}
+        before = {part: read_partition("perf", part) for part in affected}
+        old_size = _file_size(PERF_JOURNAL_PATH)
+        entry = {
+            "ts": now_ts(),
+            "delete": delete_where,
+            "update": [[w, v] for w, v in update_where],
+            "insert": [{k: r[k] for k in PERF_FIELDS} for r in insert_rows],
+        }
+        with open(PERF_JOURNAL_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        new_size = _file_size(PERF_JOURNAL_PATH)
+        if _perf_journal_cache["size"] == old_size:
+            _perf_journal_cache["entries"].append(entry)
+            _perf_journal_cache["size"] = new_size
+
+        parts = _perf_cache.setdefault("parts", {})
+        removed = 0
+        updated = 0
+        for part, rows in before.items():
+            ins = [r for r in insert_rows if partition_for_date(r["date"]) == part]
+            new_rows, rm, up = _apply_changes_in_memory(list(rows), delete_where, update_where, ins)
+            parts[part] = {"sig": _partition_sig("perf", part), "rows": new_rows, "index": build_row_index(new_rows)}
+            removed += rm
+            updated += up
+        # Untouched months keep their rows; only the journal part of their signature moved.
+        for part, e in parts.items():
+            if part not in before and e["sig"] == (_file_sig(partition_path("perf", part)), old_size):
+                e["sig"] = (e["sig"][0], new_size)
+        _perf_cache["mtime"] = None
+        _perf_cache["gen"] += 1
+    if new_size >= PERF_COMPACT_MAX_BYTES:
+        _perf_compact_wakeup.set()
+    return {"removed": removed, "updated": updated, "inserted": len(insert_rows)}
+
+def compact_perf_journal() -> int:
+    """
+    Fold the journal into the month partitions it touches. The heavy rewrite runs outside
+    the perf table lock; entries appended meanwhile stay in the journal. Returns folded entry count.
+    """
+    with PERF_COMPACT_LOCK:
+        with table_lock("perf"):
+            offset = _file_size(PERF_JOURNAL_PATH)
+            if not offset:
+                return 0
+            entries = _read_perf_journal(offset)
+            affected = set()
+            for e in entries:
+                a = _affected_partitions(e.get("delete", []), e.get("update", []), e.get("insert", []))
+                if a is None:
+                    affected = None
+                    break
+                affected |= a
+            if affected is None:
+                affected = set(list_partitions("perf"))
+            base_sigs = {part: _file_sig(partition_path("perf", part)) for part in affected}
+
+        staged = {}
+        for part in affected:
+            path = partition_path("perf", part)
+            base = _load_csv_rows(path, ensure_perf_columns) if os.path.exists(path) else []
+            rows = [r for r in _replay_perf_journal(base, entries) if partition_for_date(r["date"]) == part]
+            if not rows:
+                staged[part] = None
+                continue
+            os.makedirs(PERF_PARTITION_DIR, exist_ok=True)
+            tmp_path = path + ".compact.tmp"
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=PERF_FIELDS)
+                writer.writeheader()
+                for r in rows:
+                    writer.writerow(r)
+            staged[part] = tmp_path
+
+        with table_lock("perf"):
+            if any(_file_sig(partition_path("perf", part)) != base_sigs[part] for part in affected):
+                # performance was fully rewritten meanwhile; that write already dropped the journal.
+                for tmp_path in staged.values():
+                    if tmp_path:
+                        os.remove(tmp_path)
+                return 0
+            parts = _perf_cache.setdefault("parts", {})
+            valid = {part for part, e in parts.items() if e["sig"] == _partition_sig("perf", part)}
+            with open(PERF_JOURNAL_PATH, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+            for part, tmp_path in staged.items():
+                path = partition_path("perf", part)
+                if tmp_path:
+                    os.replace(tmp_path, path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            if tail:
+                with open(PERF_JOURNAL_PATH + ".tmp", "wb") as f:
+                    f.write(tail)
+                os.replace(PERF_JOURNAL_PATH + ".tmp", PERF_JOURNAL_PATH)
+            else:
+                os.remove(PERF_JOURNAL_PATH)
+            _perf_journal_cache["size"] = None
+            # Content did not change, only where it lives: keep valid caches valid.
+            for part in valid:
+                parts[part]["sig"] = _partition_sig("perf", part)
+            _perf_cache["mtime"] = None
+        return len(entries)
+
+def perf_compactor_loop():
+    while True:
+        _perf_compact_wakeup.wait(PERF_COMPACT_INTERVAL_SEC)
+        _perf_compact_wakeup.clear()
+        try:
+            compact_perf_journal()
+        except Exception as e:
+            print(f"Perf journal compaction warning: {e}")
+
+def start_perf_compactor():
+    if STORAGE_BACKEND == "sqlite":
+        return
+    compact_perf_journal()
+    threading.Thread(target=perf_compactor_loop, daemon=True).start()
+
+def read_table(name, force=False):
+    if STORAGE_BACKEND == "sqlite":
+        return read_sqlite_cached(name, force)
+    spec = table_spec(name)
+    if spec.get("partition_dir"):
+        return read_partitioned_table(name, force)
+    return read_csv_cached(spec["path"], spec["fields"], spec["cache"], spec["normalizer"], force)
+
+def write_table(name, rows):
+    with table_lock(name):
+        flush_pending_before_write(name)
+        if STORAGE_BACKEND == "sqlite":
+            write_sqlite_db(name, rows)
+            return
+        spec = table_spec(name)
+        if spec.get("partition_dir"):
+            write_partitioned_table(name, rows)
+            return
+        write_csv_db(spec["path"], spec["fields"], rows, spec["cache"], spec["normalizer"])
+
+def invalidate_table_caches():
+    for name in TABLE_NAMES:
+        cache = table_spec(name)["cache"]
+        cache["mtime"] = None
+        cache.pop("parts", None)
+        cache["gen"] += 1
+    _perf_journal_cache["size"] = None
+    perf_aggs_forget()
+
+def import_table_from_csv(name, path) -> int:
+    """Load a CSV file (backup/restore format) into the active storage engine."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    # Buffered taps were aimed at the rows being replaced; flushing them later would edit the restored table.
+    discard_pending_updates(name)
+    spec = table_spec(name)
+    same_file = os.path.abspath(path) == os.path.abspath(spec["path"])
+    if STORAGE_BACKEND == "sqlite":
+        write_sqlite_db(name, rows)
+    elif spec.get("partition_dir"):
+        write_partitioned_table(name, rows)
+        if same_file:
+            os.remove(path)
+    elif not same_file:
+        write_table(name, rows)
+    else:
+        spec["cache"]["mtime"] = None
+    return len(rows)
+
+def export_table_to_csv(name, path):
+    spec = table_spec(name)
+    atomic_write_csv(path, spec["fields"], read_table(name))
+
+def migrate_csv_to_sqlite_if_needed():
+    """First start on the SQLite engine: load every non-empty CSV table into an empty SQLite table."""
+    if STORAGE_BACKEND != "sqlite":
+        return
+    sqlite_init_schema()
+    conn = sqlite_conn()
+    for name in TABLE_NAMES:
+        if conn.execute(f"SELECT 1 FROM {_q(name)} LIMIT 1").fetchone():
+            continue
+        spec = table_spec(name)
+        if spec.get("partition_dir") and _disk_partitions(name):
+            rows = read_partitioned_table(name)
+            source = spec["partition_dir"]
+        elif _csv_has_rows(spec["path"]):
+            rows = _load_csv_rows(spec["path"], spec["normalizer"])
+            source = spec["path"]
+        else:
+            continue
+        write_sqlite_db(name, rows)
+        print(f"Imported {len(rows)} rows from {source} into SQLite table {name}")
 
 def read_employees(force=False):
-    return read_csv_cached(EMPLOYEES_DB_PATH, EMPLOYEE_FIELDS, _employee_cache, ensure_employee_columns, force)
+    return read_table("employees", force)
 
 def write_employees(rows):
-    write_csv_db(EMPLOYEES_DB_PATH, EMPLOYEE_FIELDS, rows, _employee_cache, ensure_employee_columns)
+    write_table("employees", rows)
 
 def read_shifts(force=False):
-    return read_csv_cached(SHIFTS_DB_PATH, SHIFT_FIELDS, _shift_cache, ensure_shift_columns, force)
+    return read_table("shifts", force)
 
 def write_shifts(rows):
-    write_csv_db(SHIFTS_DB_PATH, SHIFT_FIELDS, rows, _shift_cache, ensure_shift_columns)
+    write_table("shifts", rows)
 
 def read_perf(force=False):
-    return read_csv_cached(PERF_DB_PATH, PERF_FIELDS, _perf_cache, ensure_perf_columns, force)
+    return read_table("perf", force)
 
 def write_perf(rows):
-    write_csv_db(PERF_DB_PATH, PERF_FIELDS, rows, _perf_cache, ensure_perf_columns)
+    write_table("perf", rows)
 
 def read_summary(force=False):
-    return read_csv_cached(SHIFT_SUMMARY_DB_PATH, SUMMARY_FIELDS, _summary_cache, ensure_summary_columns, force)
+    return read_table("summary", force)
 
 def write_summary(rows):
-    write_csv_db(SHIFT_SUMMARY_DB_PATH, SUMMARY_FIELDS, rows, _summary_cache, ensure_summary_columns)
+    write_table("summary", rows)
 
 def read_weekly(force=False):
-    return read_csv_cached(WEEKLY_SHIFT_DB_PATH, WEEKLY_FIELDS, _weekly_cache, ensure_weekly_columns, force)
+    return read_table("weekly", force)
 
 def write_weekly(rows):
-    write_csv_db(WEEKLY_SHIFT_DB_PATH, WEEKLY_FIELDS, rows, _weekly_cache, ensure_weekly_columns)
+    write_table("weekly", rows)
+
+# ==============================
+# WRITE-BEHIND BUFFER (PICKER SESSIONS)
+# ==============================
+
+# Buffered updates of date-keyed tables (shifts): {name: {where key: (where, values)}}.
+# A later tap on the same row replaces the earlier one.
+PENDING_LOCK = threading.Lock()
+_pending_updates = {}
+_pending_timers = {}
+
+def _patch_cached_rows(holder, where: dict, values: dict) -> bool:
+    matched = False
+    for r in holder["index"]["date_shift"].get((where["date"], safe_lower(where["shift_type"])), ()):
+        if row_matches(r, where):
+            r.update(values)
+            matched = True
+    return matched
+
+def _overlay_pending_updates(name, holder):
+    """Re-apply buffered updates to rows just reloaded from disk, so a reload never hides them."""
+    pending = _pending_updates.get(name)
+    if not pending:
+        return
+    for where, values in list(pending.values()):
+        _patch_cached_rows(holder, where, values)
+
+def buffer_row_update(name, where: dict, values: dict) -> bool:
+    """
+    Update rows filtered by date+shift_type(+...) without writing the table yet.
+    Cached rows are patched at once, so readers in this process see the change.
+    Returns True if a cached row matched.
+    """
+    where = dict(where)
+    values = dict(values)
+    with table_lock(name):
+        matched = False
+        for holder in _index_holders(name, partition_for_date(where["date"])):
+            matched = _patch_cached_rows(holder, where, values) or matched
+        table_spec(name)["cache"]["gen"] += 1
+        with PENDING_LOCK:
+            _pending_updates.setdefault(name, {})[tuple(sorted(where.items()))] = (where, values)
+            timer = _pending_timers.pop(name, None)
+            if timer:
+                timer.cancel()
+            timer = threading.Timer(PICKER_FLUSH_IDLE_SEC, _flush_pending_quietly, args=(name,))
+            timer.daemon = True
+            _pending_timers[name] = timer
+            timer.start()
+    return matched
+
+def flush_pending_updates(name=None) -> int:
+    """Write buffered updates, one change_rows per table. Returns the number of updated rows."""
+    updated = 0
+    for n in [name] if name else list(_pending_updates):
+        with table_lock(n):
+            with PENDING_LOCK:
+                pending = _pending_updates.pop(n, None)
+                timer = _pending_timers.pop(n, None)
+            if timer:
+                timer.cancel()
+            if not pending:
+                continue
+            try:
+                updated += change_rows(n, update_where=list(pending.values()))["updated"]
+            except Exception:
+                with PENDING_LOCK:
+                    # Keep them for the next flush; newer taps on the same rows win.
+                    _pending_updates[n] = {**pending, **_pending_updates.get(n, {})}
+                raise
+    return updated
+
+def flush_pending_before_write(name):
+    """
+    Called under the table lock by every direct write: taps buffered earlier go to disk first,
+    otherwise their later flush would overwrite the newer write to the same rows.
+    """
+    if _pending_updates.get(name):
+        flush_pending_updates(name)
+
+def discard_pending_updates(name=None):
+    """Forget buffered updates without writing them."""
+    with PENDING_LOCK:
+        for n in [name] if name else list(_pending_updates):
+            _pending_updates.pop(n, None)
+            timer = _pending_timers.pop(n, None)
+            if timer:
+                timer.cancel()
+
+def _flush_pending_quietly(name=None):
+    try:
+        flush_pending_updates(name)
+    except Exception as e:
+        print(f"Pending write flush warning: {e}")
+
+atexit.register(_flush_pending_quietly)
 
 def employee_by_sap(rows, sap: str):
     sap = normalize_text(sap)
@@ -1012,16 +2660,13 @@ def parse_number_selection(text: str, max_n: int) -> list:
 def get_active_shift_or_none(context):
     return st(context).get("active_shift")
 
-def shift_rows_for_active(active: dict, force=True):
+def shift_rows_for_active(active: dict):
     if not active:
         return []
-    return [
-        r for r in read_shifts(force)
-        if r["date"] == active["date"] and safe_lower(r["shift_type"]) == safe_lower(active["shift_type"])
-    ]
+    return read_rows_for_date_shift("shifts", active["date"], active["shift_type"])
 
 def format_shift_workers_numbered(active: dict) -> str:
-    rows = shift_rows_for_active(active, force=True)
+    rows = shift_rows_for_active(active)
     if not rows:
         return "У цій зміні ще немає працівників."
 
@@ -1041,7 +2686,7 @@ def format_shift_workers_numbered(active: dict) -> str:
 
 
 def sorted_active_employees_for_roster() -> list:
-    rows = [e for e in read_employees(force=True) if e.get("sap") and e.get("surname") and safe_lower(e.get("status", "active")) == "active"]
+    rows = [e for e in read_employees() if e.get("sap") and e.get("surname") and safe_lower(e.get("status", "active")) == "active"]
     return sorted(rows, key=lambda e: safe_lower(e["surname"]))
 
 def format_all_employees_numbered_for_roster(date_str: str) -> str:
@@ -1061,66 +2706,68 @@ def set_shift_members_for_date(date_str: str, shift_type: str, selected_indexes:
     Employees are unique for the date: selected day workers are removed from night and vice versa.
     Existing HALA/group is preserved if the worker already existed in that exact shift.
     """
-    employees = sorted_active_employees_for_roster()
-    selected_saps = set()
-    selected_map = {}
-
-    for idx in selected_indexes:
-        if 0 <= idx < len(employees):
-            e = employees[idx]
-            selected_saps.add(e["sap"])
-            selected_map[e["sap"]] = e
-
-    opposite = "night" if shift_type == "day" else "day"
-    all_rows = read_shifts(force=True)
-
-    # Preserve existing group info for selected workers already in this shift.
-    existing_group = {}
-    for r in all_rows:
-        if r["date"] == date_str and r["shift_type"] == shift_type and r.get("sap") in selected_saps:
-            existing_group[r["sap"]] = (r.get("hala", ""), r.get("group", ""))
-
-    # Remove:
-    # 1) all rows of this shift for the date — then recreate selected cleanly
-    # 2) selected workers from the opposite shift — no double day/night assignment
-    kept = []
-    removed_from_same = 0
-    removed_from_opposite = 0
-
-    for r in all_rows:
-        if r["date"] == date_str and r["shift_type"] == shift_type:
-            removed_from_same += 1
-            continue
-        if r["date"] == date_str and r["shift_type"] == opposite and r.get("sap") in selected_saps:
-            removed_from_opposite += 1
-            continue
-        kept.append(r)
-
-    new_rows = []
-    for sap in sorted(selected_saps, key=lambda s: safe_lower(selected_map[s]["surname"])):
-        emp = selected_map[sap]
-        hala, group = existing_group.get(sap, ("", ""))
-        new_rows.append(ensure_shift_columns({
-            "date": date_str,
-            "shift_type": shift_type,
-            "hala": hala,
-            "group": group,
-            "sap": sap,
-            "surname": emp["surname"],
-        }))
+    with table_txn("shifts"):
+        employees = sorted_active_employees_for_roster()
+        selected_saps = set()
+        selected_map = {}
+
+        for idx in selected_indexes:
+            if 0 <= idx < len(employees):
+                e = employees[idx]
+                selected_saps.add(e["sap"])
+                selected_map[e["sap"]] = e
+
+        opposite = "night" if shift_type == "day" else "day"
+        all_rows = read_rows_for_date("shifts", date_str)
+
+        # Preserve existing group info for selected workers already in this shift.
+        existing_group = {}
+        for r in all_rows:
+            if r["date"] == date_str and r["shift_type"] == shift_type and r.get("sap") in selected_saps:
+                existing_group[r["sap"]] = (r.get("hala", ""), r.get("group", ""))
+
+        # Remove:
+        # 1) all rows of this shift for the date — then recreate selected cleanly
+        # 2) selected workers from the opposite shift — no double day/night assignment
+        removed_from_same = 0
+        removed_from_opposite = 0
+
+        for r in all_rows:
+            if r["date"] == date_str and r["shift_type"] == shift_type:
+                removed_from_same += 1
+            elif r["date"] == date_str and r["shift_type"] == opposite and r.get("sap") in selected_saps:
+                removed_from_opposite += 1
+
+        new_rows = []
+        for sap in sorted(selected_saps, key=lambda s: safe_lower(selected_map[s]["surname"])):
+            emp = selected_map[sap]
+            hala, group = existing_group.get(sap, ("", ""))
+            new_rows.append(ensure_shift_columns({
+                "date": date_str,
+                "shift_type": shift_type,
+                "hala": hala,
+                "group": group,
+                "sap": sap,
+                "surname": emp["surname"],
+            }))
 
-    write_shifts(kept + new_rows)
-    return {
-        "selected": len(new_rows),
-        "removed_from_same": removed_from_same,
-        "removed_from_opposite": removed_from_opposite,
-    }
+        change_rows(
+            "shifts",
+            delete_where=[{"date": date_str, "shift_type": shift_type}]
+            + [{"date": date_str, "shift_type": opposite, "sap": sap} for sap in selected_saps],
+            insert_rows=new_rows,
+        )
+        return {
+            "selected": len(new_rows),
+            "removed_from_same": removed_from_same,
+            "removed_from_opposite": removed_from_opposite,
+        }
 
 def count_shift_members(date_str: str, shift_type: str) -> int:
-    return len([r for r in read_shifts(force=True) if r["date"] == date_str and r["shift_type"] == shift_type])
+    return len(read_rows_for_date_shift("shifts", date_str, shift_type))
 
 def format_groups_overview(active: dict) -> str:
-    rows = shift_rows_for_active(active, force=True)
+    rows = shift_rows_for_active(active)
     if not rows:
         return "У цій зміні ще немає працівників."
 
@@ -1148,73 +2795,143 @@ def format_groups_overview(active: dict) -> str:
     return "\n".join(out)
 
 def add_workers_to_shift_unassigned(active: dict, lines: list, employees: list) -> dict:
-    all_rows = read_shifts(force=True)
-    existing_saps = {
-        r["sap"] for r in all_rows
-        if r["date"] == active["date"] and r["shift_type"] == active["shift_type"] and r.get("sap")
-    }
+    with table_txn("shifts"):
+        existing_saps = {
+            r["sap"] for r in read_rows_for_date_shift("shifts", active["date"], active["shift_type"])
+            if r.get("sap")
+        }
 
-    added = 0
-    already = []
-    missing = []
-    ambiguous = []
+        new_rows = []
+        already = []
+        missing = []
+        ambiguous = []
 
-    for line in lines:
-        emp, err = parse_worker_line_to_employee(line, employees)
-        if not emp:
-            if err == "ambiguous":
-                ambiguous.append(line)
+        for line in lines:
+            emp, err = parse_worker_line_to_employee(line, employees)
+            if not emp:
+                if err == "ambiguous":
+                    ambiguous.append(line)
+                else:
+                    missing.append(line)
+                continue
+
+            sap = emp["sap"]
+            if sap in existing_saps:
+                already.append(f"{sap} — {emp['surname']}")
+                continue
+
+            new_rows.append(ensure_shift_columns({
+                "date": active["date"],
+                "shift_type": active["shift_type"],
+                "hala": "",
+                "group": "",
+                "sap": sap,
+                "surname": emp["surname"],
+            }))
+            existing_saps.add(sap)
+
+        if new_rows:
+            change_rows("shifts", insert_rows=new_rows)
+        return {"added": len(new_rows), "already": already, "missing": missing, "ambiguous": ambiguous}
+
+def add_workers_to_group(active: dict, lines: list, employees: list, hala: str, group: str) -> dict:
+    """Add typed SAP/name lines to hala/group of the active shift; workers already in the shift are moved."""
+    with table_txn("shifts"):
+        emp_by_sap, emp_by_name = build_employee_lookup(employees)
+        added, moved, missing, ambiguous = 0, 0, [], []
+        rows = shift_rows_for_active(active)
+        new_rows, updates = [], []
+
+        for line in lines:
+            parsed = parse_sap_name_line(line)
+
+            emp = None
+            if parsed:
+                sap = parsed[0]
+                emp = emp_by_sap.get(sap)
+            elif re.fullmatch(r"\d{6,12}", line):
+                sap = line
+                emp = emp_by_sap.get(sap)
             else:
+                # allow pure surname/name input
+                key = canonical_name_key(line.upper())
+                emp = emp_by_name.get(key)
+                if not emp:
+                    # partial search fallback
+                    candidates = [e for e in employees if key in canonical_name_key(e.get("surname", ""))]
+                    if len(candidates) == 1:
+                        emp = candidates[0]
+                    elif len(candidates) > 1:
+                        ambiguous.append(line + " → " + ", ".join(emp_display(c) for c in candidates[:5]))
+                        continue
+
+            if not emp or not emp.get("sap"):
                 missing.append(line)
-            continue
+                continue
 
-        sap = emp["sap"]
-        if sap in existing_saps:
-            already.append(f"{sap} — {emp['surname']}")
-            continue
+            sap = emp["sap"]
 
-        all_rows.append(ensure_shift_columns({
-            "date": active["date"],
-            "shift_type": active["shift_type"],
-            "hala": "",
-            "group": "",
-            "sap": sap,
-            "surname": emp["surname"],
-        }))
-        existing_saps.add(sap)
-        added += 1
+            # If this worker already exists in this shift in another group, move them to the new group.
+            found_same_shift = False
+            for r in rows:
+                if r["sap"] == sap:
+                    found_same_shift = True
+                    if r["hala"] != hala or r["group"] != group:
+                        updates.append((
+                            {"date": r["date"], "shift_type": r["shift_type"], "sap": sap, "hala": r["hala"], "group": r["group"]},
+                            {"hala": hala, "group": group, "surname": emp["surname"]},
+                        ))
+                        moved += 1
+
+            if found_same_shift:
+                continue
+
+            new_row = ensure_shift_columns({
+                "date": active["date"],
+                "shift_type": active["shift_type"],
+                "hala": hala,
+                "group": group,
+                "sap": sap,
+                "surname": emp["surname"],
+            })
+            new_rows.append(new_row)
+            rows.append(new_row)
+            added += 1
 
-    write_shifts(all_rows)
-    return {"added": added, "already": already, "missing": missing, "ambiguous": ambiguous}
+        change_rows("shifts", insert_rows=new_rows, update_where=updates)
+    return {"added": added, "moved": moved, "missing": missing, "ambiguous": ambiguous}
 
 def move_selected_workers_to_group(active: dict, selected_indexes: list, hala: str, group: str) -> int:
-    all_rows = read_shifts(force=True)
-
-    shift_indexes = []
-    for idx, r in enumerate(all_rows):
-        if r["date"] == active["date"] and r["shift_type"] == active["shift_type"]:
-            shift_indexes.append(idx)
-
-    # Same sorting as display.
-    display_rows = [(i, all_rows[i]) for i in shift_indexes]
-    display_rows.sort(key=lambda pair: (
-        0 if not pair[1].get("hala") and not pair[1].get("group") else 1,
-        safe_lower(pair[1].get("hala", "")),
-        safe_lower(pair[1].get("group", "")),
-        safe_lower(pair[1].get("surname", "")),
-    ))
-
-    moved = 0
-    for sel in selected_indexes:
-        if sel < 0 or sel >= len(display_rows):
-            continue
-        original_idx = display_rows[sel][0]
-        all_rows[original_idx]["hala"] = hala
-        all_rows[original_idx]["group"] = group
-        moved += 1
+    with table_txn("shifts"):
+        all_rows = read_rows_for_date("shifts", active["date"])
+
+        shift_indexes = []
+        for idx, r in enumerate(all_rows):
+            if r["shift_type"] == active["shift_type"]:
+                shift_indexes.append(idx)
+
+        # Same sorting as display.
+        display_rows = [(i, all_rows[i]) for i in shift_indexes]
+        display_rows.sort(key=lambda pair: (
+            0 if not pair[1].get("hala") and not pair[1].get("group") else 1,
+            safe_lower(pair[1].get("hala", "")),
+            safe_lower(pair[1].get("group", "")),
+            safe_lower(pair[1].get("surname", "")),
+        ))
+
+        moved = 0
+        updates = []
+        for sel in selected_indexes:
+            if sel < 0 or sel >= len(display_rows):
+                continue
+            r = display_rows[sel][1]
+            where = {"date": r["date"], "shift_type": r["shift_type"], "sap": r["sap"], "surname": r["surname"]}
+            updates.append((where, {"hala": hala, "group": group}))
+            moved += 1
 
-    write_shifts(all_rows)
-    return moved
+        if updates:
+            change_rows("shifts", update_where=updates)
+        return moved
 
 def upsert_employee(rows, emp):
     emp = ensure_employee_columns(emp)
@@ -1244,6 +2961,23 @@ def upsert_employee(rows, emp):
         out.append(ensure_employee_columns(clean))
     return out
 
+def save_employee(emp) -> list:
+    """Upsert one employee into the table as it is now, not into a copy read earlier in the dialog."""
+    with table_txn("employees"):
+        rows = upsert_employee(read_employees(), emp)
+        write_employees(rows)
+    return rows
+
+def delete_employee(emp) -> int:
+    with table_txn("employees"):
+        rows = read_employees()
+        if emp.get("sap"):
+            keep = [r for r in rows if r.get("sap") != emp["sap"]]
+        else:
+            keep = [r for r in rows if canonical_name_key(r.get("surname", "")) != canonical_name_key(emp.get("surname", ""))]
+        write_employees(keep)
+    return len(rows) - len(keep)
+
 # ==============================
 # SEED / MIGRATION
 # ==============================
@@ -1268,7 +3002,7 @@ def canonical_name_key(name: str) -> str:
     return n
 
 def build_employee_lookup(rows=None):
-    rows = rows or read_employees(force=True)
+    rows = rows or read_employees()
     by_sap = {}
     by_name = {}
     for e in rows:
@@ -1280,38 +3014,39 @@ def build_employee_lookup(rows=None):
 
 def migrate_rows_surname_to_sap() -> tuple:
     """Fill missing SAP in old shifts/performance by matching surname to employees."""
-    employees = read_employees(force=True)
-    _, by_name = build_employee_lookup(employees)
-
-    shifts = read_shifts(force=True)
-    shift_changed = 0
-    new_shifts = []
-    for r in shifts:
-        rr = ensure_shift_columns(r)
-        if not rr["sap"] and rr["surname"]:
-            emp = by_name.get(canonical_name_key(rr["surname"]))
-            if emp and emp.get("sap"):
-                rr["sap"] = emp["sap"]
-                rr["surname"] = emp["surname"]
-                shift_changed += 1
-        new_shifts.append(rr)
-    if shift_changed:
-        write_shifts(new_shifts)
-
-    perf = read_perf(force=True)
-    perf_changed = 0
-    new_perf = []
-    for r in perf:
-        rr = ensure_perf_columns(r)
-        if not rr["sap"] and rr["surname"]:
-            emp = by_name.get(canonical_name_key(rr["surname"]))
-            if emp and emp.get("sap"):
-                rr["sap"] = emp["sap"]
-                rr["surname"] = emp["surname"]
-                perf_changed += 1
-        new_perf.append(rr)
-    if perf_changed:
-        write_perf(new_perf)
+    with table_txn("employees", "shifts", "perf"):
+        employees = read_employees()
+        _, by_name = build_employee_lookup(employees)
+
+        shifts = read_shifts()
+        shift_changed = 0
+        new_shifts = []
+        for r in shifts:
+            rr = ensure_shift_columns(r)
+            if not rr["sap"] and rr["surname"]:
+                emp = by_name.get(canonical_name_key(rr["surname"]))
+                if emp and emp.get("sap"):
+                    rr["sap"] = emp["sap"]
+                    rr["surname"] = emp["surname"]
+                    shift_changed += 1
+            new_shifts.append(rr)
+        if shift_changed:
+            write_shifts(new_shifts)
+
+        perf = read_perf()
+        perf_changed = 0
+        new_perf = []
+        for r in perf:
+            rr = ensure_perf_columns(r)
+            if not rr["sap"] and rr["surname"]:
+                emp = by_name.get(canonical_name_key(rr["surname"]))
+                if emp and emp.get("sap"):
+                    rr["sap"] = emp["sap"]
+                    rr["surname"] = emp["surname"]
+                    perf_changed += 1
+            new_perf.append(rr)
+        if perf_changed:
+            write_perf(new_perf)
 
     return shift_changed, perf_changed
 
@@ -1321,17 +3056,21 @@ def format_no_sap(rows):
     return "⚠️ Без SAP:\n\n" + ("\n".join(items) if items else "Усі працівники мають SAP ✅")
 
 def merge_seed_sap():
-    rows = read_employees(force=True)
-    for emp in seed_sap_rows():
-        rows = upsert_employee(rows, emp)
-    write_employees(rows)
+    with table_txn("employees"):
+        rows = read_employees()
+        for emp in seed_sap_rows():
+            rows = upsert_employee(rows, emp)
+        write_employees(rows)
     return len(rows)
 
 def migrate_old_local_if_needed():
     """Create/fill employees.csv from old local_data.csv if employees.csv is missing or empty."""
     employees_exists = os.path.exists(EMPLOYEES_DB_PATH)
     employees_empty = True
-    if employees_exists:
+    if STORAGE_BACKEND == "sqlite":
+        employees_exists = True
+        employees_empty = not read_employees()
+    elif employees_exists:
         try:
             with open(EMPLOYEES_DB_PATH, "r", encoding="utf-8", newline="") as f:
                 reader = csv.DictReader(f)
@@ -1430,81 +3169,82 @@ def merge_local_data_into_employees_if_possible() -> dict:
     if not os.path.exists(OLD_LOCAL_DB_PATH):
         return result
 
-    current = read_employees(force=True)
-    seed = seed_sap_rows()
+    with table_txn("employees"):
+        current = read_employees()
+        seed = seed_sap_rows()
 
-    by_name = {canonical_name_key(e["surname"]): e for e in current if e.get("surname")}
-    seed_by_name = {canonical_name_key(e["surname"]): e for e in seed if e.get("surname")}
+        by_name = {canonical_name_key(e["surname"]): e for e in current if e.get("surname")}
+        seed_by_name = {canonical_name_key(e["surname"]): e for e in seed if e.get("surname")}
 
-    old_rows = []
-    with open(OLD_LOCAL_DB_PATH, "r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            name = normalize_text(r.get("surname", "")).upper()
-            if not name:
-                continue
-            old_emp = ensure_employee_columns({
-                "surname": name,
-                "locker": r.get("locker", ""),
-                "knife": r.get("knife", ""),
-                "address": r.get("Address", ""),
-            })
-            old_rows.append(old_emp)
+        old_rows = []
+        with open(OLD_LOCAL_DB_PATH, "r", encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            for r in reader:
+                name = normalize_text(r.get("surname", "")).upper()
+                if not name:
+                    continue
+                old_emp = ensure_employee_columns({
+                    "surname": name,
+                    "locker": r.get("locker", ""),
+                    "knife": r.get("knife", ""),
+                    "address": r.get("Address", ""),
+                })
+                old_rows.append(old_emp)
+
+        for old in old_rows:
+            key = canonical_name_key(old["surname"])
+            target = by_name.get(key)
+
+            if not target:
+                # Try seed spelling, then add as no-SAP if unknown.
+                seed_emp = seed_by_name.get(key)
+                if seed_emp:
+                    target = seed_emp.copy()
+                    current.append(target)
+                    by_name[key] = target
+                else:
+                    current.append(old)
+                    by_name[key] = old
+                    result["added_no_sap"] += 1
+                    continue
 
-    for old in old_rows:
-        key = canonical_name_key(old["surname"])
-        target = by_name.get(key)
-
-        if not target:
-            # Try seed spelling, then add as no-SAP if unknown.
-            seed_emp = seed_by_name.get(key)
-            if seed_emp:
-                target = seed_emp.copy()
-                current.append(target)
-                by_name[key] = target
+            if not target.get("sap"):
+                seed_emp = seed_by_name.get(key)
+                if seed_emp and seed_emp.get("sap"):
+                    target["sap"] = seed_emp["sap"]
+
+            # Always restore locker/knife/address from old DB if present.
+            target["locker"] = old.get("locker", "")
+            target["knife"] = old.get("knife", "")
+            if old.get("address"):
+                target["address"] = old["address"]
+
+            result["matched"] += 1
+            if locker_has_value(target.get("locker", "")):
+                result["locker"] += 1
+            if knife_has(target.get("knife", "")):
+                result["knife"] += 1
+
+        # Deduplicate by SAP first, then name for no-SAP.
+        dedup = {}
+        for e in current:
+            e = ensure_employee_columns(e)
+            key = ("sap", e["sap"]) if e.get("sap") else ("name", canonical_name_key(e.get("surname", "")))
+            if key in dedup:
+                old = dedup[key]
+                for field in EMPLOYEE_FIELDS:
+                    if e.get(field) and not old.get(field):
+                        old[field] = e[field]
+                # prefer restored locker/knife if present
+                if e.get("locker"):
+                    old["locker"] = e["locker"]
+                if e.get("knife"):
+                    old["knife"] = e["knife"]
             else:
-                current.append(old)
-                by_name[key] = old
-                result["added_no_sap"] += 1
-                continue
-
-        if not target.get("sap"):
-            seed_emp = seed_by_name.get(key)
-            if seed_emp and seed_emp.get("sap"):
-                target["sap"] = seed_emp["sap"]
-
-        # Always restore locker/knife/address from old DB if present.
-        target["locker"] = old.get("locker", "")
-        target["knife"] = old.get("knife", "")
-        if old.get("address"):
-            target["address"] = old["address"]
-
-        result["matched"] += 1
-        if locker_has_value(target.get("locker", "")):
-            result["locker"] += 1
-        if knife_has(target.get("knife", "")):
-            result["knife"] += 1
-
-    # Deduplicate by SAP first, then name for no-SAP.
-    dedup = {}
-    for e in current:
-        e = ensure_employee_columns(e)
-        key = ("sap", e["sap"]) if e.get("sap") else ("name", canonical_name_key(e.get("surname", "")))
-        if key in dedup:
-            old = dedup[key]
-            for field in EMPLOYEE_FIELDS:
-                if e.get(field) and not old.get(field):
-                    old[field] = e[field]
-            # prefer restored locker/knife if present
-            if e.get("locker"):
-                old["locker"] = e["locker"]
-            if e.get("knife"):
-                old["knife"] = e["knife"]
-        else:
-            dedup[key] = e
+                dedup[key] = e
 
-    final_rows = list(dedup.values())
-    write_employees(final_rows)
+        final_rows = list(dedup.values())
+        write_employees(final_rows)
     result["rows"] = len(final_rows)
     return result
 
@@ -1532,15 +3272,412 @@ def fetch_google_csv_rows():
 # BACKUP
 # ==============================
 
-def make_backup_zip(reason: str) -> str:
+_export_gens = {}  # table -> (cache gen, file sig) of its last DATA_DIR/export file
+
+def backup_source_files() -> list:
+    """
+    CSV files that go into a backup, always one file per table so any backup restores as before.
+    SQLite tables and month-partitioned tables are exported to DATA_DIR/export first; an export
+    is redone only when the table's generation moved, so the file (and its cached hash) stays put.
+    """
+    flush_pending_updates()
     ensure_all_files()
-    path = os.path.join(BACKUP_DIR, f"backup_{now_ts()}_{reason}.zip")
-    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for p in [EMPLOYEES_DB_PATH, SHIFTS_DB_PATH, PERF_DB_PATH, SHIFT_SUMMARY_DB_PATH, WEEKLY_SHIFT_DB_PATH]:
-            if os.path.exists(p):
-                z.write(p, arcname=os.path.basename(p))
-    return path
+    export_dir = os.path.join(DATA_DIR, "export")
+    os.makedirs(export_dir, exist_ok=True)
+    paths = []
+    for name in TABLE_NAMES:
+        spec = table_spec(name)
+        if STORAGE_BACKEND != "sqlite" and not spec.get("partition_dir"):
+            paths.append(spec["path"])
+            continue
+        path = os.path.join(export_dir, os.path.basename(spec["path"]))
+        with table_lock(name):
+            read_table(name)
+            gen = spec["cache"]["gen"]
+            if _export_gens.get(name) != (gen, _file_sig(path)):
+                export_table_to_csv(name, path)
+                _export_gens[name] = (gen, _file_sig(path))
+        paths.append(path)
+    return paths
+
+def table_name_for_basename(basename: str):
+    for name in TABLE_NAMES:
+        if os.path.basename(table_spec(name)["path"]) == basename:
+            return name
+    return None
+
+BACKUP_LOCK = threading.Lock()
+_backup_hash_cache = {}  # path -> (file sig, sha256)
+_last_manifest = {"manifest": None}
+_backup_lines_cache = {}  # blob sha256 -> text lines of a snapshot table, used as diff base
+_MANIFEST_TS_RE = re.compile(r"^backup_(\d{4}-\d\d-\d\d_\d\d-\d\d-\d\d(?:_\d{6})?)_")
+
+def file_sha256(path: str) -> str:
+    sig = _file_sig(path)
+    cached = _backup_hash_cache.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _backup_hash_cache[path] = (sig, digest)
+    return digest
+
+def backup_blob_path(digest: str) -> str:
+    return os.path.join(BACKUP_BLOB_DIR, digest[:2], digest + ".gz")
+
+def store_backup_blob(path: str) -> str:
+    """Store file content once under its sha256; returns the digest."""
+    digest = file_sha256(path)
+    blob = backup_blob_path(digest)
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = blob + ".tmp"
+        with open(path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, blob)
+    return digest
+
+def store_backup_bytes(data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    blob = backup_blob_path(digest)
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with gzip.open(blob + ".tmp", "wb", compresslevel=6) as f:
+            f.write(data)
+        os.replace(blob + ".tmp", blob)
+    return digest
+
+def read_backup_lines(digest: str) -> list:
+    """Lines of a stored table (keepends, so joining them gives the exact bytes back)."""
+    lines = _backup_lines_cache.get(digest)
+    if lines is None:
+        if len(_backup_lines_cache) >= 2 * len(TABLE_NAMES):
+            _backup_lines_cache.clear()
+        with gzip.open(backup_blob_path(digest), "rt", encoding="utf-8", newline="") as f:
+            lines = _backup_lines_cache[digest] = f.read().splitlines(keepends=True)
+    return lines
+
+def read_file_lines(path: str) -> list:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return f.read().splitlines(keepends=True)
+
+def store_backup_diff(base_digest: str, path: str):
+    """
+    Row diff of a table file against its snapshot: common head and tail are kept by count, only the
+    rows in between are stored. Tables change near the end (new dates) or in place, so the middle is small.
+    Returns the diff blob digest, or None when the file differs too much to be worth a diff.
+    """
+    base = read_backup_lines(base_digest)
+    lines = read_file_lines(path)
+    limit = min(len(base), len(lines))
+    head = 0
+    while head < limit and base[head] == lines[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and base[-1 - tail] == lines[-1 - tail]:
+        tail += 1
+    rows = lines[head:len(lines) - tail]
+    if len(rows) > BACKUP_DIFF_MAX_RATIO * max(len(lines), 1):
+        return None
+    diff = {"base": base_digest, "head": head, "tail": tail, "rows": rows}
+    return store_backup_bytes(json.dumps(diff, ensure_ascii=False).encode("utf-8"))
+
+def list_backup_manifests() -> list:
+    """Manifest paths, oldest first (names start with the timestamp)."""
+    try:
+        names = [n for n in os.listdir(BACKUP_MANIFEST_DIR) if n.endswith(".json")]
+    except Exception:
+        return []
+    return [os.path.join(BACKUP_MANIFEST_DIR, n) for n in sorted(names)]
+
+def read_backup_manifest(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["path"] = path
+    return manifest
 
+def backup_manifest_time(path: str):
+    m = _MANIFEST_TS_RE.match(os.path.basename(path))
+    if not m:
+        return None
+    ts = m.group(1)
+    return datetime.strptime(ts, "%Y-%m-%d_%H-%M-%S_%f" if len(ts) > 19 else "%Y-%m-%d_%H-%M-%S")
+
+def backup_manifest_as_of(when: datetime):
+    """Newest manifest taken at or before `when`."""
+    found = None
+    for path in list_backup_manifests():
+        t = backup_manifest_time(path)
+        if t is None:
+            continue
+        if t > when:
+            break
+        found = path
+    return read_backup_manifest(found) if found else None
+
+def latest_backup_manifest():
+    if _last_manifest["manifest"] is None:
+        paths = list_backup_manifests()
+        if paths:
+            try:
+                _last_manifest["manifest"] = read_backup_manifest(paths[-1])
+            except Exception as e:
+                print(f"WARNING: cannot read backup manifest {paths[-1]}: {e}")
+    return _last_manifest["manifest"]
+
+def backup_diff_base(last):
+    """The full snapshot the next manifest may diff against, or None when a new snapshot is due."""
+    if not last:
+        return None
+    base = last
+    if last.get("base"):
+        try:
+            base = read_backup_manifest(os.path.join(BACKUP_MANIFEST_DIR, last["base"]))
+        except Exception as e:
+            print(f"WARNING: backup base {last['base']} unreadable, taking a full snapshot: {e}")
+            return None
+    taken = backup_manifest_time(base["path"])
+    if taken is None or datetime.now() - taken > timedelta(hours=BACKUP_FULL_EVERY_HOURS):
+        return None
+    return base
+
+def make_backup(reason: str) -> dict:
+    """
+    Hash the table files and write a manifest tagged with `reason`: a full snapshot (every table a blob),
+    or a diff manifest with "base" = snapshot name and "diffs" = {basename: diff blob} for changed tables.
+    If nothing changed since the previous manifest, no manifest is written: returns that one with "skipped": True.
+    """
+    with BACKUP_LOCK:
+        paths = {os.path.basename(p): p for p in backup_source_files() if os.path.exists(p)}
+        files = {basename: file_sha256(p) for basename, p in paths.items()}
+        last = latest_backup_manifest()
+        if last and last.get("files") == files:
+            return dict(last, skipped=True)
+        base = backup_diff_base(last)
+        diffs = {}
+        for basename, p in paths.items():
+            base_digest = base["files"].get(basename) if base else None
+            if base_digest == files[basename]:
+                continue
+            if base_digest:
+                diff_digest = store_backup_diff(base_digest, p)
+                if diff_digest:
+                    diffs[basename] = diff_digest
+                    continue
+            store_backup_blob(p)
+        ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")  # sortable, unique within a burst
+        path = os.path.join(BACKUP_MANIFEST_DIR, f"backup_{ts}_{reason}.json")
+        manifest = {
+            "ts": ts,
+            "reason": reason,
+            "files": files,
+            "base": os.path.basename(base["path"]) if base else None,
+            "diffs": diffs,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+        manifest["path"] = path
+        _last_manifest["manifest"] = manifest
+        return dict(manifest, skipped=False)
+
+def write_backup_file(manifest: dict, basename: str, dst):
+    """Write one table of a manifest to binary file `dst`, replaying its diff if it has one."""
+    digest = manifest["files"][basename]
+    diff_digest = (manifest.get("diffs") or {}).get(basename)
+    if not diff_digest:
+        with gzip.open(backup_blob_path(digest), "rb") as src:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return
+    with gzip.open(backup_blob_path(diff_digest), "rb") as f:
+        diff = json.loads(f.read().decode("utf-8"))
+    base = read_backup_lines(diff["base"])
+    h = hashlib.sha256()
+    for part in (base[:diff["head"]], diff["rows"], base[len(base) - diff["tail"]:]):
+        data = "".join(part).encode("utf-8")
+        h.update(data)
+        dst.write(data)
+    if h.hexdigest() != digest:
+        raise ValueError(f"{basename}: diff replay does not match backup checksum")
+
+def backup_zip_from_manifest(manifest: dict, dest) -> str:
+    """Materialize a manifest as the classic one-CSV-per-table ZIP (for Telegram and restore)."""
+    with zipfile.ZipFile(dest, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for basename in manifest["files"]:
+            with z.open(basename, "w") as dst:
+                write_backup_file(manifest, basename, dst)
+    return dest
+
+BACKUP_TIERS = [("all", "усі"), ("hourly", "щогодини"), ("daily", "щодня"), ("expired", "прострочені")]
+
+def backup_tier(taken: datetime, now: datetime) -> str:
+    age = now - taken
+    if age <= timedelta(hours=BACKUP_KEEP_ALL_HOURS):
+        return "all"
+    if age <= timedelta(days=BACKUP_HOURLY_DAYS):
+        return "hourly"
+    if age <= timedelta(days=BACKUP_DAILY_DAYS):
+        return "daily"
+    return "expired"
+
+def list_backup_entries() -> list:
+    """Every backup in BACKUP_DIR, oldest first: manifests and the backup_*.zip files written before them."""
+    entries = []
+    for path in list_backup_manifests():
+        taken = backup_manifest_time(path)
+        if taken is None:
+            continue
+        try:
+            manifest = read_backup_manifest(path)
+        except Exception as e:
+            print(f"WARNING: cannot read backup manifest {path}: {e}")
+            continue
+        entries.append({"path": path, "time": taken, "manifest": manifest, "size": _file_size(path)})
+    for name in os.listdir(BACKUP_DIR):
+        if name.startswith("backup_") and name.endswith(".zip"):
+            path = os.path.join(BACKUP_DIR, name)
+            taken = backup_manifest_time(path)
+            if taken is not None:
+                entries.append({"path": path, "time": taken, "manifest": None, "size": _file_size(path)})
+    entries.sort(key=lambda e: e["time"])
+    return entries
+
+def manifest_blob_refs(manifest: dict) -> set:
+    """Blobs a manifest needs besides its base snapshot (which is kept alongside it)."""
+    diffs = manifest.get("diffs") or {}
+    return {diffs.get(basename, digest) for basename, digest in manifest["files"].items()}
+
+def list_backup_blobs() -> dict:
+    """Stored blob files: path -> size. Leftover *.tmp files are included, they are never referenced."""
+    blobs = {}
+    for root, _, names in os.walk(BACKUP_BLOB_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            blobs[path] = _file_size(path)
+    return blobs
+
+def backup_retention_state(now: datetime = None) -> dict:
+    """
+    Decide what stays: tier rules first, then oldest-first eviction down to BACKUP_MAX_BYTES.
+    The newest backup and the snapshots of kept diff manifests are never evicted.
+    """
+    now = now or datetime.now()
+    entries = list_backup_entries()
+    blobs = list_backup_blobs()
+    by_name = {os.path.basename(e["path"]): e for e in entries}
+    tiers, keep, buckets = {}, set(), set()
+    for e in reversed(entries):  # newest first, so the newest of each hour/day wins its bucket
+        tier = tiers[e["path"]] = backup_tier(e["time"], now)
+        if tier == "all":
+            keep.add(e["path"])
+        elif tier in ("hourly", "daily"):
+            bucket = (tier, e["time"].strftime("%Y%m%d%H" if tier == "hourly" else "%Y%m%d"))
+            if bucket not in buckets:
+                buckets.add(bucket)
+                keep.add(e["path"])
+    if entries:
+        keep.add(entries[-1]["path"])
+
+    def base_of(e):
+        name = e["manifest"].get("base") if e["manifest"] else None
+        return by_name[name]["path"] if name in by_name else None
+
+    dependents = Counter()
+    for e in entries:
+        if e["path"] in keep and base_of(e):
+            keep.add(base_of(e))
+    for e in entries:
+        if e["path"] in keep and base_of(e):
+            dependents[base_of(e)] += 1
+
+    refs = Counter()
+    for e in entries:
+        if e["path"] in keep and e["manifest"]:
+            refs.update(manifest_blob_refs(e["manifest"]))
+    blob_size = {os.path.basename(p)[:-3]: size for p, size in blobs.items() if p.endswith(".gz")}
+    total = sum(e["size"] for e in entries if e["path"] in keep) + sum(blob_size.get(d, 0) for d in refs)
+    while total > BACKUP_MAX_BYTES:
+        # Oldest first; a snapshot becomes evictable once the diff manifests built on it are gone.
+        e = next((e for e in entries if e["path"] in keep and e is not entries[-1] and not dependents[e["path"]]), None)
+        if e is None:
+            break
+        keep.discard(e["path"])
+        total -= e["size"]
+        if base_of(e):
+            dependents[base_of(e)] -= 1
+        if e["manifest"]:
+            for digest in manifest_blob_refs(e["manifest"]):
+                refs[digest] -= 1
+                if refs[digest] == 0:
+                    total -= blob_size.get(digest, 0)
+    return {"entries": entries, "blobs": blobs, "tiers": tiers, "keep": keep, "refs": +refs, "total": total}
+
+def prune_backups(max_deletes: int = None) -> int:
+    """One eviction step: deletes up to max_deletes evicted backups, then blobs nothing kept refers to."""
+    max_deletes = BACKUP_EVICT_BATCH if max_deletes is None else max_deletes
+    deleted = 0
+    with BACKUP_LOCK:
+        state = backup_retention_state()
+        for e in state["entries"]:
+            if deleted >= max_deletes:
+                return deleted
+            if e["path"] not in state["keep"]:
+                os.remove(e["path"])
+                deleted += 1
+        for path in state["blobs"]:
+            if deleted >= max_deletes:
+                return deleted
+            if not (path.endswith(".gz") and os.path.basename(path)[:-3] in state["refs"]):
+                os.remove(path)
+                _backup_lines_cache.pop(os.path.basename(path)[:-3], None)
+                deleted += 1
+    return deleted
+
+def backup_evictor_loop():
+    while True:
+        try:
+            while prune_backups() >= BACKUP_EVICT_BATCH:
+                time.sleep(1)
+        except Exception as e:
+            print(f"Backup retention warning: {e}")
+        time.sleep(BACKUP_RETENTION_INTERVAL_SEC)
+
+def start_backup_evictor():
+    threading.Thread(target=backup_evictor_loop, daemon=True).start()
+
+def _mib(n: int) -> str:
+    return f"{n / 1024 / 1024:.1f} MiB"
+
+def backup_retention_text() -> str:
+    with BACKUP_LOCK:
+        state = backup_retention_state()
+    count, size = Counter(), Counter()
+    owner = {}
+    for e in state["entries"]:  # oldest first: a shared blob is counted in the newest tier using it
+        tier = state["tiers"][e["path"]] if e["path"] in state["keep"] else "evict"
+        count[tier] += 1
+        size[tier] += e["size"]
+        if e["manifest"]:
+            for digest in manifest_blob_refs(e["manifest"]):
+                owner[digest] = tier
+    for path, blob_bytes in state["blobs"].items():
+        size[owner.get(os.path.basename(path)[:-3], "evict")] += blob_bytes
+    used = sum(e["size"] for e in state["entries"]) + sum(state["blobs"].values())
+    lines = ["🗂️ Backups", ""]
+    for tier, label in BACKUP_TIERS + [("evict", "до видалення")]:
+        if count[tier] or size[tier]:
+            lines.append(f"{label}: {count[tier]} шт. | {_mib(size[tier])}")
+    lines += [
+        "",
+        f"На диску: {_mib(used)} з {_mib(BACKUP_MAX_BYTES)}",
+        f"Після очищення: {_mib(state['total'])}",
+        f"Правила: усі за {BACKUP_KEEP_ALL_HOURS:g} год, щогодини {BACKUP_HOURLY_DAYS:g} дн, щодня {BACKUP_DAILY_DAYS:g} дн",
+    ]
+    return "\n".join(lines)
 
 def extract_named_file_from_zip(z: zipfile.ZipFile, target_basename: str, dest_dir: str) -> bool:
     """
@@ -1551,25 +3688,138 @@ def extract_named_file_from_zip(z: zipfile.ZipFile, target_basename: str, dest_d
         if os.path.basename(member) == target_basename:
             os.makedirs(dest_dir, exist_ok=True)
             with z.open(member) as src, open(os.path.join(dest_dir, target_basename), "wb") as dst:
-                dst.write(src.read())
+                shutil.copyfileobj(src, dst, 1024 * 1024)
             return True
     return False
 
-async def send_backup_to_chat(context, chat_id, file_path, caption):
+async def send_backup_to_chat(bot, chat_id, file_path, caption):
     with open(file_path, "rb") as f:
-        await context.bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(file_path), caption=caption)
-
-async def backup_everywhere(context, trigger_chat_id: int, reason: str, caption_extra: str = ""):
-    path = make_backup_zip(reason)
-    caption = f"💾 Backup • {reason}\n{os.path.basename(path)}"
-    if caption_extra:
-        caption += f"\n{caption_extra}"
-    if BACKUP_CHAT_ID:
+        await bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(file_path), caption=caption)
+
+# queue holds {"manifest", "reason", "extra", "chat_id"}; created by start_backup_uploader inside the bot's loop.
+# batch is what the worker is collecting/uploading right now, so shutdown can still send it.
+BACKUP_UPLOADS = {
+    "queue": None,
+    "task": None,
+    "batch": [],
+    "queued": 0,
+    "sent": 0,
+    "coalesced": 0,
+    "retries": 0,
+    "failed": 0,
+    "last_sent": "",
+    "last_error": "",
+}
+
+def backup_upload_caption(batch: list) -> str:
+    reasons = []
+    for item in batch:
+        if item["reason"] not in reasons:
+            reasons.append(item["reason"])
+    caption = f"💾 Backup • {', '.join(reasons)}\n{os.path.basename(batch[-1]['manifest']['path'])}"
+    extras = [item["extra"] for item in batch if item["extra"]]
+    if extras:
+        caption += "\n" + "\n".join(extras)
+    return caption[:1024]  # Telegram caption limit
+
+async def upload_backup_batch(bot, batch: list):
+    """Upload the newest manifest of the batch (it covers every change in it), retrying with backoff."""
+    manifest = batch[-1]["manifest"]
+    caption = backup_upload_caption(batch)
+    zip_path = os.path.join(DATA_DIR, "export", os.path.splitext(os.path.basename(manifest["path"]))[0] + ".zip")
+    delay = 2.0
+    for attempt in range(1, BACKUP_UPLOAD_RETRIES + 1):
         try:
-            await send_backup_to_chat(context, BACKUP_CHAT_ID, path, caption)
+            await run_disk(backup_zip_from_manifest, manifest, zip_path)
+            await send_backup_to_chat(bot, BACKUP_CHAT_ID, zip_path, caption)
+            BACKUP_UPLOADS["sent"] += 1
+            BACKUP_UPLOADS["coalesced"] += len(batch) - 1
+            BACKUP_UPLOADS["last_sent"] = f"{now_ts()} {os.path.basename(manifest['path'])}"
+            return
         except Exception as e:
-            await context.bot.send_message(chat_id=trigger_chat_id, text=f"⚠️ Backup у групу не відправився: {e}")
-    return [path]
+            BACKUP_UPLOADS["last_error"] = f"{now_ts()} {e}"
+            if attempt == BACKUP_UPLOAD_RETRIES:
+                break
+            BACKUP_UPLOADS["retries"] += 1
+            wait = float(e.retry_after if isinstance(e, RetryAfter) else delay)
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, 300.0)
+        finally:
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+    BACKUP_UPLOADS["failed"] += 1
+    try:
+        await bot.send_message(chat_id=batch[-1]["chat_id"], text=f"⚠️ Backup у групу не відправився: {BACKUP_UPLOADS['last_error']}")
+    except Exception as e:
+        print(f"WARNING: backup upload failed and user was not notified: {e}")
+
+async def backup_upload_worker(bot):
+    queue = BACKUP_UPLOADS["queue"]
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = BACKUP_UPLOADS["batch"] = [await queue.get()]
+        deadline = loop.time() + BACKUP_UPLOAD_WINDOW_SEC
+        while (timeout := deadline - loop.time()) > 0:
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        await upload_backup_batch(bot, batch)
+        BACKUP_UPLOADS["batch"] = []
+        BACKUP_UPLOADS["queued"] -= len(batch)
+
+async def start_backup_uploader(app):
+    BACKUP_UPLOADS["queue"] = asyncio.Queue()
+    BACKUP_UPLOADS["task"] = asyncio.create_task(backup_upload_worker(app.bot))
+
+async def stop_backup_uploader(app):
+    """On shutdown send whatever is still collected or queued as one last upload."""
+    task, queue = BACKUP_UPLOADS["task"], BACKUP_UPLOADS["queue"]
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    batch = BACKUP_UPLOADS["batch"]
+    while not queue.empty():
+        batch.append(queue.get_nowait())
+    BACKUP_UPLOADS["task"] = BACKUP_UPLOADS["queue"] = None
+    if batch:
+        await upload_backup_batch(app.bot, batch)
+    BACKUP_UPLOADS["batch"] = []
+    BACKUP_UPLOADS["queued"] = 0
+
+def backup_upload_status_text() -> str:
+    u = BACKUP_UPLOADS
+    last = latest_backup_manifest()
+    lines = [
+        "💾 Backup",
+        "",
+        f"Остання локальна: {os.path.basename(last['path']) if last else '-'}",
+        f"Група: {BACKUP_CHAT_ID if BACKUP_CHAT_ID else 'не налаштована'}",
+        f"У черзі: {u['queued']} | відправлено: {u['sent']} | об'єднано: {u['coalesced']} | повторів: {u['retries']} | не вдалося: {u['failed']}",
+        f"Вікно об'єднання: {BACKUP_UPLOAD_WINDOW_SEC:g} с",
+        f"Остання відправка: {u['last_sent'] or '-'}",
+    ]
+    if u["last_error"]:
+        lines.append(f"Остання помилка: {u['last_error']}")
+    return "\n".join(lines)
+
+async def backup_everywhere(context, trigger_chat_id: int, reason: str, caption_extra: str = ""):
+    """
+    Local snapshot now (pre_* must capture the state before the change), upload to the group later.
+    """
+    manifest = await run_disk(make_backup, reason)
+    if manifest["skipped"] or not BACKUP_CHAT_ID:
+        return [manifest["path"]]
+    if BACKUP_UPLOADS["queue"] is None:
+        await upload_backup_batch(context.bot, [{"manifest": manifest, "reason": reason, "extra": caption_extra, "chat_id": trigger_chat_id}])
+        return [manifest["path"]]
+    BACKUP_UPLOADS["queued"] += 1
+    BACKUP_UPLOADS["queue"].put_nowait({"manifest": manifest, "reason": reason, "extra": caption_extra, "chat_id": trigger_chat_id})
+    return [manifest["path"]]
 
 # ==============================
 # FORMATTERS
@@ -1588,14 +3838,17 @@ def shoe_display(e):
         return size
     return label
 
-def format_employee_card(emp, perf_rows):
-    vals = [r for r in perf_rows if r["sap"] == emp["sap"] and safe_float(r["percent"]) is not None]
-    vals_sorted = sorted(vals, key=lambda r: (parse_ddmmyyyy(r["date"]) or datetime.min), reverse=True)
-    last = vals_sorted[0] if vals_sorted else None
-    avg = None
-    if vals:
-        nums = [safe_float(r["percent"]) for r in vals]
-        avg = sum(nums) / len(nums)
+def format_trend(recent) -> str:
+    """'118,00 → 125,50 → 131,20% ↗' over the recent shifts, oldest first."""
+    pcts = [p for _, _, _, p in recent]
+    if len(pcts) < 2:
+        return "-"
+    arrow = "↗" if pcts[-1] - pcts[0] >= 1 else "↘" if pcts[0] - pcts[-1] >= 1 else "→"
+    return " → ".join(fmt_percent(p) for p in pcts) + f"% {arrow}"
+
+def format_employee_card(emp):
+    stats = sap_stats(emp["sap"]) if emp["sap"] else _sap_stats_empty()
+    avg = stats["sum"] / stats["count"] if stats["count"] else None
 
     return (
         "👤 Картка працівника\n\n"
@@ -1606,8 +3859,9 @@ def format_employee_card(emp, perf_rows):
         f"Взуття: {shoe_display(emp)}\n"
         f"Статус: {emp['status'] or 'active'}\n\n"
         "📊 Продуктивність:\n"
-        f"Остання: {(last['date'] + ' — ' + fmt_percent(last['percent']) + '%') if last else '-'}\n"
-        f"Середня: {(fmt_percent(avg) + '%') if avg is not None else '-'}"
+        f"Остання: {(stats['last'] + ' — ' + fmt_percent(stats['last_percent']) + '%') if stats['count'] else '-'}\n"
+        f"Середня: {(fmt_percent(avg) + '%') if avg is not None else '-'}\n"
+        f"Тренд: {format_trend(stats['recent'])}"
     )
 
 def format_all(rows):
@@ -1643,29 +3897,28 @@ def format_stats(rows):
         f"🚫 Без ножа: {len([r for r in only if not knife_has(r['knife'])])}"
     )
 
-def get_shift_summary(summary_rows, date_str, shift_type):
-    for r in summary_rows:
-        if r["date"] == date_str and safe_lower(r["shift_type"]) == safe_lower(shift_type):
-            return r
-    return None
+def get_shift_summary(date_str, shift_type):
+    rows = read_rows_for_date_shift("summary", date_str, shift_type)
+    return rows[0] if rows else None
 
-def compute_shift_avg(perf_rows, date_str, st):
-    vals = [safe_float(r["percent"]) for r in perf_rows if r["date"] == date_str and safe_lower(r["shift_type"]) == st and safe_float(r["percent"]) is not None]
+def compute_shift_avg(date_str, st):
+    vals = [r.pct for r in read_rows_for_date_shift("perf", date_str, st) if r.pct is not None]
     return sum(vals) / len(vals) if vals else None
 
-def format_shift(date_str, st, shifts_rows, perf_rows, summary_rows):
-    items = [r for r in shifts_rows if r["date"] == date_str and safe_lower(r["shift_type"]) == safe_lower(st)]
+def format_shift(date_str, st):
+    items = read_rows_for_date_shift("shifts", date_str, st)
+    perf_rows = read_rows_for_date_shift("perf", date_str, st)
     header = f"{date_str} ({shift_type_label(st)} зміна)\n"
-    summ = get_shift_summary(summary_rows, date_str, st)
+    summ = get_shift_summary(date_str, st)
     if summ:
         header += f"Загальний %: {summ['total_percent'] or '-'} | Агенція %: {summ['agency_percent'] or '-'}\n"
-    avg = compute_shift_avg(perf_rows, date_str, st)
+    avg = compute_shift_avg(date_str, st)
     if avg is not None:
         header += f"Середній % по SAP: {fmt_percent(avg)}%\n"
     if not items:
         return header + "Немає працівників у зміні."
 
-    perf_map = {(r["sap"], r["hala"], r["group"]): r["percent"] for r in perf_rows if r["date"] == date_str and safe_lower(r["shift_type"]) == safe_lower(st)}
+    perf_map = {(r["sap"], r["hala"], r["group"]): r["percent"] for r in perf_rows}
     items = sorted(items, key=lambda r: (safe_lower(r["hala"]), safe_lower(r["group"]), safe_lower(r["surname"])))
     blocks = []
     cur = None
@@ -1684,21 +3937,12 @@ def format_shift(date_str, st, shifts_rows, perf_rows, summary_rows):
         blocks.append("\n".join(lines))
     return (header + "\n".join(blocks)).strip()
 
-def compute_month_averages(perf_rows, month):
-    sums, cnts, names = {}, {}, {}
-    for r in perf_rows:
-        if month_key_from_date_str(r["date"]) != month:
-            continue
-        p = safe_float(r["percent"])
-        if p is None or not r["sap"]:
-            continue
-        sums[r["sap"]] = sums.get(r["sap"], 0) + p
-        cnts[r["sap"]] = cnts.get(r["sap"], 0) + 1
-        names[r["sap"]] = r["surname"]
-    return {sap: (sums[sap] / cnts[sap], cnts[sap], names.get(sap, "")) for sap in sums}
+def compute_month_averages(month):
+    """{sap: (avg, shifts, surname)} from the month's materialized aggregates."""
+    return {sap: (a["sum"] / a["count"], a["count"], a["surname"]) for sap, a in month_aggregates(month).items()}
 
-def format_sorted_workers(perf_rows, month):
-    avgs = compute_month_averages(perf_rows, month)
+def format_sorted_workers(month):
+    avgs = compute_month_averages(month)
     if not avgs:
         return f"Немає записів продуктивності за {month}."
     rows = sorted([(avg, cnt, sap, name) for sap, (avg, cnt, name) in avgs.items()], key=lambda x: x[0])
@@ -1709,6 +3953,97 @@ def format_sorted_workers(perf_rows, month):
 
 
 
+# ==============================
+# RENDER CACHE
+# ==============================
+
+# Formatter -> tables its text is built from. Any write to one of them bumps its generation
+# and the cached text of that formatter stops matching.
+RENDER_DEPS = {
+    "format_shift": ("shifts", "perf", "summary"),
+    "format_groups_overview": ("shifts",),
+    "format_shift_workers_numbered": ("shifts",),
+    "format_all": ("employees",),
+    "format_stats": ("employees",),
+    "format_no_sap": ("employees",),
+    "format_with_locker": ("employees",),
+    "format_no_locker": ("employees",),
+    "format_with_knife": ("employees",),
+    "format_no_knife": ("employees",),
+}
+
+_render_cache = {"entries": OrderedDict(), "hits": 0, "misses": 0, "uncached": 0, "evicted": 0, "lock": threading.Lock()}
+
+def _render_arg_key(a, tables):
+    """Hashable stand-in for a formatter argument; TypeError if it cannot be keyed."""
+    if isinstance(a, dict):
+        return tuple(sorted(a.items()))
+    if isinstance(a, list):
+        # Only a table's own cached row list (what read_employees() returns) is known by its generation.
+        for name in tables:
+            if a is table_spec(name)["cache"]["rows"]:
+                return ("rows", name)
+        raise TypeError("row list is not a table cache")
+    hash(a)
+    return a
+
+def _render_gens(tables, args) -> tuple:
+    """Generations of `tables` after a signature check of the month the arguments point at."""
+    date_str = ""
+    for a in args:
+        if isinstance(a, dict) and a.get("date"):
+            date_str = a["date"]
+        elif isinstance(a, str) and parse_ddmmyyyy(a):
+            date_str = a
+    gens = []
+    for name in tables:
+        _index_holders(name, partition_for_date(date_str) if date_str else None)
+        gens.append(table_spec(name)["cache"]["gen"])
+    return tuple(gens)
+
+def render_cached(fn, *args) -> str:
+    """
+    fn(*args) through an LRU of rendered texts keyed by (formatter, arguments), valid while the
+    generations of the formatter's RENDER_DEPS tables are the ones it was rendered at.
+    """
+    tables = RENDER_DEPS[fn.__name__]
+    cache = _render_cache
+    # Generations first: the check may reload a table, and a row list from before that is not keyable.
+    gens = _render_gens(tables, args)
+    try:
+        key = (fn.__name__, tuple(_render_arg_key(a, tables) for a in args))
+    except TypeError:
+        with cache["lock"]:
+            cache["uncached"] += 1
+        return fn(*args)
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is not None and entry[0] == gens:
+            cache["entries"].move_to_end(key)
+            cache["hits"] += 1
+            return entry[1]
+        cache["misses"] += 1
+    # Rendered outside the lock; the text is at least as new as `gens`, so storing it under them is safe.
+    text = fn(*args)
+    with cache["lock"]:
+        cache["entries"][key] = (gens, text)
+        cache["entries"].move_to_end(key)
+        while len(cache["entries"]) > RENDER_CACHE_MAX_ENTRIES:
+            cache["entries"].popitem(last=False)
+            cache["evicted"] += 1
+    return text
+
+def render_cache_stats_text() -> str:
+    c = _render_cache
+    with c["lock"]:
+        total = c["hits"] + c["misses"]
+        return (
+            f"🧾 Кеш відображення: {len(c['entries'])}/{RENDER_CACHE_MAX_ENTRIES} | "
+            f"влучань {c['hits']} | промахів {c['misses']}"
+            + (f" ({c['hits'] / total:.0%} влучань)" if total else "")
+            + f" | витіснено {c['evicted']} | без кешу {c['uncached']}"
+        )
+
 # ==============================
 # INLINE EMPLOYEE LIST / CARD
 # ==============================
@@ -1747,7 +4082,7 @@ def employee_list_keyboard(items: list, page: int = 0) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 def employee_find_by_callback_key(key: str):
-    rows = read_employees(force=True)
+    rows = read_employees()
     if key.startswith("name_"):
         nk = key[5:]
         for e in rows:
@@ -1765,19 +4100,19 @@ async def employee_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if action == "page":
         page = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
-        text, kb = employee_list_page(read_employees(force=True), page)
+        text, kb = employee_list_page(await run_disk(read_employees), page)
         await query.edit_message_text(text, reply_markup=kb)
         return
 
     if action == "card":
         key = parts[2] if len(parts) > 2 else ""
         page = parts[3] if len(parts) > 3 else "0"
-        emp = employee_find_by_callback_key(key)
+        emp = await run_disk(employee_find_by_callback_key, key)
         if not emp:
             await query.edit_message_text("❌ Працівника не знайдено. Онови список 👥 Всі.")
             return
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ До списку", callback_data=f"emp:page:{page}")]])
-        await query.edit_message_text(format_employee_card(emp, read_perf(force=True)), reply_markup=kb)
+        await query.edit_message_text(await run_disk(format_employee_card, emp), reply_markup=kb)
         return
 
 # ==============================
@@ -1798,7 +4133,7 @@ def weekly_session(context):
 
 def init_weekly_picker(context, weekday: str):
     employees = sorted_active_employees_for_roster()
-    existing = {(r.get("weekday"), r.get("sap")): r.get("default_shift", "none") for r in read_weekly(force=True)}
+    existing = {(r.get("weekday"), r.get("sap")): r.get("default_shift", "none") for r in read_weekly()}
     wp = {
         "weekday": weekday,
         "page": 0,
@@ -1861,7 +4196,6 @@ def weekly_keyboard(wp: dict) -> InlineKeyboardMarkup:
 
 def apply_weekly_picker(wp: dict) -> dict:
     weekday = wp.get("weekday", "")
-    old = [r for r in read_weekly(force=True) if r.get("weekday") != weekday]
     new = []
     for item in wp.get("items", []):
         if item.get("status") in {"day", "night"}:
@@ -1871,46 +4205,46 @@ def apply_weekly_picker(wp: dict) -> dict:
                 "surname": item["surname"],
                 "default_shift": item["status"],
             }))
-    write_weekly(old + new)
+    change_rows("weekly", delete_where=[{"weekday": weekday}], insert_rows=new)
     day, night, none = weekly_counts(wp)
     return {"day": day, "night": night, "none": none}
 
 def create_shift_from_weekly(date_str: str, shift_type: str) -> dict:
-    weekday = weekday_from_date(date_str)
-    if weekday == "":
-        return {"added": 0, "already": 0}
-    employees = {e["sap"]: e for e in read_employees(force=True) if e.get("sap")}
-    weekly = [r for r in read_weekly(force=True) if r.get("weekday") == weekday and r.get("default_shift") == shift_type]
-    rows = read_shifts(force=True)
-    existing = {r.get("sap") for r in rows if r.get("date") == date_str and r.get("shift_type") == shift_type and r.get("sap")}
-    opposite = "night" if shift_type == "day" else "day"
-    weekly_saps = {r.get("sap") for r in weekly if r.get("sap")}
-
-    # If worker is in opposite shift this exact date, do not duplicate. Manual date assignment wins.
-    opposite_saps = {r.get("sap") for r in rows if r.get("date") == date_str and r.get("shift_type") == opposite and r.get("sap")}
-    added = 0
-    already = 0
-    for r in weekly:
-        sap = r.get("sap")
-        emp = employees.get(sap)
-        if not sap or not emp or sap in opposite_saps:
-            continue
-        if sap in existing:
-            already += 1
-            continue
-        rows.append(ensure_shift_columns({
-            "date": date_str,
-            "shift_type": shift_type,
-            "hala": "",
-            "group": "",
-            "sap": sap,
-            "surname": emp["surname"],
-        }))
-        existing.add(sap)
-        added += 1
-    if added:
-        write_shifts(rows)
-    return {"added": added, "already": already}
+    with table_txn("employees", "shifts", "weekly"):
+        weekday = weekday_from_date(date_str)
+        if weekday == "":
+            return {"added": 0, "already": 0}
+        employees = {e["sap"]: e for e in read_employees() if e.get("sap")}
+        weekly = [r for r in read_weekly() if r.get("weekday") == weekday and r.get("default_shift") == shift_type]
+        rows = read_rows_for_date("shifts", date_str)
+        existing = {r.get("sap") for r in read_rows_for_date_shift("shifts", date_str, shift_type) if r.get("sap")}
+        opposite = "night" if shift_type == "day" else "day"
+        weekly_saps = {r.get("sap") for r in weekly if r.get("sap")}
+
+        # If worker is in opposite shift this exact date, do not duplicate. Manual date assignment wins.
+        opposite_saps = {r.get("sap") for r in rows if r.get("shift_type") == opposite and r.get("sap")}
+        new_rows = []
+        already = 0
+        for r in weekly:
+            sap = r.get("sap")
+            emp = employees.get(sap)
+            if not sap or not emp or sap in opposite_saps:
+                continue
+            if sap in existing:
+                already += 1
+                continue
+            new_rows.append(ensure_shift_columns({
+                "date": date_str,
+                "shift_type": shift_type,
+                "hala": "",
+                "group": "",
+                "sap": sap,
+                "surname": emp["surname"],
+            }))
+            existing.add(sap)
+        if new_rows:
+            change_rows("shifts", insert_rows=new_rows)
+        return {"added": len(new_rows), "already": already}
 
 async def weekly_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1945,7 +4279,7 @@ async def weekly_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if action == "save":
         await backup_everywhere(context, update.effective_chat.id, "pre_weekly_save")
-        result = apply_weekly_picker(wp)
+        result = await run_disk(apply_weekly_picker, wp)
         await backup_everywhere(context, update.effective_chat.id, "after_weekly_save")
         ud.pop("weekly_picker", None)
         await query.edit_message_text(f"✅ Сталі зміни збережено\n☀️ Day: {result['day']}\n🌙 Night: {result['night']}")
@@ -1985,10 +4319,9 @@ def init_roster_picker(context, date_str: str):
     }
 
     # Preload existing assignments for this date.
-    shifts = read_shifts(force=True)
     by_sap = {}
-    for r in shifts:
-        if r["date"] == date_str and r.get("sap") and r["shift_type"] in {"day", "night"}:
+    for r in read_rows_for_date("shifts", date_str):
+        if r.get("sap") and r["shift_type"] in {"day", "night"}:
             by_sap[r["sap"]] = r["shift_type"]
 
     for item in rp["items"]:
@@ -2059,49 +4392,47 @@ def roster_keyboard(rp: dict) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 def apply_roster_picker_to_shifts(rp: dict) -> dict:
-    date = rp.get("date", "")
-    items = rp.get("items", [])
-
-    day_saps = {x["sap"] for x in items if x.get("status") == "day"}
-    night_saps = {x["sap"] for x in items if x.get("status") == "night"}
-    selected_saps = day_saps | night_saps
-
-    employees = {e["sap"]: e for e in read_employees(force=True) if e.get("sap")}
-    old_rows = read_shifts(force=True)
-
-    # Preserve existing HALA/group for same date+shift+sap.
-    old_group = {}
-    for r in old_rows:
-        if r["date"] == date and r["shift_type"] in {"day", "night"} and r.get("sap"):
-            old_group[(r["shift_type"], r["sap"])] = (r.get("hala", ""), r.get("group", ""))
-
-    # Remove all day/night rows for this date. Then recreate from picker.
-    kept = [
-        r for r in old_rows
-        if not (r["date"] == date and r["shift_type"] in {"day", "night"})
-    ]
-
-    new_rows = []
-    for shift_type, saps in [("day", day_saps), ("night", night_saps)]:
-        for sap in sorted(saps, key=lambda s: safe_lower(employees.get(s, {}).get("surname", ""))):
-            emp = employees.get(sap)
-            if not emp:
-                continue
-            hala, group = old_group.get((shift_type, sap), ("", ""))
-            new_rows.append(ensure_shift_columns({
-                "date": date,
-                "shift_type": shift_type,
-                "hala": hala,
-                "group": group,
-                "sap": sap,
-                "surname": emp["surname"],
-            }))
+    with table_txn("employees", "shifts"):
+        date = rp.get("date", "")
+        items = rp.get("items", [])
 
-    write_shifts(kept + new_rows)
-    return {"day": len(day_saps), "night": len(night_saps), "total": len(selected_saps)}
+        day_saps = {x["sap"] for x in items if x.get("status") == "day"}
+        night_saps = {x["sap"] for x in items if x.get("status") == "night"}
+        selected_saps = day_saps | night_saps
+
+        employees = {e["sap"]: e for e in read_employees() if e.get("sap")}
+        # Preserve existing HALA/group for same date+shift+sap.
+        old_group = {}
+        for r in read_rows_for_date("shifts", date):
+            if r["shift_type"] in {"day", "night"} and r.get("sap"):
+                old_group[(r["shift_type"], r["sap"])] = (r.get("hala", ""), r.get("group", ""))
+
+        new_rows = []
+        for shift_type, saps in [("day", day_saps), ("night", night_saps)]:
+            for sap in sorted(saps, key=lambda s: safe_lower(employees.get(s, {}).get("surname", ""))):
+                emp = employees.get(sap)
+                if not emp:
+                    continue
+                hala, group = old_group.get((shift_type, sap), ("", ""))
+                new_rows.append(ensure_shift_columns({
+                    "date": date,
+                    "shift_type": shift_type,
+                    "hala": hala,
+                    "group": group,
+                    "sap": sap,
+                    "surname": emp["surname"],
+                }))
+
+        # Remove all day/night rows for this date. Then recreate from picker.
+        change_rows(
+            "shifts",
+            delete_where=[{"date": date, "shift_type": "day"}, {"date": date, "shift_type": "night"}],
+            insert_rows=new_rows,
+        )
+        return {"day": len(day_saps), "night": len(night_saps), "total": len(selected_saps)}
 
 async def send_roster_picker(update: Update, context: ContextTypes.DEFAULT_TYPE, date_str: str):
-    rp = init_roster_picker(context, date_str)
+    rp = await run_disk(init_roster_picker, context, date_str)
     await update.message.reply_text(
         roster_page_text(rp),
         reply_markup=roster_keyboard(rp)
@@ -2162,7 +4493,7 @@ async def roster_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         date = rp.get("date", "")
         chat_id = update.effective_chat.id
         await backup_everywhere(context, chat_id, "pre_inline_roster_save", date)
-        result = apply_roster_picker_to_shifts(rp)
+        result = await run_disk(apply_roster_picker_to_shifts, rp)
         await backup_everywhere(context, chat_id, "after_inline_roster_save", f"{date}: day {result['day']} night {result['night']}")
 
         ud["active_shift"] = {"date": date, "shift_type": "day"}
@@ -2192,7 +4523,7 @@ DEFAULT_WORKPLACES = [
 ]
 
 def init_workplace_picker(context, active: dict):
-    rows = shift_rows_for_active(active, force=True)
+    rows = shift_rows_for_active(active)
     rows = sorted(rows, key=lambda r: safe_lower(r.get("surname", "")))
     wp = {
         "date": active["date"],
@@ -2308,26 +4639,11 @@ def apply_workplace_to_shift(wp: dict, idx: int, hala: str, group: str):
     item["hala"] = hala
     item["group"] = group
 
-    all_rows = read_shifts(force=True)
-    changed = False
-
-    for r in all_rows:
-        if (
-            r["date"] == wp["date"]
-            and r["shift_type"] == wp["shift_type"]
-            and r.get("sap") == item["sap"]
-        ):
-            r["hala"] = hala
-            r["group"] = group
-            r["surname"] = item["surname"]
-            changed = True
-
-    if changed:
-        write_shifts(all_rows)
-    return changed
+    where = {"date": wp["date"], "shift_type": wp["shift_type"], "sap": item["sap"]}
+    return buffer_row_update("shifts", where, {"hala": hala, "group": group, "surname": item["surname"]})
 
 async def send_workplace_picker(update: Update, context: ContextTypes.DEFAULT_TYPE, active: dict):
-    wp = init_workplace_picker(context, active)
+    wp = await run_disk(init_workplace_picker, context, active)
     if not wp.get("items"):
         await update.message.reply_text("У цій зміні ще немає працівників.")
         return
@@ -2361,7 +4677,7 @@ async def workplace_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         hala = parts[3] if len(parts) > 3 else ""
         group = parts[4] if len(parts) > 4 else ""
 
-        apply_workplace_to_shift(wp, idx, hala, group)
+        await run_disk(apply_workplace_to_shift, wp, idx, hala, group)
 
         await query.edit_message_text(
             workplace_page_text(wp),
@@ -2394,7 +4710,7 @@ async def workplace_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if action == "overview":
         active = {"date": wp["date"], "shift_type": wp["shift_type"]}
         await query.edit_message_text(
-            format_groups_overview(active),
+            await run_disk(render_cached, format_groups_overview, active),
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ До списку", callback_data="wp:back:list")]])
         )
         return
@@ -2402,8 +4718,9 @@ async def workplace_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if action == "done":
         active = {"date": wp["date"], "shift_type": wp["shift_type"]}
         ud.pop("workplace_picker", None)
+        await run_disk(flush_pending_updates, "shifts")
         await query.edit_message_text(
-            "✅ Розподіл по робочих місцях завершено.\n\n" + format_groups_overview(active)
+            "✅ Розподіл по робочих місцях завершено.\n\n" + await run_disk(render_cached, format_groups_overview, active)
         )
         return
 
@@ -2462,13 +4779,23 @@ async def cmd_paths(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"DATA_DIR: {DATA_DIR}\n"
         f"employees: {EMPLOYEES_DB_PATH}\n"
         f"local_data: {OLD_LOCAL_DB_PATH}\n"
-        f"shifts: {SHIFTS_DB_PATH}\n"
-        f"performance: {PERF_DB_PATH}\n"
+        f"shifts: {SHIFTS_PARTITION_DIR}/MM partitions\n"
+        f"performance: {PERF_PARTITION_DIR}/MM partitions + {os.path.basename(PERF_JOURNAL_PATH)}\n"
         f"summary: {SHIFT_SUMMARY_DB_PATH}\n"
+        f"storage: {STORAGE_BACKEND}" + (f" ({SQLITE_DB_PATH})" if STORAGE_BACKEND == "sqlite" else "") + "\n"
         f"backups: {BACKUP_DIR}"
     )
     await update.message.reply_text(msg)
 
+async def cmd_iostats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(io_stats_text() + "\n\n" + render_cache_stats_text())
+
+async def cmd_backupstatus(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(await run_disk(backup_upload_status_text))
+
+async def cmd_backups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(await run_disk(backup_retention_text))
+
 async def cmd_ocrtest(update: Update, context: ContextTypes.DEFAULT_TYPE):
     sample = " ".join(context.args) if context.args else ""
     if not sample:
@@ -2491,7 +4818,7 @@ async def cmd_ocrtest(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def employee_flow(update, context, text):
     ud = st(context)
-    rows = read_employees()
+    rows = await run_disk(read_employees)
 
     if ud["mode"] == "add_wait_sap":
         if not re.fullmatch(r"\d{6,12}", text):
@@ -2539,7 +4866,7 @@ async def employee_flow(update, context, text):
             return
         ud["tmp"]["shoe_type"] = safe_lower(text)
         new_emp = ensure_employee_columns(ud["tmp"])
-        write_employees(upsert_employee(rows, new_emp))
+        await run_disk(save_employee, new_emp)
         await backup_everywhere(context, update.effective_chat.id, "add_employee", emp_display(new_emp))
         reset_state(context)
         await show_employee_menu(update, context, f"✅ Додано:\n{emp_display(new_emp)}")
@@ -2555,7 +4882,7 @@ async def employee_flow(update, context, text):
             await update.message.reply_text("Знайдено кілька. Введи точніше або SAP:\n\n" + "\n".join(emp_display(x) for x in matches[:20]))
             return
         reset_state(context)
-        await update.message.reply_text(format_employee_card(matches[0], read_perf(force=True)), reply_markup=EMPLOYEE_KB)
+        await update.message.reply_text(await run_disk(format_employee_card, matches[0]), reply_markup=EMPLOYEE_KB)
         return
 
     if ud["mode"] == "edit_wait_query":
@@ -2632,10 +4959,9 @@ async def employee_flow(update, context, text):
         if text != "-":
             emp["shoe_type"] = safe_lower(text)
 
-        rows2 = upsert_employee(rows, emp)
-        write_employees(rows2)
+        await run_disk(save_employee, emp)
 
-        shift_m, perf_m = migrate_rows_surname_to_sap()
+        shift_m, perf_m = await run_disk(migrate_rows_surname_to_sap)
 
         await backup_everywhere(context, update.effective_chat.id, "edit_employee", f"SAP {emp.get('sap','')}")
         reset_state(context)
@@ -2652,10 +4978,7 @@ async def employee_flow(update, context, text):
             await update.message.reply_text("Знайдено кілька. Введи точніше або SAP:\n\n" + "\n".join(emp_display(x) for x in matches[:20]))
             return
         deleted = matches[0]
-        if deleted.get("sap"):
-            write_employees([r for r in rows if r.get("sap") != deleted["sap"]])
-        else:
-            write_employees([r for r in rows if canonical_name_key(r.get("surname","")) != canonical_name_key(deleted.get("surname",""))])
+        await run_disk(delete_employee, deleted)
         await backup_everywhere(context, update.effective_chat.id, "delete_employee", emp_display(deleted))
         reset_state(context)
         await show_employee_menu(update, context, f"🗑️ Видалено:\n{emp_display(deleted)}")
@@ -2667,9 +4990,7 @@ async def employee_flow(update, context, text):
 
 async def work_flow(update, context, text):
     ud = st(context)
-    employees = read_employees()
-    shifts = read_shifts()
-    perf = read_perf()
+    employees = await run_disk(read_employees)
 
     if ud["mode"] == "work_create_date":
         date = extract_date_from_btn(text)
@@ -2688,7 +5009,7 @@ async def work_flow(update, context, text):
             return
         date = ud["tmp"]["date"]
         ud["active_shift"] = {"date": date, "shift_type": typ}
-        result = create_shift_from_weekly(date, typ)
+        result = await run_disk(create_shift_from_weekly, date, typ)
         if result.get("added"):
             await backup_everywhere(context, update.effective_chat.id, "create_shift_from_weekly", f"{date} {typ}: +{result['added']}")
         reset_state(context)
@@ -2716,7 +5037,7 @@ async def work_flow(update, context, text):
         date = ud["tmp"]["date"]
         ud["active_shift"] = {"date": date, "shift_type": typ}
         reset_state(context)
-        await update.message.reply_text(format_shift(date, typ, read_shifts(True), read_perf(True), read_summary(True)), reply_markup=WORK_KB)
+        await update.message.reply_text(await run_disk(render_cached, format_shift, date, typ), reply_markup=WORK_KB)
         return
 
     if ud["mode"] == "split_wait_date":
@@ -2731,7 +5052,7 @@ async def work_flow(update, context, text):
 
     if ud["mode"] == "split_wait_day_numbers":
         date = ud["tmp"].get("date")
-        employees = sorted_active_employees_for_roster()
+        employees = await run_disk(sorted_active_employees_for_roster)
         selected = parse_number_selection(text, len(employees))
         if not selected:
             await update.message.reply_text("Не бачу номерів. Приклад: 1,2,5-9")
@@ -2741,7 +5062,7 @@ async def work_flow(update, context, text):
         ud["mode"] = "split_wait_night_numbers"
 
         await update.message.reply_text(
-            format_all_employees_numbered_for_roster(date)
+            await run_disk(format_all_employees_numbered_for_roster, date)
             + f"\n\n✅ Day вибрано: {len(selected)}"
             + "\nТепер введи номери працівників для НІЧНОЇ зміни night:"
             + "\nЯкщо нічної немає — введи 0.",
@@ -2751,7 +5072,7 @@ async def work_flow(update, context, text):
 
     if ud["mode"] == "split_wait_night_numbers":
         date = ud["tmp"].get("date")
-        employees = sorted_active_employees_for_roster()
+        employees = await run_disk(sorted_active_employees_for_roster)
 
         if normalize_text(text) in {"0", "-", "нема", "немає"}:
             night_selected = []
@@ -2770,8 +5091,8 @@ async def work_flow(update, context, text):
 
         await backup_everywhere(context, update.effective_chat.id, "pre_split_day_night", f"{date}")
 
-        day_result = set_shift_members_for_date(date, "day", day_selected)
-        night_result = set_shift_members_for_date(date, "night", night_selected_clean)
+        day_result = await run_disk(set_shift_members_for_date, date, "day", day_selected)
+        night_result = await run_disk(set_shift_members_for_date, date, "night", night_selected_clean)
 
         await backup_everywhere(context, update.effective_chat.id, "after_split_day_night", f"{date}: day {day_result['selected']} night {night_result['selected']}")
 
@@ -2806,7 +5127,7 @@ async def work_flow(update, context, text):
             await update.message.reply_text("Обери день тижня кнопкою.", reply_markup=weekly_weekday_kb())
             return
         reset_state(context)
-        wp = init_weekly_picker(context, weekday)
+        wp = await run_disk(init_weekly_picker, context, weekday)
         await update.message.reply_text(weekly_page_text(wp), reply_markup=weekly_keyboard(wp))
         return
 
@@ -2822,7 +5143,7 @@ async def work_flow(update, context, text):
             await update.message.reply_text("Встав список працівників, кожен з нового рядка.")
             return
 
-        result = add_workers_to_shift_unassigned(active, lines, employees)
+        result = await run_disk(add_workers_to_shift_unassigned, active, lines, employees)
         await backup_everywhere(context, update.effective_chat.id, "shift_add_list", f"{active['date']} {active['shift_type']} +{result['added']}")
         reset_state(context)
 
@@ -2867,7 +5188,7 @@ async def work_flow(update, context, text):
         ud["mode"] = "dispatch_wait_numbers"
 
         await update.message.reply_text(
-            format_shift_workers_numbered(active)
+            await run_disk(render_cached, format_shift_workers_numbered, active)
             + "\n\nВведи номери для групи "
             + f"{(hala + '/' if hala else '')}{group}\n"
             + "Приклад: 1,2,5-9",
@@ -2882,7 +5203,7 @@ async def work_flow(update, context, text):
             await show_work_menu(update, context, "Спочатку створи/обери зміну.")
             return
 
-        rows = shift_rows_for_active(active, force=True)
+        rows = await run_disk(shift_rows_for_active, active)
         if not rows:
             reset_state(context)
             await show_work_menu(update, context, "У зміні немає працівників.")
@@ -2895,7 +5216,7 @@ async def work_flow(update, context, text):
 
         hala = ud["tmp"].get("dispatch_hala", "")
         group = ud["tmp"].get("dispatch_group", "")
-        moved = move_selected_workers_to_group(active, selected, hala, group)
+        moved = await run_disk(move_selected_workers_to_group, active, selected, hala, group)
 
         await backup_everywhere(context, update.effective_chat.id, "dispatch_group", f"{active['date']} {active['shift_type']} {hala}/{group} moved {moved}")
         reset_state(context)
@@ -2904,7 +5225,7 @@ async def work_flow(update, context, text):
             update,
             context,
             f"✅ Перенесено в {(hala + '/' if hala else '')}{group}: {moved}\n\n"
-            + format_groups_overview(active)
+            + await run_disk(render_cached, format_groups_overview, active)
         )
         return
 
@@ -2930,65 +5251,9 @@ async def work_flow(update, context, text):
             reset_state(context)
             await show_work_menu(update, context, "Спочатку створи/обери зміну.")
             return
-        emp_by_sap, emp_by_name = build_employee_lookup(employees)
         lines = [normalize_text(x) for x in (update.message.text or "").splitlines() if normalize_text(x)]
-        added, moved, missing, ambiguous = 0, 0, [], []
-        rows = read_shifts(True)
-
-        for line in lines:
-            parsed = parse_sap_name_line(line)
-
-            emp = None
-            if parsed:
-                sap = parsed[0]
-                emp = emp_by_sap.get(sap)
-            elif re.fullmatch(r"\d{6,12}", line):
-                sap = line
-                emp = emp_by_sap.get(sap)
-            else:
-                # allow pure surname/name input
-                key = canonical_name_key(line.upper())
-                emp = emp_by_name.get(key)
-                if not emp:
-                    # partial search fallback
-                    candidates = [e for e in employees if key in canonical_name_key(e.get("surname", ""))]
-                    if len(candidates) == 1:
-                        emp = candidates[0]
-                    elif len(candidates) > 1:
-                        ambiguous.append(line + " → " + ", ".join(emp_display(c) for c in candidates[:5]))
-                        continue
-
-            if not emp or not emp.get("sap"):
-                missing.append(line)
-                continue
-
-            sap = emp["sap"]
-
-            # If this worker already exists in this shift in another group, move them to the new group.
-            found_same_shift = False
-            for r in rows:
-                if r["date"] == active["date"] and r["shift_type"] == active["shift_type"] and r["sap"] == sap:
-                    found_same_shift = True
-                    if r["hala"] != ud["tmp"]["hala"] or r["group"] != ud["tmp"]["group"]:
-                        r["hala"] = ud["tmp"]["hala"]
-                        r["group"] = ud["tmp"]["group"]
-                        r["surname"] = emp["surname"]
-                        moved += 1
-
-            if found_same_shift:
-                continue
-
-            rows.append(ensure_shift_columns({
-                "date": active["date"],
-                "shift_type": active["shift_type"],
-                "hala": ud["tmp"]["hala"],
-                "group": ud["tmp"]["group"],
-                "sap": sap,
-                "surname": emp["surname"],
-            }))
-            added += 1
-
-        write_shifts(rows)
+        res = await run_disk(add_workers_to_group, active, lines, employees, ud["tmp"]["hala"], ud["tmp"]["group"])
+        added, moved, missing, ambiguous = res["added"], res["moved"], res["missing"], res["ambiguous"]
         await backup_everywhere(context, update.effective_chat.id, "shift_add_workers", f"+{added}, moved {moved}")
         reset_state(context)
 
@@ -3023,13 +5288,17 @@ async def work_flow(update, context, text):
         if not parsed:
             await update.message.reply_text("Не знайшов SAP і %. Приклад: 51009998 - 156,44")
             return
-        result = import_percent_rows_by_date(date, parsed)
+        result = await run_disk(import_percent_rows_by_date, date, parsed)
         if result["written_count"]:
             await backup_everywhere(context, update.effective_chat.id, "import_percent_by_date", f"{date}: {result['written_count']}")
         reset_state(context)
         await show_work_menu(update, context, format_import_by_date_report(date, result))
         return
 
+    if ud["mode"] == "import_file_wait_doc":
+        await update.message.reply_text("Надішли CSV або XLSX файлом-документом (колонки date, sap, percent).")
+        return
+
     if ud["mode"] == "import_photo_wait_date":
         date = extract_date_from_btn(text)
         if not parse_ddmmyyyy(date):
@@ -3051,7 +5320,7 @@ async def work_flow(update, context, text):
             await show_work_menu(update, context, "Спочатку створи/обери зміну.")
             return
         emp_by_sap = {e["sap"]: e for e in employees if e["sap"]}
-        shift_rows = [r for r in read_shifts(True) if r["date"] == active["date"] and r["shift_type"] == active["shift_type"]]
+        shift_rows = await run_disk(shift_rows_for_active, active)
         group_by_sap = {r["sap"]: (r["hala"], r["group"]) for r in shift_rows}
         parsed, bad, missing = [], [], []
         for line in (update.message.text or "").splitlines():
@@ -3073,10 +5342,7 @@ async def work_flow(update, context, text):
             return
 
         # replace existing same shift + SAP
-        old = read_perf(True)
-        sap_set = {r["sap"] for r in parsed}
-        kept = [r for r in old if not (r["date"] == active["date"] and r["shift_type"] == active["shift_type"] and r["sap"] in sap_set)]
-        write_perf(kept + [ensure_perf_columns(r) for r in parsed])
+        await run_disk(upsert_rows, "perf", [ensure_perf_columns(r) for r in parsed], PERF_KEY)
         await backup_everywhere(context, update.effective_chat.id, "import_percent", f"{active['date']} {active['shift_type']} записів {len(parsed)}")
         reset_state(context)
 
@@ -3113,12 +5379,9 @@ async def work_flow(update, context, text):
             await update.message.reply_text("Не схоже на число.")
             return
         active = ud.get("active_shift")
-        rows_shift = [r for r in read_shifts(True) if r["date"] == active["date"] and r["shift_type"] == active["shift_type"] and r["hala"] == ud["tmp"]["hala"] and r["group"] == ud["tmp"]["group"]]
-        old = read_perf(True)
-        sap_set = {r["sap"] for r in rows_shift}
-        kept = [r for r in old if not (r["date"] == active["date"] and r["shift_type"] == active["shift_type"] and r["sap"] in sap_set)]
-        new = [{"date": active["date"], "shift_type": active["shift_type"], "hala": r["hala"], "group": r["group"], "sap": r["sap"], "surname": r["surname"], "percent": str(p)} for r in rows_shift]
-        write_perf(kept + new)
+        rows_shift = [r for r in await run_disk(shift_rows_for_active, active) if r["hala"] == ud["tmp"]["hala"] and r["group"] == ud["tmp"]["group"]]
+        new = [ensure_perf_columns({"date": active["date"], "shift_type": active["shift_type"], "hala": r["hala"], "group": r["group"], "sap": r["sap"], "surname": r["surname"], "percent": str(p)}) for r in rows_shift]
+        await run_disk(upsert_rows, "perf", new, PERF_KEY)
         await backup_everywhere(context, update.effective_chat.id, "group_percent", f"{ud['tmp']['hala']}/{ud['tmp']['group']}={p}")
         reset_state(context)
         await show_work_menu(update, context, f"✅ Записано {fmt_percent(p)}% для {len(new)} працівників.")
@@ -3127,19 +5390,25 @@ async def work_flow(update, context, text):
     if ud["mode"] == "ocr_preview_wait_confirm":
         if is_btn(text, BTN_CONFIRM_SAVE_IMPORT) or safe_lower(text) in {"так", "yes", "save"}:
             pending = ud.get("pending_ocr_import") or {}
-            rows_to_save = pending.get("preview") or []
             date = pending.get("date", "")
-            if not rows_to_save:
+            if not pending.get("rows"):
                 reset_state(context)
                 ud.pop("pending_ocr_import", None)
                 await show_work_menu(update, context, "❌ Немає рядків для збереження.")
                 return
             await backup_everywhere(context, update.effective_chat.id, "pre_ocr_save", f"{date}: before save")
-            count = save_import_preview_rows(rows_to_save)
+            result = await run_disk(commit_percent_import, pending)
+            count = result["written_count"]
             await backup_everywhere(context, update.effective_chat.id, "after_ocr_save", f"{date}: saved {count}")
             reset_state(context)
             ud.pop("pending_ocr_import", None)
-            await show_work_menu(update, context, f"✅ OCR збережено. Записано: {count}")
+            msg = f"✅ OCR збережено. Записано: {count}"
+            if result["replanned"]:
+                msg += (
+                    "\n⚠️ Зміни за цю дату змінились після перегляду — рядки перераховано."
+                    f"\nБез зміни: {len(result['missing'])}, і day, і night: {len(result['ambiguous'])}, немає в базі: {len(result['unknown_sap'])}"
+                )
+            await show_work_menu(update, context, msg)
             return
 
         if is_btn(text, BTN_CANCEL_IMPORT) or safe_lower(text) in {"ні", "no", "cancel"}:
@@ -3173,7 +5442,7 @@ async def work_flow(update, context, text):
             return
         date = ud["tmp"].get("date")
         await backup_everywhere(context, update.effective_chat.id, "pre_clear_percent", f"{date}")
-        removed = clear_percent_for_date(date)
+        removed = await run_disk(clear_percent_for_date, date)
         await backup_everywhere(context, update.effective_chat.id, "after_clear_percent", f"{date}: removed {removed}")
         reset_state(context)
         await show_work_menu(update, context, f"🧹 Очищено % за {date}. Видалено записів: {removed}")
@@ -3189,7 +5458,7 @@ async def work_flow(update, context, text):
                 return
             month = dt.strftime("%m.%Y")
         reset_state(context)
-        await update.message.reply_text(format_sorted_workers(read_perf(True), month), reply_markup=WORK_KB)
+        await update.message.reply_text(await run_disk(format_sorted_workers, month), reply_markup=WORK_KB)
         return
 
     if ud["mode"] == "work_export_date":
@@ -3208,11 +5477,10 @@ async def work_flow(update, context, text):
             await update.message.reply_text("Обери day або night.")
             return
         date = ud["tmp"]["date"]
-        content = format_shift(date, typ, read_shifts(True), read_perf(True), read_summary(True))
+        content = await run_disk(render_cached, format_shift, date, typ)
         filename = f"shift_{date.replace('.','-')}_{typ}.txt"
         path = os.path.join(BACKUP_DIR, filename)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(content + "\n")
+        await run_disk(write_text_file, path, content + "\n")
         reset_state(context)
         await context.bot.send_document(update.effective_chat.id, document=InputFile(path, filename=filename), caption="📝 Експорт зміни")
         await show_work_menu(update, context, "Готово ✅")
@@ -3253,11 +5521,8 @@ async def work_flow(update, context, text):
         if p is None:
             await update.message.reply_text("Не схоже на число.")
             return
-        rows = read_summary(True)
         date, typ = ud["tmp"]["date"], ud["tmp"]["shift_type"]
-        rows = [r for r in rows if not (r["date"] == date and r["shift_type"] == typ)]
-        rows.append(ensure_summary_columns({"date": date, "shift_type": typ, "total_percent": ud["tmp"]["total_percent"], "agency_percent": str(p)}))
-        write_summary(rows)
+        await run_disk(upsert_rows, "summary", [ensure_summary_columns({"date": date, "shift_type": typ, "total_percent": ud["tmp"]["total_percent"], "agency_percent": str(p)})], SUMMARY_KEY)
         await backup_everywhere(context, update.effective_chat.id, "summary", f"{date} {typ}")
         reset_state(context)
         await show_work_menu(update, context, "✅ % по зміні збережено.")
@@ -3284,7 +5549,28 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if ud["mode"] == "restore_wait_file":
-        await update.message.reply_text("Надішли CSV або ZIP файлом-документом.")
+        when = parse_restore_moment(text)
+        if not when:
+            await update.message.reply_text("Надішли CSV або ZIP файлом-документом, або дату DD.MM.YYYY HH:MM.")
+            return
+        await backup_everywhere(context, update.effective_chat.id, "pre_restore")
+        try:
+            manifest, result = await run_disk(restore_tables_as_of, when)
+        except Exception as e:
+            await update.message.reply_text(f"❌ Помилка відновлення: {e}")
+            return
+        if manifest is None:
+            await update.message.reply_text(f"Немає локальних backup на {when.strftime('%d.%m.%Y %H:%M')} або раніше.")
+            return
+        restored, converted_count, merge_info = result
+        shift_m, perf_m = await run_disk(migrate_rows_surname_to_sap)
+        await backup_everywhere(context, update.effective_chat.id, "after_restore", f"стан на {manifest['ts']}")
+        reset_state(context); set_menu(context, "main")
+        await show_main_menu(
+            update, context,
+            f"♻️ Відновлено стан на {manifest['ts']} ({manifest['reason']}) ✅\n"
+            + zip_restore_report(restored, converted_count, merge_info, shift_m, perf_m),
+        )
         return
 
     if ud["mode"]:
@@ -3315,7 +5601,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if is_btn(text, "Seed SAP"):
         await backup_everywhere(context, update.effective_chat.id, "pre_seed_sap")
-        count = merge_seed_sap()
+        count = await run_disk(merge_seed_sap)
         await backup_everywhere(context, update.effective_chat.id, "after_seed_sap")
         await show_main_menu(update, context, f"🧬 Seed SAP завершено ✅\nЗаписів у базі: {count}")
         return
@@ -3324,14 +5610,17 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ud["mode"] = "restore_wait_file"
         ud["tmp"] = {}
         set_menu(context, "main")
-        await update.message.reply_text("Надішли ZIP backup або employees.csv файлом.")
+        await update.message.reply_text(
+            "Надішли ZIP backup або employees.csv файлом.\n"
+            "Або введи дату й час DD.MM.YYYY HH:MM — відновлю стан з локальних backup на той момент."
+        )
         return
 
     # employee menu
     if ud["menu"] == "employee":
-        rows = read_employees()
+        rows = await run_disk(read_employees)
         if is_btn(text, "Статистика"):
-            await update.message.reply_text(format_stats(rows), reply_markup=EMPLOYEE_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_stats, rows), reply_markup=EMPLOYEE_KB); return
         if is_btn(text, "Всі"):
             msg, kb = employee_list_page(rows, 0)
             await update.message.reply_text(msg, reply_markup=kb); return
@@ -3339,15 +5628,15 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ud["mode"] = "card_wait_query"; ud["tmp"] = {}
             await update.message.reply_text("Введи SAP або частину прізвища:", reply_markup=ReplyKeyboardMarkup([[BTN_CANCEL]], resize_keyboard=True)); return
         if is_btn(text, "Без SAP"):
-            await update.message.reply_text(format_no_sap(rows), reply_markup=EMPLOYEE_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_no_sap, rows), reply_markup=EMPLOYEE_KB); return
         if is_btn(text, "З шафкою"):
-            await update.message.reply_text(format_with_locker(rows), reply_markup=EMPLOYEE_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_with_locker, rows), reply_markup=EMPLOYEE_KB); return
         if is_btn(text, "Без шафки"):
-            await update.message.reply_text(format_no_locker(rows), reply_markup=EMPLOYEE_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_no_locker, rows), reply_markup=EMPLOYEE_KB); return
         if is_btn(text, "З ножем"):
-            await update.message.reply_text(format_with_knife(rows), reply_markup=EMPLOYEE_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_with_knife, rows), reply_markup=EMPLOYEE_KB); return
         if is_btn(text, "Без ножа"):
-            await update.message.reply_text(format_no_knife(rows), reply_markup=EMPLOYEE_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_no_knife, rows), reply_markup=EMPLOYEE_KB); return
         if is_btn(text, "Додати працівника"):
             ud["mode"] = "add_wait_sap"; ud["tmp"] = {}
             await update.message.reply_text("Введи SAP:", reply_markup=ReplyKeyboardMarkup([[BTN_CANCEL]], resize_keyboard=True)); return
@@ -3393,13 +5682,13 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             active = ud.get("active_shift")
             if not active:
                 await show_work_menu(update, context, "Спочатку створи/обери зміну."); return
-            await update.message.reply_text(format_shift_workers_numbered(active), reply_markup=WORK_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_shift_workers_numbered, active), reply_markup=WORK_KB); return
 
         if is_btn(text, "Розподіл"):
             active = ud.get("active_shift")
             if not active:
                 await show_work_menu(update, context, "Спочатку створи/обери зміну."); return
-            if not shift_rows_for_active(active, force=True):
+            if not await run_disk(shift_rows_for_active, active):
                 await show_work_menu(update, context, "У зміні немає працівників. Спочатку зроби 🗓 Розподіл day/night або додай список у зміну."); return
             reset_state(context)
             await send_workplace_picker(update, context, active); return
@@ -3408,13 +5697,20 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             active = ud.get("active_shift")
             if not active:
                 await show_work_menu(update, context, "Спочатку створи/обери зміну."); return
-            await update.message.reply_text(format_groups_overview(active), reply_markup=WORK_KB); return
+            await update.message.reply_text(await run_disk(render_cached, format_groups_overview, active), reply_markup=WORK_KB); return
 
         if is_btn(text, "Додати працівників"):
             if not ud.get("active_shift"):
                 await show_work_menu(update, context, "Спочатку створи/обери зміну."); return
             ud["mode"] = "work_add_hala"; ud["tmp"] = {}
             await update.message.reply_text("Обери зал:", reply_markup=hala_kb()); return
+        if is_btn(text, BTN_IMPORT_FILE):
+            ud["mode"] = "import_file_wait_doc"; ud["tmp"] = {}
+            await update.message.reply_text(
+                "Надішли CSV або XLSX з колонками date, sap, percent — можна за багато дат одразу.\n"
+                "Бот сам знайде SAP у day/night на кожну дату. Приклад рядка:\n16.10.2026;51009998;156,44",
+                reply_markup=ReplyKeyboardMarkup([[BTN_CANCEL]], resize_keyboard=True)
+            ); return
         if is_btn(text, "Імпорт %"):
             ud["mode"] = "import_by_date_wait_date"; ud["tmp"] = {}
             await update.message.reply_text("Обери дату для імпорту %:", reply_markup=date_kb()); return
@@ -3454,78 +5750,154 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # DOCUMENT RESTORE
 # ==============================
 
-async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ud = st(context)
-    if ud["mode"] != "restore_wait_file":
-        await update.message.reply_text("Файл отримав, але зараз не режим відновлення. Натисни ♻️ Відновити з файлу.")
-        return
-
-    doc: Document = update.message.document
-    fname = doc.file_name or ""
-    low = fname.lower()
-    if not (low.endswith(".csv") or low.endswith(".zip")):
-        await update.message.reply_text("Потрібен CSV або ZIP.")
-        return
-
-    await backup_everywhere(context, update.effective_chat.id, "pre_restore")
-    file = await doc.get_file()
-    content = await file.download_as_bytearray()
+# Columns a restored CSV must have; anything else is filled with defaults by ensure_*_columns.
+RESTORE_REQUIRED_COLUMNS = {
+    "employees": ["surname"],
+    "shifts": ["date", "shift_type", "sap"],
+    "perf": ["date", "sap", "percent"],
+    "summary": ["date", "shift_type"],
+    "weekly": ["weekday", "sap"],
+    None: ["surname"],  # local_data.csv
+}
+
+def validate_restore_csv(path: str, required: list) -> int:
+    """Streaming check of a staged CSV: UTF-8, required header columns, every row as wide as the header."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            raise ValueError("порожній файл")
+        missing = [c for c in required if c not in header]
+        if missing:
+            raise ValueError("немає колонок " + ", ".join(missing))
+        rows = 0
+        for row in reader:
+            if row and len(row) != len(header):
+                raise ValueError(f"рядок {reader.line_num}: {len(row)} полів замість {len(header)}")
+            rows += 1
+    return rows
 
-    if low.endswith(".zip"):
-        try:
-            with zipfile.ZipFile(io.BytesIO(bytes(content))) as z:
-                restored = []
-                wanted = [
-                    os.path.basename(EMPLOYEES_DB_PATH),
-                    os.path.basename(OLD_LOCAL_DB_PATH),
-                    os.path.basename(SHIFTS_DB_PATH),
-                    os.path.basename(PERF_DB_PATH),
-                    os.path.basename(SHIFT_SUMMARY_DB_PATH),
-                    os.path.basename(WEEKLY_SHIFT_DB_PATH),
-                ]
-                for target in wanted:
-                    if extract_named_file_from_zip(z, target, DATA_DIR):
-                        restored.append(target)
-
-                converted_count = 0
-                merge_info = None
-
-                # If local_data.csv exists in ZIP, it is the source of truth for locker/knife.
-                if os.path.basename(OLD_LOCAL_DB_PATH) in restored:
-                    if os.path.basename(EMPLOYEES_DB_PATH) not in restored:
-                        converted_count = convert_local_data_to_employees_if_possible()
-                    merge_info = merge_local_data_into_employees_if_possible()
-                elif os.path.basename(EMPLOYEES_DB_PATH) not in restored:
+def swap_in_restored_files(staging: str, staged: list):
+    """
+    Load every validated file into live storage. The current tables are exported first, so if any load
+    fails every table already replaced is put back and the error is raised.
+    """
+    rollback = os.path.join(staging, "rollback")
+    os.makedirs(rollback)
+    saved = []
+    for target in staged:
+        name = table_name_for_basename(target)
+        live = os.path.join(DATA_DIR, target)
+        if name:
+            export_table_to_csv(name, os.path.join(rollback, target))
+        elif os.path.exists(live):
+            shutil.copy2(live, os.path.join(rollback, target))
+    try:
+        for target in staged:
+            name = table_name_for_basename(target)
+            saved.append(target)
+            if name:
+                import_table_from_csv(name, os.path.join(staging, target))
+            else:
+                os.replace(os.path.join(staging, target), os.path.join(DATA_DIR, target))
+    except Exception:
+        for target in saved:
+            name = table_name_for_basename(target)
+            kept = os.path.join(rollback, target)
+            if name:
+                import_table_from_csv(name, kept)
+            elif os.path.exists(kept):
+                os.replace(kept, os.path.join(DATA_DIR, target))
+            elif os.path.exists(os.path.join(DATA_DIR, target)):
+                os.remove(os.path.join(DATA_DIR, target))
+        invalidate_table_caches()
+        raise
+
+def restore_tables_from_zip(source) -> tuple:
+    """
+    Restore known tables from a backup ZIP (path or file object). Members are extracted in chunks into a
+    staging dir and validated before anything live is touched. Returns (restored, converted_count, merge_info).
+    """
+    wanted = [
+        os.path.basename(EMPLOYEES_DB_PATH),
+        os.path.basename(OLD_LOCAL_DB_PATH),
+        os.path.basename(SHIFTS_DB_PATH),
+        os.path.basename(PERF_DB_PATH),
+        os.path.basename(SHIFT_SUMMARY_DB_PATH),
+        os.path.basename(WEEKLY_SHIFT_DB_PATH),
+    ]
+    staging = tempfile.mkdtemp(prefix="restore-", dir=DATA_DIR)
+    try:
+        with zipfile.ZipFile(source) as z:
+            restored = [target for target in wanted if extract_named_file_from_zip(z, target, staging)]
+        for target in restored:
+            try:
+                validate_restore_csv(os.path.join(staging, target), RESTORE_REQUIRED_COLUMNS[table_name_for_basename(target)])
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                raise ValueError(f"{target}: {e}. Нічого не змінено.")
+
+        with table_txn(*TABLE_NAMES):
+            swap_in_restored_files(staging, restored)
+
+            converted_count = 0
+            merge_info = None
+
+            # If local_data.csv exists in ZIP, it is the source of truth for locker/knife.
+            if os.path.basename(OLD_LOCAL_DB_PATH) in restored:
+                if os.path.basename(EMPLOYEES_DB_PATH) not in restored:
                     converted_count = convert_local_data_to_employees_if_possible()
-
-                # If ZIP had neither useful employees.csv nor local_data.csv, at least seed SAP list.
-                if not os.path.exists(EMPLOYEES_DB_PATH) or len(read_employees(force=True)) == 0:
-                    converted_count = merge_seed_sap()
-
-                _employee_cache["mtime"] = _shift_cache["mtime"] = _perf_cache["mtime"] = _summary_cache["mtime"] = None
-
-            reset_state(context); set_menu(context, "main")
-            msg = "♻️ Відновлено з ZIP ✅\n" + ", ".join(restored)
-            shift_m, perf_m = migrate_rows_surname_to_sap()
-            if converted_count:
-                msg += f"\n👤 employees.csv створено/оновлено: {converted_count}"
-            if merge_info:
-                msg += f"\n🔁 local_data.csv підтягнуто: {merge_info['matched']} працівників"
-                msg += f"\n🗄️ Шафки: {merge_info['locker']} | 🔪 Ножі: {merge_info['knife']}"
-            if shift_m or perf_m:
-                msg += f"\n🔗 SAP підтягнуто: зміни {shift_m}, продуктивність {perf_m}"
-            if os.path.basename(OLD_LOCAL_DB_PATH) not in restored:
-                msg += "\n⚠️ У цьому ZIP немає local_data.csv — шафки/ножі з нього відновити неможливо."
-            await show_main_menu(update, context, msg)
-        except Exception as e:
-            await update.message.reply_text(f"❌ Помилка ZIP: {e}")
-        return
-
-    text = content.decode("utf-8", errors="replace")
-    reader = csv.DictReader(StringIO(text))
-    raw_rows = list(reader)
+                merge_info = merge_local_data_into_employees_if_possible()
+            elif os.path.basename(EMPLOYEES_DB_PATH) not in restored:
+                converted_count = convert_local_data_to_employees_if_possible()
+
+            # Restored files changed behind the caches' back: drop them once, then read normally.
+            invalidate_table_caches()
+
+            # If ZIP had neither useful employees.csv nor local_data.csv, at least seed SAP list.
+            if not os.path.exists(EMPLOYEES_DB_PATH) or len(read_employees()) == 0:
+                converted_count = merge_seed_sap()
+        return restored, converted_count, merge_info
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def restore_tables_as_of(when: datetime):
+    """Rebuild the tables as they were in the newest local backup taken at or before `when`."""
+    manifest = backup_manifest_as_of(when)
+    if manifest is None:
+        return None, None
+    fd, zip_path = tempfile.mkstemp(prefix="restore-", suffix=".zip", dir=DATA_DIR)
+    os.close(fd)
+    try:
+        backup_zip_from_manifest(manifest, zip_path)
+        return manifest, restore_tables_from_zip(zip_path)
+    finally:
+        os.remove(zip_path)
+
+def parse_restore_moment(text: str):
+    """DD.MM.YYYY HH:MM or DD.MM.YYYY (end of that day)."""
+    text = normalize_text(text)
+    try:
+        return datetime.strptime(text, "%d.%m.%Y %H:%M")
+    except ValueError:
+        day = parse_ddmmyyyy(text)
+        return day.replace(hour=23, minute=59, second=59) if day else None
+
+def zip_restore_report(restored: list, converted_count: int, merge_info, shift_m: int, perf_m: int) -> str:
+    msg = ", ".join(restored)
+    if converted_count:
+        msg += f"\n👤 employees.csv створено/оновлено: {converted_count}"
+    if merge_info:
+        msg += f"\n🔁 local_data.csv підтягнуто: {merge_info['matched']} працівників"
+        msg += f"\n🗄️ Шафки: {merge_info['locker']} | 🔪 Ножі: {merge_info['knife']}"
+    if shift_m or perf_m:
+        msg += f"\n🔗 SAP підтягнуто: зміни {shift_m}, продуктивність {perf_m}"
+    return msg
+
+def restore_employees_from_csv(path: str) -> list:
     seed = {safe_lower(e["surname"]): e for e in seed_sap_rows()}
     rows = []
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as f:
+        raw_rows = list(csv.DictReader(f))
     for r in raw_rows:
         emp = ensure_employee_columns(r)
         if not emp["sap"] and safe_lower(emp["surname"]) in seed:
@@ -3542,6 +5914,75 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rows.append(emp)
     rows = [r for r in rows if r["surname"] or r["sap"]]
     write_employees(rows)
+    return rows
+
+async def import_percent_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    doc: Document = update.message.document
+    low = (doc.file_name or "").lower()
+    if not (low.endswith(".csv") or low.endswith(".xlsx")):
+        await update.message.reply_text("Потрібен CSV або XLSX.")
+        return
+
+    file = await doc.get_file()
+    fd, upload_path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(low)[1], dir=DATA_DIR)
+    os.close(fd)
+    try:
+        await file.download_to_drive(custom_path=upload_path)
+        await backup_everywhere(context, update.effective_chat.id, "pre_import_file", low)
+        try:
+            result = await run_disk(import_percent_file, upload_path, low)
+        except Exception as e:
+            await update.message.reply_text(f"❌ Помилка файлу: {e}")
+            return
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+    if result["written_count"]:
+        await backup_everywhere(context, update.effective_chat.id, "import_percent_file", f"{low}: {result['written_count']}")
+    reset_state(context)
+    await show_work_menu(update, context, format_percent_file_report(result))
+
+async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ud = st(context)
+    if ud["mode"] == "import_file_wait_doc":
+        await import_percent_document(update, context)
+        return
+    if ud["mode"] != "restore_wait_file":
+        await update.message.reply_text("Файл отримав, але зараз не режим відновлення. Натисни ♻️ Відновити з файлу.")
+        return
+
+    doc: Document = update.message.document
+    fname = doc.file_name or ""
+    low = fname.lower()
+    if not (low.endswith(".csv") or low.endswith(".zip")):
+        await update.message.reply_text("Потрібен CSV або ZIP.")
+        return
+
+    await backup_everywhere(context, update.effective_chat.id, "pre_restore")
+    file = await doc.get_file()
+    # Straight to disk: a year of history in a ZIP should not sit in memory.
+    fd, upload_path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(low)[1], dir=DATA_DIR)
+    os.close(fd)
+    try:
+        await file.download_to_drive(custom_path=upload_path)
+
+        if low.endswith(".zip"):
+            try:
+                restored, converted_count, merge_info = await run_disk(restore_tables_from_zip, upload_path)
+                reset_state(context); set_menu(context, "main")
+                shift_m, perf_m = await run_disk(migrate_rows_surname_to_sap)
+                msg = "♻️ Відновлено з ZIP ✅\n" + zip_restore_report(restored, converted_count, merge_info, shift_m, perf_m)
+                if os.path.basename(OLD_LOCAL_DB_PATH) not in restored:
+                    msg += "\n⚠️ У цьому ZIP немає local_data.csv — шафки/ножі з нього відновити неможливо."
+                await show_main_menu(update, context, msg)
+            except Exception as e:
+                await update.message.reply_text(f"❌ Помилка ZIP: {e}")
+            return
+
+        rows = await run_disk(restore_employees_from_csv, upload_path)
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
     await backup_everywhere(context, update.effective_chat.id, "after_restore", f"Працівників: {len(rows)}")
     reset_state(context); set_menu(context, "main")
     await show_main_menu(update, context, f"♻️ employees.csv відновлено ✅\nЗаписів: {len(rows)}")
@@ -3550,6 +5991,8 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # PHOTO PLACEHOLDER
 # ==============================
 
+_albums = {}  # (chat_id, media_group_id) -> {"photos": [(message_id, photo)], "update", "context", "last", "task"}
+
 async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ud = st(context)
     if ud.get("mode") != "import_photo_wait_photo":
@@ -3565,7 +6008,7 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_work_menu(update, context, "❌ Дата не вибрана. Почни фото-імпорт ще раз.")
         return
 
-    if not OCR_SPACE_API_KEY:
+    if not get_ocr_provider().available():
         await update.message.reply_text(
             "⚠️ Фото-імпорт потребує OCR_SPACE_API_KEY у Render Environment.\n\n"
             "Поки зроби так: відкрий фото → скопіюй/набери рядки SAP - % і використай 📥 Імпорт % за датою.\n"
@@ -3573,16 +6016,57 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    group_id = update.message.media_group_id
+    if not group_id:
+        await import_photos(update, context, [update.message.photo[-1]])
+        return
+
+    # Album: Telegram delivers every photo as its own update; collect them, import once.
+    key = (update.effective_chat.id, group_id)
+    loop = asyncio.get_running_loop()
+    album = _albums.get(key)
+    if album is None:
+        album = _albums[key] = {"photos": [], "update": update, "context": context}
+        album["task"] = asyncio.create_task(collect_album(key))
+    album["photos"].append((update.message.message_id, update.message.photo[-1]))
+    album["last"] = loop.time()
+
+async def collect_album(key):
+    album = _albums[key]
+    loop = asyncio.get_running_loop()
+    while (wait := album["last"] + ALBUM_COLLECT_SEC - loop.time()) > 0:
+        await asyncio.sleep(wait)
+    _albums.pop(key, None)
+    photos = [photo for _, photo in sorted(album["photos"], key=lambda x: x[0])]
+    await import_photos(album["update"], album["context"], photos)
+
+async def import_photos(update, context, photos: list):
+    """OCR one or more photos for the chosen date (bounded concurrency), merge by SAP, show one preview."""
+    ud = st(context)
+    date = ud["tmp"].get("date")
     try:
-        await update.message.reply_text("📸 Фото отримав. Розпізнаю OCR...")
-        photo = update.message.photo[-1]
-        tg_file = await photo.get_file()
-        content = await tg_file.download_as_bytearray()
-        ocr_text = ocr_space_image_bytes(bytes(content), "telegram_photo.jpg")
-        parsed = parse_sap_percent_from_text(ocr_text)
+        if len(photos) == 1:
+            await update.message.reply_text("📸 Фото отримав. Розпізнаю OCR...")
+        else:
+            await update.message.reply_text(f"📸 Отримав альбом: {len(photos)} фото. Розпізнаю OCR...")
+
+        limit = asyncio.Semaphore(OCR_CONCURRENCY)
+
+        async def recognize_limited(photo):
+            async with limit:
+                return await recognize_photo(photo)
+
+        results = await asyncio.gather(*(recognize_limited(p) for p in photos), return_exceptions=True)
+        errors = [f"фото {i}: {r}" for i, r in enumerate(results, start=1) if isinstance(r, Exception)]
+        recognized = [r for r in results if not isinstance(r, Exception)]
+        if not recognized:
+            raise RuntimeError("; ".join(errors))
+        ocr_texts = [text for text, _ in recognized]
+        cached = sum(1 for _, from_cache in recognized if from_cache)
+        parsed, conflicts = merge_parsed_rows([parse_sap_percent_from_text(t) for t in ocr_texts])
 
         if not parsed:
-            preview = (ocr_text or "").strip()
+            preview = "\n".join(ocr_texts).strip()
             if len(preview) > 700:
                 preview = preview[:700] + "\n..."
             await update.message.reply_text(
@@ -3593,7 +6077,7 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        preview_result = build_import_preview_by_date(date, parsed)
+        preview_result = await run_disk(plan_percent_import, date, parsed)
 
         ud["pending_ocr_import"] = preview_result
         ud["mode"] = "ocr_preview_wait_confirm"
@@ -3603,7 +6087,19 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [[BTN_CONFIRM_SAVE_IMPORT, BTN_CANCEL_IMPORT], [BTN_BACK]],
             resize_keyboard=True
         )
-        await update.message.reply_text(format_import_preview_report(preview_result), reply_markup=kb)
+        notes = []
+        if len(photos) > 1:
+            notes.append(f"🖼️ Фото: {len(photos)}, розпізнано: {len(recognized)}, унікальних SAP: {len(parsed)}")
+        if cached:
+            notes.append("♻️ Це фото вже розпізнавалось — OCR взято з кешу." if len(photos) == 1 else f"♻️ З кешу OCR: {cached}")
+        if errors:
+            notes.append("⚠️ Не розпізнано — " + "; ".join(errors))
+        if conflicts:
+            notes.append("⚠️ Різні % для одного SAP (взято з першого фото):\n" + "\n".join(conflicts[:10]))
+        report = format_import_preview_report(preview_result)
+        if notes:
+            report = "\n".join(notes) + "\n\n" + report
+        await update.message.reply_text(report, reply_markup=kb)
 
     except Exception as e:
         await update.message.reply_text(f"❌ Помилка OCR: {e}\n\nМожеш вставити ці дані текстом через 📥 Імпорт % за датою.")
@@ -3612,23 +6108,42 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # MAIN
 # ==============================
 
+async def on_app_stop(app):
+    await stop_backup_uploader(app)
+    await close_ocr_provider()
+
 def main():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN is missing")
 
     copy_legacy_root_files_to_data_if_needed()
+    migrate_single_files_to_partitions()
+    repartition_undated_rows()
+    migrate_csv_to_sqlite_if_needed()
     migrate_old_local_if_needed()
     ensure_all_files()
+    start_perf_compactor()
+    start_backup_evictor()
     try:
         migrate_rows_surname_to_sap()
     except Exception as e:
         print(f"Migration warning: {e}")
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(start_backup_uploader)
+        .post_stop(on_app_stop)
+        .build()
+    )
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("chatid", cmd_chatid))
     app.add_handler(CommandHandler("paths", cmd_paths))
     app.add_handler(CommandHandler("ocrtest", cmd_ocrtest))
+    app.add_handler(CommandHandler("iostats", cmd_iostats))
+    app.add_handler(CommandHandler("backupstatus", cmd_backupstatus))
+    app.add_handler(CommandHandler("backups", cmd_backups))
     app.add_handler(CallbackQueryHandler(employee_callback, pattern=r"^emp:"))
     app.add_handler(CallbackQueryHandler(weekly_callback, pattern=r"^weekly:"))
     app.add_handler(CallbackQueryHandler(roster_callback, pattern=r"^roster:"))